@@ -0,0 +1,234 @@
+# Offline micro/macro benchmarks for the record conversion hot paths. No network or iLevel
+#  credentials are needed: inputs come from benchmarks.synthetic.
+#
+# Usage:
+#   python -m benchmarks.bench --scale 1000,10000 --output bench.json
+#   python -m benchmarks.bench --scale 10000 --compare bench.json --filter process_records
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from suds.sax.parser import Parser
+
+from benchmarks import synthetic
+from tap_ilevel import SoapFixer
+from tap_ilevel.discover import discover
+from tap_ilevel.ilevel_api import sobject_to_dict, get_periodic_data_rows
+from tap_ilevel.transform import transform_json, hash_data
+import tap_ilevel.singer_operations as singer_ops
+
+# tap_ilevel/__init__ re-exports sync(), which shadows the tap_ilevel.sync module attribute
+process_records = sys.modules['tap_ilevel.sync'].process_records
+
+CASES = {}
+
+
+# Register a case: setup(scale) is called before each repeat (untimed) and returns the callable
+#  to time.
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@contextmanager
+def stdout_to_devnull():
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def selected_catalog():
+    catalog = discover()
+    for stream in catalog.streams:
+        for entry in stream.metadata:
+            if entry['breadcrumb'] == ():
+                entry['metadata']['selected'] = True
+    return catalog
+
+
+def request_state(stream_name, catalog, bookmark_field):
+    return singer_ops.get_request_state(
+        client=None, stream_name=stream_name, start_date='2000-01-01', last_date='2000-01-01',
+        end_date=datetime.utcnow(), state={}, bookmark_field=bookmark_field, id_fields=['id'],
+        period_types='FiscalQuarter', stream=catalog.get_stream(stream_name), catalog=catalog)
+
+
+@case('sobject_to_dict.data_value')
+def _sobject_to_dict_data_value(scale):
+    objects = synthetic.make_data_values(scale)
+    return lambda: [sobject_to_dict(obj) for obj in objects]
+
+
+def _entity_setup(kind):
+    def setup(scale):
+        objects = synthetic.make_entities(kind, scale)
+        return lambda: [sobject_to_dict(obj) for obj in objects]
+    return setup
+
+
+for _kind in synthetic.ENTITY_KINDS:
+    case('sobject_to_dict.{}'.format(_kind))(_entity_setup(_kind))
+
+
+@case('transform_json.investment_transaction')
+def _transform_json(scale):
+    records = [sobject_to_dict(obj)
+               for obj in synthetic.make_entities('investment_transaction', scale)]
+    return lambda: transform_json(records)
+
+
+@case('hash_data.dimensions')
+def _hash_data(scale):
+    dimensions = [json.dumps({'data_item_id': index, 'entity_id': index * 7, 'scenario_id': 1,
+                              'period_type': 'FiscalQuarter', 'currency_code': 'USD'},
+                             sort_keys=True) for index in range(scale)]
+    return lambda: [hash_data(dims) for dims in dimensions]
+
+
+@case('periodic_rows.data_value')
+def _periodic_rows(scale):
+    objects = synthetic.make_data_values(scale)
+    return lambda: [get_periodic_data_rows(obj, 'benchmark') for obj in objects]
+
+
+@case('process_records.periodic_data_standardized')
+def _process_records_periodic(scale):
+    catalog = selected_catalog()
+    req_state = request_state('periodic_data_standardized', catalog, 'reported_date_value')
+    rows = []
+    for obj in synthetic.make_data_values(scale):
+        rows.extend(get_periodic_data_rows(obj, 'benchmark'))
+
+    def run():
+        with stdout_to_devnull():
+            process_records(rows, req_state)
+    return run
+
+
+@case('process_records.assets')
+def _process_records_assets(scale):
+    catalog = selected_catalog()
+    req_state = request_state('assets', catalog, 'last_modified_date')
+    records = [sobject_to_dict(obj) for obj in synthetic.make_entities('asset', scale)]
+
+    def run():
+        with stdout_to_devnull():
+            process_records(records, req_state)
+    return run
+
+
+@case('soap_fixer.marshal_igetbatch')
+def _soap_fixer(scale):
+    params = ''.join(
+        '<BaseRequestParameters><DataItemId>{0}</DataItemId><DataValueType>Numeric</DataValueType>'
+        '<EntitiesPath><Path><int>{0}</int></Path></EntitiesPath><RequestIdentifier>{0}'
+        '</RequestIdentifier><ScenarioId>1</ScenarioId><CurrencyCode>USD</CurrencyCode>'
+        '<DataItemValue>xsd:int_{0}</DataItemValue><Period><Type>FiscalQuarter</Type></Period>'
+        '</BaseRequestParameters>'.format(index) for index in range(scale))
+    request = ('<Envelope><Body><iGetBatch><serviceRequest><ParametersList>{}</ParametersList>'
+               '</serviceRequest></iGetBatch></Body></Envelope>').format(params)
+    context = type('MarshalContext', (), {})()
+    context.envelope = Parser().parse(string=request.encode('utf-8')).root()
+    return lambda: SoapFixer().marshalled(context)
+
+
+@case('sax_parse.data_values_reply')
+def _parse_data_values(scale):
+    reply = synthetic.data_values_reply_xml(scale).encode('utf-8')
+    return lambda: Parser().parse(string=reply)
+
+
+@case('sax_parse.investment_transactions_reply')
+def _parse_transactions(scale):
+    reply = synthetic.entities_reply_xml('investment_transaction', scale).encode('utf-8')
+    return lambda: Parser().parse(string=reply)
+
+
+def run_case(name, scale, repeat):
+    timings = []
+    for _ in range(repeat):
+        func = CASES[name](scale)
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        'scale': scale,
+        'repeat': repeat,
+        'best_seconds': round(best, 6),
+        'mean_seconds': round(sum(timings) / len(timings), 6),
+        'per_item_us': round(best / scale * 1e6, 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {(r['case'], r['scale']): r for r in json.load(file)['results']}
+    print('{:50} {:>8} {:>12} {:>12} {:>8}'.format('case', 'scale', 'base us', 'new us', 'ratio'))
+    for result in results:
+        base = baseline.get((result['case'], result['scale']))
+        if base is None:
+            continue
+        ratio = result['per_item_us'] / base['per_item_us'] if base['per_item_us'] else None
+        print('{:50} {:>8} {:>12} {:>12} {:>8}'.format(
+            result['case'], result['scale'], base['per_item_us'], result['per_item_us'],
+            '{:.2f}x'.format(ratio) if ratio else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline tap-ilevel benchmarks')
+    parser.add_argument('--scale', default='1000', help='Comma separated item counts')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeats per case (best is kept)')
+    parser.add_argument('--filter', help='Only run cases containing this string')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Compare per item timings with a previous results file')
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scale.split(',')]
+    results = []
+    for name in sorted(CASES):
+        if args.filter and args.filter not in name:
+            continue
+        for scale in scales:
+            result = run_case(name, scale, args.repeat)
+            result['case'] = name
+            results.append(result)
+            print('{:50} {:>8} {:>12.3f} us/item'.format(name, scale, result['per_item_us']),
+                  file=sys.stderr)
+
+    output = {
+        'commit': git_commit(),
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
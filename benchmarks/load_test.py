@@ -0,0 +1,114 @@
+# End to end load test: runs tap_ilevel.sync.sync against a local MockILevelServer (see
+#  benchmarks.mock_server) and reports wall time, record throughput per stream and the server's
+#  request, throttling and fault counts. Singer output is counted, not written.
+#
+# Usage:
+#   python -m benchmarks.load_test --assets 2000 --data-points 200000 --latency 0.05 \
+#       --streams assets,periodic_data_standardized --output load.json
+#   python -m benchmarks.load_test --fault-rate 0.01 --config '{"output_mode": "batch"}'
+import argparse
+import json
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import mock_server
+from tap_ilevel import get_client
+from tap_ilevel.api import select_streams
+from tap_ilevel.discover import discover
+from tap_ilevel.sync import sync
+
+MESSAGE_RE = re.compile(r'^\{"type": "(\w+)"(?:, "stream": "([^"]+)")?')
+DEFAULT_STREAMS = ('assets,funds,investments,securities,scenarios,data_items,'
+                   'asset_to_asset_relations,fund_to_asset_relations,fund_to_fund_relations,'
+                   'investment_transactions,periodic_data_standardized')
+
+
+# Stand-in for stdout counting Singer messages per type and stream.
+class MessageCounter:
+    def __init__(self):
+        self.counts = {}
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes = self.bytes + len(data)
+        for line in data.splitlines():
+            match = MESSAGE_RE.match(line)
+            if match:
+                key = '{}:{}'.format(*match.groups()) if match.group(2) else match.group(1)
+                self.counts[key] = self.counts.get(key, 0) + 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tap-ilevel end to end load test')
+    parser.add_argument('--streams', default=DEFAULT_STREAMS, help='Comma separated streams')
+    parser.add_argument('--start-date', help='Sync start date (default: start of the history)')
+    parser.add_argument('--period-types', default='FiscalQuarter')
+    parser.add_argument('--config', help='Extra tap config settings as a JSON object')
+    parser.add_argument('--state', help='Initial state as a JSON object')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    mock_server.add_tenant_args(parser)
+    mock_server.add_server_args(parser)
+    args = parser.parse_args()
+
+    tenant = mock_server.tenant_from_args(args)
+    server = mock_server.server_from_args(args, tenant).start()
+
+    start_date = args.start_date or (
+        datetime.utcnow() - timedelta(days=args.history_days)).strftime('%Y-%m-%d')
+    config = {
+        'username': 'load-test',
+        'password': 'load-test',
+        'start_date': start_date,
+        'period_types': args.period_types,
+        'service_url': server.url
+    }
+    config.update(json.loads(args.config) if args.config else {})
+    state = json.loads(args.state) if args.state else {}
+    stream_names = args.streams.split(',')
+    catalog = select_streams(discover(), stream_names)
+
+    counter = MessageCounter()
+    error = None
+    stdout = sys.stdout
+    sys.stdout = counter
+    start = time.perf_counter()
+    try:
+        sync(client=get_client(config), config=config, catalog=catalog, state=state)
+    except Exception as err: # pylint: disable=broad-except
+        error = repr(err)
+    finally:
+        elapsed = time.perf_counter() - start
+        sys.stdout = stdout
+        server.stop()
+
+    records = {key.split(':', 1)[1]: count for key, count in counter.counts.items()
+               if key.startswith('RECORD:')}
+    total_records = sum(records.values())
+    results = {
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'arguments': vars(args),
+        'elapsed_seconds': round(elapsed, 3),
+        'records': records,
+        'records_per_second': round(total_records / elapsed, 1) if elapsed else None,
+        'messages': counter.counts,
+        'output_bytes': counter.bytes,
+        'server': server.stats.to_dict(),
+        'final_state': state,
+        'error': error
+    }
+    print(json.dumps(results, indent=2, default=str))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, default=str)
+    if error:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
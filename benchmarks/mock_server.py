@@ -0,0 +1,693 @@
+# Local stand-in for the iLevel DataService (2019 Q1) for scale and load testing. Serves a WSDL
+#  covering the operations used by the tap and answers them from a synthetic tenant of
+#  configurable size, with tunable latency, throttling (503) and fault injection (SOAP faults,
+#  dropped connections).
+#
+# Usage:
+#   python -m benchmarks.mock_server --port 8080 --assets 5000 --data-points 1000000 --latency 0.05
+#  then run the tap with "service_url": "http://127.0.0.1:8080/DataService.svc" in its config.
+import argparse
+import bisect
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import xml.etree.ElementTree as ET
+
+import dateutil.parser
+
+from benchmarks import synthetic
+
+TNS = synthetic.DATA_SERVICE_NS
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+OBJECT_TYPES = ['Asset', 'CurrencyRate', 'DataItem', 'Fund', 'Investment', 'InvestmentTransaction',
+                'Scenario', 'Security', 'SegmentNode', 'FundToAsset', 'FundToFund', 'AssetToAsset']
+# Order matters: DataItemObjectEx.DataValueType is an index into DataValueTypes
+ENUMS = {
+    'ObjectTypes': OBJECT_TYPES,
+    'UpdatedObjectTypes': OBJECT_TYPES,
+    'DataValueTypes': ['Numeric', 'Text', 'Date', 'Boolean', 'ObjectId', 'Currency'],
+    'DateTypes': ['Current', 'Latest', 'Specific'],
+    'PeriodTypes': ['FiscalYear', 'Year', 'FiscalQuarter', 'Quarter', 'L3M', 'Month'],
+    'ExchangeRateTypes': ['Average', 'EndOfPeriod', 'Historical'],
+}
+PERIOD_MONTHS = {'FiscalYear': 12, 'Year': 12, 'FiscalQuarter': 3, 'Quarter': 3, 'L3M': 3,
+                 'Month': 1}
+
+# iGetBatch request parameters (also echoed back as a DataValue's SDParameters)
+REQUEST_PARAMETERS = [
+    ('CurrencyCode', 'xs:string'), ('DataItemId', 'xs:int'), ('DataItemValue', 'xs:anyType'),
+    ('DataValueType', 'tns:DataValueTypes'), ('DetailId', 'xs:int'),
+    ('EndOfPeriod', 'tns:Date'), ('EntitiesPath', 'tns:EntitiesPath'),
+    ('ExchangeRate', 'tns:ExchangeRate'), ('Offset', 'tns:Period'), ('Period', 'tns:Period'),
+    ('ReportedDate', 'tns:Date'), ('RequestIdentifier', 'xs:int'), ('ScenarioId', 'xs:int'),
+    ('StandardizedDataId', 'xs:int')]
+
+STATIC_TYPES = {
+    'Date': [('Type', 'tns:DateTypes'), ('Value', 'xs:dateTime')],
+    'Period': [('IsOffset', 'xs:boolean'), ('Quantity', 'xs:int'), ('Type', 'tns:PeriodTypes')],
+    'ExchangeRate': [('Type', 'tns:ExchangeRateTypes')],
+    'EntitiesPath': [('Path', 'ns3:ArrayOfint')],
+    'BaseRequestParameters': REQUEST_PARAMETERS,
+    'DataServiceRequest': [('IncludeExcelFormula', 'xs:boolean'),
+                           ('IncludeStandardizedDataInfo', 'xs:boolean'),
+                           ('ParametersList', 'tns:ArrayOfBaseRequestParameters')],
+    'DataValue': [('Error', 'xs:string'), ('ExcelFormula', 'xs:string'),
+                  ('NoDataAvailable', 'xs:boolean'), ('SDParameters', 'tns:StandardizedDataParameters'),
+                  ('Value', 'xs:anyType')],
+    'DataItemsSearchCriteria': [('GetGlobalDataItemsOnly', 'xs:boolean')],
+    'InvestmentTransactionsSearchCriteria': [('TransactionIds', 'ns3:ArrayOfint')],
+}
+# Fields the tap assigns into right after factory.create, so they are declared required (suds does
+#  not build optional members of new objects)
+REQUIRED_FIELDS = {'TransactionIds'}
+# Types extending BaseRequestParameters without adding fields
+DERIVED_PARAMETER_TYPES = ['AssetAndFundGetRequestParameters', 'StandardizedDataParameters']
+
+# GetObjectsByIds returns a mixed array; assets and data items come back as NamedEntity elements
+OBJECTS_BY_IDS_ELEMENTS = [('NamedEntity', 'NamedEntity'), ('Fund', 'Fund'),
+                           ('Investment', 'Investment'),
+                           ('InvestmentTransaction', 'InvestmentTransaction'),
+                           ('Scenario', 'NamedEntity'), ('Security', 'Security'),
+                           ('ObjectRelationship', 'ObjectRelationship'),
+                           ('CurrencyRate', 'CurrencyRate')]
+
+# Daily USD rates (currency, mid around which the rate moves) of the currency_rates stream
+FX_RATES = [('EUR', 0.9), ('GBP', 0.78)]
+
+DATE_RANGE = [('type', 'tns:UpdatedObjectTypes'), ('startDate', 'xs:dateTime'),
+              ('endDate', 'xs:dateTime')]
+# (operation, parameters, result type)
+OPERATIONS = [
+    ('GetAssets', [], 'tns:ArrayOfAsset'),
+    ('GetFunds', [], 'tns:ArrayOfFund'),
+    ('GetScenarios', [], 'tns:ArrayOfNamedEntity'),
+    ('GetSecurities', [], 'tns:ArrayOfSecurity'),
+    ('GetInvestments', [], 'tns:ArrayOfInvestment'),
+    ('GetObjectRelationships', [], 'tns:ArrayOfObjectRelationship'),
+    ('GetDataItems', [('criteria', 'tns:DataItemsSearchCriteria')], 'tns:ArrayOfDataItemObjectEx'),
+    ('GetInvestmentTransactions', [('criteria', 'tns:InvestmentTransactionsSearchCriteria')],
+     'tns:ArrayOfInvestmentTransaction'),
+    ('GetUpdatedObjects', DATE_RANGE, 'ns3:ArrayOfint'),
+    ('GetDeletedObjects', DATE_RANGE, 'ns3:ArrayOfint'),
+    ('GetObjectsByIds', [('type', 'tns:UpdatedObjectTypes'), ('ids', 'ns3:ArrayOfint')],
+     'tns:ArrayOfObjects'),
+    ('GetUpdatedData', DATE_RANGE[1:], 'ns3:ArrayOfint'),
+    ('iGetBatch', [('request', 'tns:DataServiceRequest')], 'tns:ArrayOfDataValue'),
+]
+
+
+def __element(name, type_name, max_occurs=None):
+    return '<xs:element minOccurs="{}"{} name="{}" nillable="true" type="{}"/>'.format(
+        1 if name in REQUIRED_FIELDS else 0,
+        ' maxOccurs="{}"'.format(max_occurs) if max_occurs else '', name, type_name)
+
+
+def __complex_type(name, fields, base=None):
+    elements = ''.join(__element(field, type_name) for field, type_name in fields)
+    if base:
+        return ('<xs:complexType name="{}"><xs:complexContent><xs:extension base="{}">'
+                '<xs:sequence>{}</xs:sequence></xs:extension></xs:complexContent>'
+                '</xs:complexType>').format(name, base, elements)
+    return '<xs:complexType name="{}"><xs:sequence>{}</xs:sequence></xs:complexType>'.format(
+        name, elements)
+
+
+# Complex types for a stream JSON schema: one for the entity and one per nested object, named
+#  after the parent type and field (e.g. InvestmentTransactionScenario).
+def __schema_types(name, schema):
+    fields = []
+    types = []
+    for prop_name, prop in schema.get('properties', {}).items():
+        if prop_name == 'is_soft_deleted':
+            continue
+        field = synthetic.soap_name(prop_name)
+        prop, kinds = synthetic.property_types(prop)
+        max_occurs = None
+        if 'array' in kinds:
+            prop, kinds = synthetic.property_types(prop.get('items', {}))
+            max_occurs = 'unbounded'
+        if 'object' in kinds:
+            nested_name = '{}{}'.format(name, field)
+            types.extend(__schema_types(nested_name, prop))
+            type_name = 'tns:{}'.format(nested_name)
+        elif 'integer' in kinds:
+            type_name = 'xs:int'
+        elif 'number' in kinds:
+            type_name = 'xs:double'
+        elif 'boolean' in kinds:
+            type_name = 'xs:boolean'
+        elif prop.get('format') == 'date-time':
+            type_name = 'xs:dateTime'
+        else:
+            type_name = 'xs:string'
+        fields.append((field, type_name, max_occurs))
+    elements = ''.join(__element(*field) for field in fields)
+    types.append('<xs:complexType name="{}"><xs:sequence>{}</xs:sequence></xs:complexType>'.format(
+        name, elements))
+    return types
+
+
+def __array_type(name, elements):
+    return '<xs:complexType name="{}"><xs:sequence>{}</xs:sequence></xs:complexType>'.format(
+        name, ''.join(__element(element, 'tns:{}'.format(type_name), 'unbounded')
+                      for element, type_name in elements))
+
+
+# WSDL for the mock service, with the endpoint at location.
+def build_wsdl(location):
+    types = []
+    for name, values in ENUMS.items():
+        types.append('<xs:simpleType name="{}"><xs:restriction base="xs:string">{}'
+                     '</xs:restriction></xs:simpleType>'.format(
+                         name, ''.join('<xs:enumeration value="{}"/>'.format(value)
+                                       for value in values)))
+    for name, fields in STATIC_TYPES.items():
+        types.append(__complex_type(name, fields))
+    for name in DERIVED_PARAMETER_TYPES:
+        types.append(__complex_type(name, [], base='tns:BaseRequestParameters'))
+    types.append(__array_type('ArrayOfBaseRequestParameters',
+                              [('BaseRequestParameters', 'BaseRequestParameters')]))
+    types.append(__array_type('ArrayOfDataValue', [('DataValue', 'DataValue')]))
+    for _, _, item_name, stream_name in synthetic.ENTITY_KINDS.values():
+        types.extend(__schema_types(item_name, synthetic.load_schema(stream_name)))
+        types.append(__array_type('ArrayOf{}'.format(item_name), [(item_name, item_name)]))
+    types.append(__array_type('ArrayOfObjects', OBJECTS_BY_IDS_ELEMENTS))
+
+    messages = []
+    port_operations = []
+    binding_operations = []
+    for operation, parameters, result_type in OPERATIONS:
+        types.append('<xs:element name="{}"><xs:complexType><xs:sequence>{}</xs:sequence>'
+                     '</xs:complexType></xs:element>'.format(
+                         operation, ''.join(__element(*param) for param in parameters)))
+        types.append('<xs:element name="{0}Response"><xs:complexType><xs:sequence>{1}'
+                     '</xs:sequence></xs:complexType></xs:element>'.format(
+                         operation, __element('{}Result'.format(operation), result_type)))
+        messages.append(
+            '<wsdl:message name="IDataService_{0}_InputMessage"><wsdl:part name="parameters" '
+            'element="tns:{0}"/></wsdl:message><wsdl:message name="IDataService_{0}_OutputMessage">'
+            '<wsdl:part name="parameters" element="tns:{0}Response"/></wsdl:message>'.format(operation))
+        port_operations.append(
+            '<wsdl:operation name="{0}"><wsdl:input message="tns:IDataService_{0}_InputMessage"/>'
+            '<wsdl:output message="tns:IDataService_{0}_OutputMessage"/></wsdl:operation>'.format(
+                operation))
+        binding_operations.append(
+            '<wsdl:operation name="{0}"><soap:operation soapAction="{1}/IDataService/{0}" '
+            'style="document"/><wsdl:input><soap:body use="literal"/></wsdl:input><wsdl:output>'
+            '<soap:body use="literal"/></wsdl:output></wsdl:operation>'.format(operation, TNS))
+
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<wsdl:definitions name="DataService" targetNamespace="{tns}" '
+        'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+        'xmlns:xs="{xsd}" xmlns:tns="{tns}" xmlns:ns3="{arrays}">'
+        '<wsdl:types>'
+        '<xs:schema elementFormDefault="qualified" targetNamespace="{arrays}">'
+        '<xs:complexType name="ArrayOfint"><xs:sequence><xs:element minOccurs="0" '
+        'maxOccurs="unbounded" name="int" type="xs:int"/></xs:sequence></xs:complexType>'
+        '</xs:schema>'
+        '<xs:schema elementFormDefault="qualified" targetNamespace="{tns}">'
+        '<xs:import namespace="{arrays}"/>{types}</xs:schema>'
+        '</wsdl:types>{messages}'
+        '<wsdl:portType name="IDataService">{port_operations}</wsdl:portType>'
+        '<wsdl:binding name="CustomBinding_IDataService2" type="tns:IDataService">'
+        '<soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>{binding_operations}'
+        '</wsdl:binding>'
+        '<wsdl:service name="DataService"><wsdl:port name="CustomBinding_IDataService2" '
+        'binding="tns:CustomBinding_IDataService2"><soap:address location="{location}"/>'
+        '</wsdl:port></wsdl:service>'
+        '</wsdl:definitions>'
+    ).format(tns=TNS, xsd=synthetic.XSD_NS, arrays=synthetic.ARRAYS_NS, types=''.join(types),
+             messages=''.join(messages), port_operations=''.join(port_operations),
+             binding_operations=''.join(binding_operations), location=location)
+
+
+def __local_name(element):
+    return element.tag.split('}')[-1]
+
+
+# Descendant of element following a path of local names, None if missing.
+def find(element, *path):
+    for name in path:
+        if element is None:
+            return None
+        element = next((child for child in element if __local_name(child) == name), None)
+    return element
+
+
+def find_text(element, *path):
+    found = find(element, *path)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip()
+
+
+def find_ints(element, *path):
+    found = find(element, *path)
+    if found is None:
+        return []
+    return [int(child.text) for child in found if __local_name(child) == 'int']
+
+
+def parse_date(value):
+    return dateutil.parser.parse(value).replace(tzinfo=None)
+
+
+# Synthetic iLevel tenant. Entities are generated from the stream schemas (see
+#  benchmarks.synthetic) with ids in a separate range per object type; each has a last modified
+#  date spread over the past history_days, and deleted_ratio of them (on top of count) are
+#  deleted within that period. data_points standardized data ids are updated over the same
+#  period; each maps to a (data item, asset, fiscal quarter) value.
+class SyntheticTenant:
+    def __init__(self, assets=100, funds=10, securities=50, investments=100, data_items=40,
+                 calc_data_items=5, transactions=1000, data_points=10000, history_days=90,
+                 deleted_ratio=0.02, no_data_ratio=0.05, seed=1):
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.history_days = history_days
+        self.deleted_ratio = deleted_ratio
+        self.no_data_ratio = no_data_ratio
+        self.random = random.Random(seed)
+        # object type: {id: (object, last modified, deleted at)}
+        self.objects = {}
+
+        self.__add_entities('Asset', 'asset', assets, 100000)
+        self.__add_entities('Fund', 'fund', funds, 200000)
+        self.__add_entities('Security', 'security', securities, 300000)
+        self.__add_entities('Investment', 'investment', investments, 400000)
+        self.__add_entities('DataItem', 'data_item', data_items, 500000)
+        self.__add_entities('InvestmentTransaction', 'investment_transaction', transactions, 600000)
+        self.__add_entities('Scenario', 'scenario', 3, 1)
+
+        for index, (obj, _, _) in enumerate(self.objects['Scenario'].values()):
+            obj.Name = ['Actual', 'Budget', 'Forecast'][index]
+        for index, (obj, _, _) in enumerate(self.objects['DataItem'].values()):
+            obj.Name = 'Data item {}'.format(index + 1)
+            obj.DataValueType = 5 if index % 2 else 0 # Currency, Numeric
+            obj.IsGlobal = index < calc_data_items
+            obj.FormulaTypeIDsString = '1' if index < calc_data_items else None
+        for obj, _, _ in self.objects['Asset'].values():
+            obj.InitialPeriod = self.now - timedelta(days=730)
+        self.__add_currency_rates(800000)
+
+        asset_ids = self.live_ids('Asset')
+        fund_ids = self.live_ids('Fund')
+        relation_id = 700000
+        for type_id, count in (('FundToAsset', assets), ('FundToFund', funds),
+                               ('AssetToAsset', assets // 10)):
+            self.__add_entities(type_id, 'relation', count, relation_id)
+            for index, (obj, _, _) in enumerate(self.objects[type_id].values()):
+                obj.TypeId = type_id
+                from_ids = asset_ids if type_id == 'AssetToAsset' else fund_ids
+                to_ids = fund_ids if type_id == 'FundToFund' else asset_ids
+                obj.FromId = from_ids[index % len(from_ids)] if from_ids else None
+                obj.ToId = to_ids[(index + 1) % len(to_ids)] if to_ids else None
+            relation_id = relation_id + 100000
+
+        self.data_item_ids = self.live_ids('DataItem')
+        self.asset_ids = asset_ids
+        self.data_points = data_points
+        # Sorted (updated, standardized data id) for GetUpdatedData windows
+        self.data_updates = sorted(
+            (self.__past_date(), 900000 + index) for index in range(data_points))
+        self.data_update_dates = [updated for updated, _ in self.data_updates]
+
+    def __past_date(self):
+        return self.now - timedelta(seconds=self.random.uniform(0, self.history_days * 86400))
+
+    def __add_entities(self, object_type, kind, count, id_base):
+        deleted_count = int(count * self.deleted_ratio)
+        entities = synthetic.make_entities(kind, count + deleted_count)
+        objects = self.objects.setdefault(object_type, {})
+        for index, obj in enumerate(entities):
+            obj.Id = id_base + index
+            modified = self.__past_date()
+            for field in ('LastModifiedDate', 'LastModified'):
+                if field in obj:
+                    setattr(obj, field, modified)
+            deleted = self.__past_date() if index >= count else None
+            objects[obj.Id] = (obj, modified, deleted)
+
+    # A rate per currency and day over the past history_days, published (modified) at 18:00.
+    def __add_currency_rates(self, id_base):
+        objects = self.objects.setdefault('CurrencyRate', {})
+        today = self.now.replace(hour=0, minute=0, second=0)
+        for currency, base_mid in FX_RATES:
+            for day in range(self.history_days + 1):
+                date = today - timedelta(days=self.history_days - day)
+                mid = round(base_mid * (1 + 0.05 * ((day * 7919) % 100 - 50) / 50.0), 6)
+                obj = synthetic.new_object(
+                    'CurrencyRate', Date=date, Bid=round(mid * 0.999, 6),
+                    Ask=round(mid * 1.001, 6), Mid=mid, CurrencyFrom='USD', CurrencyTo=currency)
+                objects[id_base + len(objects)] = (
+                    obj, min(date + timedelta(hours=18), self.now), None)
+
+    def live_ids(self, object_type):
+        return [obj_id for obj_id, (_, _, deleted) in self.objects.get(object_type, {}).items()
+                if deleted is None]
+
+    def __live(self, object_type):
+        return [obj for obj, _, deleted in self.objects.get(object_type, {}).values()
+                if deleted is None]
+
+    # (reply XML, item count) for an operation and its Body element.
+    def reply(self, operation, request):
+        result = '{}Result'.format(operation)
+        response = '{}Response'.format(operation)
+        entity_operations = {
+            'GetAssets': ('Asset', 'Asset'), 'GetFunds': ('Fund', 'Fund'),
+            'GetScenarios': ('Scenario', 'NamedEntity'), 'GetSecurities': ('Security', 'Security'),
+            'GetInvestments': ('Investment', 'Investment')}
+        if operation in entity_operations:
+            object_type, item_name = entity_operations[operation]
+            items = self.__live(object_type)
+            return synthetic.envelope(response, result, items, item_name), len(items)
+
+        if operation == 'GetObjectRelationships':
+            items = (self.__live('FundToAsset') + self.__live('FundToFund') +
+                     self.__live('AssetToAsset'))
+            return synthetic.envelope(response, result, items, 'ObjectRelationship'), len(items)
+
+        if operation == 'GetDataItems':
+            items = self.__live('DataItem')
+            if find_text(request, 'criteria', 'GetGlobalDataItemsOnly') == 'true':
+                items = [item for item in items if item.IsGlobal]
+            return synthetic.envelope(response, result, items, 'DataItemObjectEx'), len(items)
+
+        if operation == 'GetInvestmentTransactions':
+            objects = self.objects['InvestmentTransaction']
+            items = [objects[obj_id][0] for obj_id in
+                     find_ints(request, 'criteria', 'TransactionIds') if obj_id in objects]
+            return synthetic.envelope(response, result, items, 'InvestmentTransaction'), len(items)
+
+        if operation in ('GetUpdatedObjects', 'GetDeletedObjects'):
+            start = parse_date(find_text(request, 'startDate'))
+            end = parse_date(find_text(request, 'endDate'))
+            position = 1 if operation == 'GetUpdatedObjects' else 2
+            ids = [obj_id for obj_id, entry in
+                   self.objects.get(find_text(request, 'type'), {}).items()
+                   if entry[position] is not None and start <= entry[position] < end]
+            return synthetic.envelope(response, result, ids, 'a:int'), len(ids)
+
+        if operation == 'GetObjectsByIds':
+            object_type = find_text(request, 'type')
+            objects = self.objects.get(object_type, {})
+            items = [objects[obj_id][0] for obj_id in find_ints(request, 'ids')
+                     if obj_id in objects]
+            if object_type in ('Asset', 'DataItem'):
+                type_name = 'Asset' if object_type == 'Asset' else 'DataItemObjectEx'
+                return synthetic.envelope(response, result, items, 'NamedEntity', type_name), \
+                    len(items)
+            item_name = 'ObjectRelationship' if object_type in ('FundToAsset', 'FundToFund', \
+                'AssetToAsset') else object_type
+            return synthetic.envelope(response, result, items, item_name), len(items)
+
+        if operation == 'GetUpdatedData':
+            start = parse_date(find_text(request, 'startDate'))
+            end = parse_date(find_text(request, 'endDate'))
+            ids = [sd_id for _, sd_id in self.data_updates[
+                bisect.bisect_left(self.data_update_dates, start):
+                bisect.bisect_left(self.data_update_dates, end)]]
+            return synthetic.envelope(response, result, ids, 'a:int'), len(ids)
+
+        if operation == 'iGetBatch':
+            parameters = find(request, 'request', 'ParametersList')
+            include_formula = find_text(request, 'request', 'IncludeExcelFormula') == 'true'
+            include_sd_info = find_text(request, 'request', 'IncludeStandardizedDataInfo') == 'true'
+            items = [self.__data_value(params, include_formula, include_sd_info) for params in
+                     (parameters if parameters is not None else [])]
+            return synthetic.envelope(response, result, items, 'DataValue'), len(items)
+
+        raise ValueError('Unsupported operation {}'.format(operation))
+
+    def __period_end(self, period_type, offset):
+        months = PERIOD_MONTHS.get(period_type, 3)
+        month_index = self.now.year * 12 + self.now.month - 1
+        # First month after the current period, moved back by offset periods
+        month_index = (month_index // months + 1 + offset) * months
+        return datetime(month_index // 12, month_index % 12 + 1, 1) - timedelta(days=1)
+
+    # DataValue for one iGetBatch request: a standardized data id, or a data item / entity /
+    #  period (offset) request as made for calculated data. ExcelFormula and SDParameters are only
+    #  included when requested.
+    def __data_value(self, params, include_formula=True, include_sd_info=True):
+        sd_id = find_text(params, 'StandardizedDataId')
+        request_id = find_text(params, 'RequestIdentifier')
+        if sd_id is not None:
+            index = int(sd_id) - 900000
+            if not 0 <= index < self.data_points or not self.data_item_ids or not self.asset_ids:
+                return synthetic.new_object('DataValue', Error='Unknown StandardizedDataId')
+            data_item_id = self.data_item_ids[index % len(self.data_item_ids)]
+            entity_ids = [self.asset_ids[(index // len(self.data_item_ids)) % len(self.asset_ids)]]
+            period_type = 'FiscalQuarter'
+            offset = -(index // (len(self.data_item_ids) * len(self.asset_ids)) % 8)
+            scenario_id = 1
+            currency_code = 'USD'
+            data_value_type = 'Numeric'
+        else:
+            data_item_id = find_text(params, 'DataItemId')
+            entity_ids = find_ints(params, 'EntitiesPath', 'Path')
+            period_type = find_text(params, 'Period', 'Type') or 'FiscalQuarter'
+            offset = int(find_text(params, 'Offset', 'Quantity') or 0)
+            scenario_id = find_text(params, 'ScenarioId')
+            currency_code = find_text(params, 'CurrencyCode')
+            data_value_type = find_text(params, 'DataValueType')
+
+        key = '{}|{}|{}|{}|{}'.format(data_item_id, entity_ids, period_type, offset, scenario_id)
+        checksum = zlib.crc32(key.encode('utf-8'))
+        if checksum % 1000 < self.no_data_ratio * 1000:
+            value = 'No Data Available'
+        else:
+            value = (checksum % 200000000 - 100000000) / 100.0
+
+        sd_parameters = synthetic.new_object(
+            'StandardizedDataParameters',
+            CurrencyCode=currency_code,
+            DataItemId=data_item_id,
+            DataValueType=data_value_type,
+            DetailId=None,
+            EndOfPeriod=synthetic.new_object(
+                'Date', Type='Latest', Value=self.__period_end(period_type, offset)),
+            EntitiesPath=synthetic.new_object('EntitiesPath', Path=synthetic.new_object(
+                'ArrayOfint', int=entity_ids)),
+            ExchangeRate=synthetic.new_object('ExchangeRate', Type='Average'),
+            Period=synthetic.new_object('Period', Type=period_type, Quantity=1),
+            ReportedDate=synthetic.new_object('Date', Type='Current', Value=self.now),
+            RequestIdentifier=request_id,
+            ScenarioId=scenario_id,
+            StandardizedDataId=sd_id)
+        fields = {}
+        if include_formula:
+            fields['ExcelFormula'] = '=@IGET({},{},"{}",{})'.format(
+                entity_ids, data_item_id, period_type, offset)
+        if include_sd_info:
+            fields['SDParameters'] = sd_parameters
+        return synthetic.new_object('DataValue', Value=value, **fields)
+
+
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.items = {}
+        self.errors = {'faults': 0, 'disconnects': 0, 'throttled': 0}
+
+    def incr(self, error):
+        with self.lock:
+            self.errors[error] = self.errors[error] + 1
+
+    def add(self, operation, items=0):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+            self.items[operation] = self.items.get(operation, 0) + items
+
+    def to_dict(self):
+        with self.lock:
+            result = {'requests': dict(self.requests), 'items': dict(self.items)}
+            result.update(self.errors)
+            return result
+
+
+def fault_envelope(message):
+    return (
+        '<s:Envelope xmlns:s="{}"><s:Body><s:Fault><faultcode>s:Server</faultcode>'
+        '<faultstring xml:lang="en-US">{}</faultstring></s:Fault></s:Body></s:Envelope>'
+    ).format(SOAP_ENV_NS, message)
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def __send(self, code, body, extra_headers=None):
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, val in (extra_headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        if 'wsdl' not in urlparse(self.path).query.lower():
+            self.__send(404, '')
+            return
+        self.__send(200, self.server.wsdl)
+
+    def do_POST(self): # pylint: disable=invalid-name
+        server = self.server
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = find(ET.fromstring(request), 'Body')
+        operation = body[0].tag.split('}')[-1]
+
+        if server.throttled():
+            server.stats.incr('throttled')
+            self.__send(503, fault_envelope('The server is too busy.'), {'Retry-After': '1'})
+            return
+        roll = server.random.random()
+        if roll < server.disconnect_rate:
+            server.stats.incr('disconnects')
+            self.close_connection = True
+            return
+        if roll < server.disconnect_rate + server.fault_rate:
+            server.stats.incr('faults')
+            self.__send(500, fault_envelope('Injected fault for {}'.format(operation)))
+            return
+
+        reply, items = server.tenant.reply(operation, body[0])
+        server.stats.add(operation, items)
+        delay = server.latency + items * server.latency_per_item
+        if server.jitter:
+            delay = delay + server.random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        self.__send(200, reply)
+
+
+# Threaded HTTP server for a SyntheticTenant. Each reply is delayed by latency plus
+#  latency_per_item for each returned item (plus up to jitter seconds). Over throttle_rps requests
+#  per second are rejected with 503; fault_rate of requests get a SOAP fault (500) and
+#  disconnect_rate are dropped without a reply.
+class MockILevelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tenant, host='127.0.0.1', port=0, latency=0.0, latency_per_item=0.0,
+                 jitter=0.0, throttle_rps=None, fault_rate=0.0, disconnect_rate=0.0, seed=1):
+        super().__init__((host, port), MockRequestHandler)
+        self.tenant = tenant
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.jitter = jitter
+        self.throttle_rps = throttle_rps
+        self.fault_rate = fault_rate
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.stats = ServerStats()
+        self.thread = None
+        self.throttle_lock = threading.Lock()
+        self.tokens = throttle_rps or 0
+        self.tokens_updated = time.monotonic()
+        self.wsdl = build_wsdl('{}/Soap11NoWSA'.format(self.url))
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/DataService.svc'.format(host, port)
+
+    # Token bucket of throttle_rps requests per second (burst of one second)
+    def throttled(self):
+        if not self.throttle_rps:
+            return False
+        with self.throttle_lock:
+            now = time.monotonic()
+            self.tokens = min(self.throttle_rps,
+                              self.tokens + (now - self.tokens_updated) * self.throttle_rps)
+            self.tokens_updated = now
+            if self.tokens < 1:
+                return True
+            self.tokens = self.tokens - 1
+            return False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_tenant_args(parser):
+    parser.add_argument('--assets', type=int, default=100)
+    parser.add_argument('--funds', type=int, default=10)
+    parser.add_argument('--securities', type=int, default=50)
+    parser.add_argument('--investments', type=int, default=100)
+    parser.add_argument('--data-items', type=int, default=40)
+    parser.add_argument('--calc-data-items', type=int, default=5,
+                        help='Global data items with a formula (periodic_data_calculated)')
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--data-points', type=int, default=10000,
+                        help='Standardized data ids updated within the history')
+    parser.add_argument('--history-days', type=int, default=90)
+    parser.add_argument('--deleted-ratio', type=float, default=0.02)
+    parser.add_argument('--no-data-ratio', type=float, default=0.05)
+
+
+def add_server_args(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per reply')
+    parser.add_argument('--latency-per-item', type=float, default=0.0,
+                        help='Additional seconds per returned item')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to N extra seconds')
+    parser.add_argument('--throttle-rps', type=float, help='Reject requests over N/s with 503')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='SOAP fault probability')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help='Dropped connection probability')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def tenant_from_args(args):
+    return SyntheticTenant(
+        assets=args.assets, funds=args.funds, securities=args.securities,
+        investments=args.investments, data_items=args.data_items,
+        calc_data_items=args.calc_data_items, transactions=args.transactions,
+        data_points=args.data_points, history_days=args.history_days,
+        deleted_ratio=args.deleted_ratio, no_data_ratio=args.no_data_ratio, seed=args.seed)
+
+
+def server_from_args(args, tenant, host='127.0.0.1', port=0):
+    return MockILevelServer(
+        tenant, host=host, port=port, latency=args.latency,
+        latency_per_item=args.latency_per_item, jitter=args.jitter,
+        throttle_rps=args.throttle_rps, fault_rate=args.fault_rate,
+        disconnect_rate=args.disconnect_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock iLevel DataService')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_tenant_args(parser)
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, tenant_from_args(args), args.host, args.port)
+    print('Serving mock iLevel DataService at {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats.to_dict())
+
+
+if __name__ == '__main__':
+    main()
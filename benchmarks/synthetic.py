@@ -0,0 +1,173 @@
+# Synthetic iLevel data for offline benchmarks: suds objects and raw SOAP reply XML shaped like
+#  the DataService replies (DataValue and the entity types). Entity objects are generated from the
+#  stream JSON schemas, so their shape follows the schemas as they change.
+import json
+import random
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+from suds.sudsobject import Factory
+
+from tap_ilevel.schema import get_abs_path
+
+DATA_SERVICE_NS = 'http://schemas.ilevelsolutions.com/services/dataservice/2019/Q1'
+ARRAYS_NS = 'http://schemas.microsoft.com/2003/10/Serialization/Arrays'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+BASE_DATE = datetime(2020, 1, 1)
+
+# (reply element, result element, item element, stream schema) per entity kind
+ENTITY_KINDS = {
+    'asset': ('GetAssetsResponse', 'GetAssetsResult', 'Asset', 'assets'),
+    'fund': ('GetFundsResponse', 'GetFundsResult', 'Fund', 'funds'),
+    'investment_transaction': ('GetInvestmentTransactionsResponse',
+                               'GetInvestmentTransactionsResult', 'InvestmentTransaction',
+                               'investment_transactions'),
+    'scenario': ('GetScenariosResponse', 'GetScenariosResult', 'NamedEntity', 'scenarios'),
+    'security': ('GetSecuritiesResponse', 'GetSecuritiesResult', 'Security', 'securities'),
+    'investment': ('GetInvestmentsResponse', 'GetInvestmentsResult', 'Investment', 'investments'),
+    'data_item': ('GetDataItemsResponse', 'GetDataItemsResult', 'DataItemObjectEx', 'data_items'),
+    'relation': ('GetObjectRelationshipsResponse', 'GetObjectRelationshipsResult',
+                 'ObjectRelationship', 'fund_to_asset_relations'),
+    'currency_rate': ('GetObjectsByIdsResponse', 'GetObjectsByIdsResult', 'CurrencyRate',
+                      'currency_rates'),
+}
+
+
+def new_object(name, **fields):
+    obj = Factory.object(name)
+    for key, val in fields.items():
+        setattr(obj, key, val)
+    return obj
+
+
+def load_schema(stream_name):
+    with open(get_abs_path('schemas/{}.json'.format(stream_name))) as file:
+        return json.load(file)
+
+
+# SOAP (PascalCase) field name for a schema property, e.g. formula_type_i_ds_string ->
+#  FormulaTypeIDsString (soap_name does not reverse decamelize for these).
+def soap_name(prop_name):
+    return ''.join(part[:1].upper() + part[1:] for part in prop_name.split('_'))
+
+
+# (property schema, non-null JSON types) for a schema property, resolving anyOf.
+def property_types(prop):
+    if 'anyOf' in prop:
+        prop = next(option for option in prop['anyOf'] if option.get('type') != 'null')
+    types = prop.get('type', [])
+    if isinstance(types, str):
+        types = [types]
+    return prop, [t for t in types if t != 'null']
+
+
+# Value for a schema property, deterministic for a given seed (record index).
+def __value(name, prop, seed):
+    prop, types = property_types(prop)
+    if 'object' in types:
+        return schema_object(soap_name(name), prop, seed)
+    if 'array' in types:
+        return [__value(name, prop.get('items', {}), seed + offset) for offset in range(2)]
+    if 'integer' in types:
+        return seed
+    if 'number' in types:
+        return round(seed * 1.5, 2)
+    if 'boolean' in types:
+        return seed % 2 == 0
+    if prop.get('format') == 'date-time':
+        return BASE_DATE + timedelta(days=seed % 1000)
+    return '{} {}'.format(name, seed)
+
+
+# A suds object with a (PascalCase) field for each property of a schema object.
+def schema_object(name, schema, seed):
+    fields = {}
+    for prop_name, prop in schema.get('properties', {}).items():
+        if prop_name == 'is_soft_deleted':
+            continue
+        fields[soap_name(prop_name)] = __value(prop_name, prop, seed)
+    return new_object(name, **fields)
+
+
+def make_entities(kind, count):
+    _, _, item_name, stream_name = ENTITY_KINDS[kind]
+    schema = load_schema(stream_name)
+    return [schema_object(item_name, schema, index + 1) for index in range(count)]
+
+
+# iGetBatch DataValue, including SDParameters and ExcelFormula (as requested by the tap).
+def make_data_value(index, entities_per_value=1):
+    sd_parameters = new_object(
+        'StandardizedDataParameters',
+        CurrencyCode='USD',
+        DataItemId=5000 + index % 250,
+        DataValueType='Numeric',
+        DetailId=None,
+        ScenarioId=1,
+        Period=new_object('Period', Type='FiscalQuarter', Quantity=1),
+        EndOfPeriod=new_object('Date', Type='Latest', Value=BASE_DATE + timedelta(days=index % 90)),
+        ReportedDate=new_object('Date', Type='Current', Value=BASE_DATE + timedelta(days=index % 30)),
+        ExchangeRate=new_object('ExchangeRate', Type='Average'),
+        RequestIdentifier=index,
+        StandardizedDataId=900000 + index,
+        EntitiesPath=new_object('EntitiesPath', Path=new_object(
+            'ArrayOfint', int=[130000 + index + offset for offset in range(entities_per_value)])))
+    return new_object(
+        'DataValue',
+        Value=round(random.Random(index).uniform(-1e6, 1e6), 4),
+        ExcelFormula='=@IGET("Asset {}","Revenue","Actual","FQ","USD")'.format(index),
+        SDParameters=sd_parameters)
+
+
+def make_data_values(count, entities_per_value=1):
+    return [make_data_value(index + 1, entities_per_value) for index in range(count)]
+
+
+def __to_xml(name, val, prefix='', type_name=None):
+    tag = '{}{}'.format(prefix, name)
+    if val is None:
+        return '<{} i:nil="true"/>'.format(tag)
+    if hasattr(val, '__keylist__'):
+        inner = []
+        for key in val.__keylist__:
+            child = getattr(val, key)
+            if key == 'int' and isinstance(child, list):
+                inner.extend(__to_xml('int', item, 'a:') for item in child)
+            elif isinstance(child, list):
+                inner.append(''.join(__to_xml(key, item) for item in child))
+            else:
+                inner.append(__to_xml(key, child))
+        # type_name: a derived type in place of the declared one (e.g. an Asset as NamedEntity)
+        attrs = ' i:type="{}"'.format(type_name) if type_name else ''
+        return '<{0}{1}>{2}</{0}>'.format(tag, attrs, ''.join(inner))
+    if isinstance(val, list):
+        return '<{0}>{1}</{0}>'.format(tag, ''.join(__to_xml(name, item) for item in val))
+    if isinstance(val, datetime):
+        return '<{0}>{1}</{0}>'.format(tag, val.isoformat())
+    if isinstance(val, bool):
+        return '<{0}>{1}</{0}>'.format(tag, 'true' if val else 'false')
+    if isinstance(val, float):
+        # Typed as the DataService does for xs:anyType values (DataValue.Value)
+        return '<{0} i:type="b:double">{1}</{0}>'.format(tag, repr(val))
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(val)))
+
+
+# SOAP reply envelope with items as the result's item_name elements. With type_name, each item
+#  is marked as that (derived) type.
+def envelope(response_name, result_name, items, item_name, type_name=None):
+    body = ''.join(__to_xml(item_name, item, type_name=type_name) for item in items)
+    return (
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<s:Body><{0} xmlns="{1}"><{2} xmlns:i="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:a="{3}" xmlns:b="{4}">{5}</{2}></{0}></s:Body></s:Envelope>'
+    ).format(response_name, DATA_SERVICE_NS, result_name, ARRAYS_NS, XSD_NS, body)
+
+
+def data_values_reply_xml(count, entities_per_value=1):
+    return envelope('iGetBatchResponse', 'iGetBatchResult',
+                    make_data_values(count, entities_per_value), 'DataValue')
+
+
+def entities_reply_xml(kind, count):
+    response_name, result_name, item_name, _ = ENTITY_KINDS[kind]
+    return envelope(response_name, result_name, make_entities(kind, count), item_name)
@@ -9,24 +9,28 @@ setup(name='tap-ilevel',
       classifiers=['Programming Language :: Python :: 3 :: Only'],
       py_modules=['tap_ilevel'],
       install_requires=[
-          'suds-jurko==0.6',
+          'suds==1.2.0',
           'pyhumps==1.6.1',
           'backoff==1.8.0',
           'requests==2.23.0',
           'singer-python==5.9.0'
       ],
       extras_require={
+        'parquet': [
+            'pyarrow'
+        ],
         'dev': [
             'pylint',
             'ipdb',
-            'nose'
+            'nose',
+            'pytest'
         ]
       },
       entry_points='''
           [console_scripts]
           tap-ilevel=tap_ilevel:main
       ''',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
       package_data={
           'tap_ilevel': [
               'schemas/*.json'
@@ -6,14 +6,24 @@ import argparse
 from decimal import Decimal
 from suds.plugin import MessagePlugin
 from suds.client import Client
+from suds.cache import NoCache
 from suds.wsse import *
 from suds.sax.attribute import Attribute
 
 import singer
 from singer import utils, metadata
+from singer.catalog import Catalog
 
+from tap_ilevel import config as tap_config
 from tap_ilevel.discover import discover
 from tap_ilevel.sync import sync
+from tap_ilevel.run_profile import ProfilePlugin
+from tap_ilevel.replay_transport import get_transport
+from tap_ilevel.planner import plan_sync, log_plan
+from tap_ilevel.api import iter_records, iter_sync
+from tap_ilevel.spool import replay_spool
+from tap_ilevel.daemon import run_daemon
+from tap_ilevel.backfill import write_backfill_jobs, merge_backfill_states
 
 LOGGER = singer.get_logger()
 
@@ -45,47 +55,100 @@ class SoapFixer(MessagePlugin):
             element.setText(type_and_value[1])
 
 
-def do_discover():
-    LOGGER.info('Starting discover')
-    catalog = discover()
-    json.dump(catalog.to_dict(), sys.stdout, indent=2)
-    LOGGER.info('Finished discover')
+# Standard Singer arguments (see singer.utils.parse_args) plus tap specific options.
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help='Config file', required=True)
+    parser.add_argument('-s', '--state', help='State file')
+    parser.add_argument(
+        '-p', '--properties', help='Property selections: DEPRECATED, Please use --catalog instead')
+    parser.add_argument('--catalog', help='Catalog file')
+    parser.add_argument('-d', '--discover', action='store_true', help='Do schema discovery')
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='Dry run: estimate API calls, batches and duration per selected stream (JSON on '
+             'stdout) from the id listing calls only, without fetching details or emitting records')
+    parser.add_argument(
+        '--profile-dir',
+        help='Profile each stream (cProfile/sampled stacks, tracemalloc, peak RSS) into this '
+             'directory; overrides the profile_dir config setting')
+    parser.add_argument(
+        '--profile-sample-interval', type=float,
+        help='Sample stacks every N seconds instead of running cProfile (low overhead)')
+    parser.add_argument(
+        '--replay-spool', action='store_true',
+        help='Re-emit the records and states spooled (spool_dir) after the given state, without '
+             'any API calls')
+    parser.add_argument(
+        '--daemon', action='store_true',
+        help='Keep running: sync the catalog every daemon_interval_seconds with a warm client, '
+             'until stopped (SIGTERM/SIGINT)')
+    parser.add_argument(
+        '--backfill-split', type=int, metavar='JOBS',
+        help='Split the date range of the selected date window streams into up to JOBS backfill '
+             'jobs, writing a config per job (backfill_dir) and the jobs as JSON on stdout')
+    parser.add_argument(
+        '--backfill-merge', nargs='+', metavar='STATE',
+        help='Merge the states of finished backfill jobs into the given state (or an empty one), '
+             'written as JSON on stdout')
 
+    args = parser.parse_args()
+    for option, value in (('--plan', args.plan), ('--daemon', args.daemon),
+                          ('--backfill-split', args.backfill_split is not None)):
+        if value and not args.catalog:
+            parser.error('{} requires --catalog'.format(option))
+    args.config_path = args.config
+    args.config = utils.load_json(args.config)
+    if args.state:
+        args.state_path = args.state
+        args.state = utils.load_json(args.state)
+    else:
+        args.state = {}
+    if args.properties:
+        args.properties_path = args.properties
+        args.properties = utils.load_json(args.properties)
+    if args.catalog:
+        args.catalog_path = args.catalog
+        args.catalog = Catalog.load(args.catalog)
+    # Multi-account runs have the credentials in each account (see accounts.get_accounts)
+    if args.config.get('accounts'):
+        utils.check_config(args.config, ['start_date'])
+    else:
+        utils.check_config(args.config, REQUIRED_CONFIG_KEYS)
 
-@singer.utils.handle_top_exception(LOGGER)
-def main():
-    LOGGER.info('Running main method....')
+    if args.profile_dir:
+        args.config['profile_dir'] = args.profile_dir
+    if args.profile_sample_interval:
+        args.config['profile_sample_interval'] = args.profile_sample_interval
 
-    parsed_args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    return args
 
-    state = {}
-    if parsed_args.state:
-        state = parsed_args.state
 
-    config = {}
-    if parsed_args.config:
-        config = parsed_args.config
+# URL of the iLevel DataService. service_url (e.g. a local mock server) replaces the iLevel URL
+#  built from is_sandbox, wsdl_year and wsdl_quarter.
+def get_service_url(config):
+    url = config.get('service_url')
+    if not url:
+        wsdl_year = config.get('wsdl_year', '2019')
+        wsdl_quarter = config.get('wsdl_quarter', 'Q1')
+        sandbox_flag = config.get('is_sandbox', 'false')
+        is_sandbox = False
+        if sandbox_flag in {"true", "True"}:
+            is_sandbox = True
 
-    wsdl_year = config.get('wsdl_year', '2019')
-    wsdl_quarter = config.get('wsdl_quarter', 'Q1')
-    sandbox_flag = config.get('is_sandbox', 'false')
-    is_sandbox = False
-    if sandbox_flag in {"true", "True"}:
-        is_sandbox = True
+        LOGGER.info('init: is sandbox: %s', config.get('is_sandbox'))
+        if is_sandbox:
+            sandbox = 'sand'
+        else:
+            sandbox = ''
 
-    LOGGER.info('init: is sandbox: %s', config.get('is_sandbox'))
-    if is_sandbox:
-        sandbox = 'sand'
-    else:
-        sandbox = ''
+        url = 'https://{}services.ilevelsolutions.com/DataService/Service/{}/{}/DataService.svc'.format(
+            sandbox, wsdl_year, wsdl_quarter)
+    return url
 
-    url = 'https://{}services.ilevelsolutions.com/DataService/Service/{}/{}/DataService.svc'.format(
-        sandbox, wsdl_year, wsdl_quarter)
-    LOGGER.info('init: url is %s', url)
-    wsdl_url = url + '?singleWsdl'
-    plugin = SoapFixer()
-    client = Client(wsdl_url, plugins=[plugin])
 
+# WS-Security header with the config credentials.
+def get_security(config):
     username = config.get('username')
     password = config.get('password')
 
@@ -94,21 +157,103 @@ def main():
     security.tokens.append(token)
     timestamp = Timestamp(600)  # i.e. 10 minutes
     security.tokens.append(timestamp)
+    return security
+
+
+# SOAP client for the iLevel DataService (see get_service_url).
+def get_client(config, transport=None):
+    url = get_service_url(config)
+    LOGGER.info('init: url is %s', url)
+    wsdl_url = url + '?singleWsdl'
+    plugin = SoapFixer()
+    if transport is not None or config.get('service_url'):
+        # Bypass the WSDL cache so the WSDL fetch is recorded (or served from the archive), and
+        #  a non iLevel service is never served a cached WSDL
+        options = {'cache': NoCache()}
+        if transport is not None:
+            options['transport'] = transport
+        client = Client(wsdl_url, plugins=[plugin, ProfilePlugin()], **options)
+    else:
+        client = Client(wsdl_url, plugins=[plugin, ProfilePlugin()])
 
     #
     endpoint_url = url + '/Soap11NoWSA'
     client.set_options(
         port='CustomBinding_IDataService2',
         location=endpoint_url,
-        wsse=security)
-
-    if parsed_args.discover:
-        do_discover()
-    elif parsed_args.catalog:
-        sync(client=client,
-             config=parsed_args.config,
-             catalog=parsed_args.catalog,
-             state=state)
+        wsse=get_security(config))
+
+    return client
+
+
+def do_discover(client, config):
+    LOGGER.info('Starting discover')
+    # Wide periodic data streams (pivot_periodic_data) need the data items from the API
+    catalog = discover(client if tap_config.get_bool(config, 'pivot_periodic_data') else None)
+    json.dump(catalog.to_dict(), sys.stdout, indent=2)
+    LOGGER.info('Finished discover')
+
+
+def do_plan(client, config, catalog, state):
+    LOGGER.info('Starting plan')
+    plan = plan_sync(client=client, config=config, catalog=catalog, state=state)
+    log_plan(plan)
+    json.dump(plan, sys.stdout, indent=2)
+    LOGGER.info('Finished plan')
+
+
+@singer.utils.handle_top_exception(LOGGER)
+def main():
+    LOGGER.info('Running main method....')
+
+    parsed_args = parse_args()
+
+    state = {}
+    if parsed_args.state:
+        state = parsed_args.state
+
+    config = {}
+    if parsed_args.config:
+        config = parsed_args.config
+
+    if parsed_args.replay_spool:
+        replay_spool(config, state)
+        return
+    if parsed_args.backfill_split is not None:
+        stream_names = [stream.tap_stream_id
+                        for stream in parsed_args.catalog.get_selected_streams(state)]
+        jobs = write_backfill_jobs(config, stream_names, parsed_args.backfill_split)
+        json.dump(jobs, sys.stdout, indent=2)
+        return
+    if parsed_args.backfill_merge:
+        job_states = [utils.load_json(path) for path in parsed_args.backfill_merge]
+        json.dump(merge_backfill_states(job_states, state), sys.stdout, indent=2)
+        return
+
+    transport = get_transport(config)
+    client = get_client(config, transport)
+
+    try:
+        if parsed_args.discover:
+            do_discover(client, parsed_args.config)
+        elif parsed_args.plan:
+            do_plan(client=client,
+                    config=parsed_args.config,
+                    catalog=parsed_args.catalog,
+                    state=state)
+        elif parsed_args.daemon:
+            run_daemon(client=client,
+                       config=parsed_args.config,
+                       catalog=parsed_args.catalog,
+                       state=state)
+        elif parsed_args.catalog:
+            sync(client=client,
+                 config=parsed_args.config,
+                 catalog=parsed_args.catalog,
+                 state=state)
+    finally:
+        if transport is not None:
+            transport.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+import json
+import os
+import weakref
+
+import singer
+from suds.client import Client, ServiceSelector
+from suds.options import Options
+from suds.properties import Unskin
+from suds.transport.https import HttpAuthenticated
+
+from tap_ilevel.replay_transport import share_transport
+
+from tap_ilevel.hybrid import DEFAULT_SNAPSHOT_DIR
+
+LOGGER = singer.get_logger()
+
+# Account clients by run client, kept for the next syncs with the same client (daemon mode)
+ACCOUNT_CLIENTS = weakref.WeakKeyDictionary()
+
+# Multi-account runs: the config lists several iLevel accounts under "accounts", each an object
+#  of settings overriding the shared (top level) config for that account:
+#   name: account name (required, unique), key of its state (accounts.<name>)
+#   username, password: the account credentials
+#   stream_prefix: prefix of the account's output stream names (default "<name>_")
+#   any other setting, e.g. start_date, calc_scenarios, scope_*, service_url
+# The accounts are synced one after the other in one process, sharing the parsed WSDL (clients
+#  share the parsed WSDL of the service URL), the output writer and spool, the conversion pool,
+#  the time budget, the run profile, the fx table and any record/replay transport. Each account
+#  keeps its own bookmarks and hybrid snapshots (snapshot_dir/<name>).
+
+
+def get_accounts(config):
+    accounts = config.get('accounts')
+    if not accounts:
+        return []
+    if isinstance(accounts, str):
+        accounts = json.loads(accounts)
+
+    shared = {key: value for key, value in config.items() if key != 'accounts'}
+    result = []
+    names = set()
+    for account in accounts:
+        name = account.get('name')
+        if not name or name in names:
+            raise Exception('accounts: each account needs a unique name, got: {}'.format(name))
+        names.add(name)
+        account_config = dict(shared, **account)
+        account_config.setdefault('stream_prefix', '{}_'.format(name))
+        account_config.setdefault(
+            'snapshot_dir', os.path.join(shared.get('snapshot_dir', DEFAULT_SNAPSHOT_DIR), name))
+        result.append((name, account_config))
+    return result
+
+
+def get_account_state(state, name):
+    return state.setdefault('accounts', {}).setdefault(name, {})
+
+
+# Account names in sync order: starting with the account interrupted in the last run (if any).
+def get_account_order(accounts, state):
+    names = [name for name, _ in accounts]
+    last_account = state.get('currently_syncing_account')
+    if last_account in names:
+        index = names.index(last_account)
+        names = names[index:] + names[:index]
+    return names
+
+
+def set_currently_syncing_account(state, name):
+    if name is None:
+        state.pop('currently_syncing_account', None)
+    else:
+        state['currently_syncing_account'] = name
+
+
+# Client sharing the parsed WSDL (and the plugins) of another, as suds Client.clone() does but
+#  without deep copying the options, which fails on recent Pythons (and for transports holding
+#  open files). See replay_transport.share_transport for the transport.
+def clone_client(client):
+    class Uninitialized(Client):
+        def __init__(self): # pylint: disable=super-init-not-called
+            pass
+    clone = Uninitialized()
+    clone.options = Options()
+    Unskin(clone.options).update({name: value for name, value in
+                                  Unskin(client.options).defined.items() if name != 'transport'})
+    clone.set_options(transport=share_transport(client.options.transport) or HttpAuthenticated())
+    clone.wsdl = client.wsdl
+    clone.factory = client.factory
+    clone.service = ServiceSelector(clone, client.wsdl.services)
+    clone.sd = client.sd
+    clone.messages = dict(tx=None, rx=None)
+    return clone
+
+
+# SOAP clients of the accounts, by name. Accounts on the service URL of the run's client share
+#  its parsed WSDL; others get their own client (WSDL parsed once per URL).
+def get_account_clients(client, accounts):
+    # Imported here: the package __init__ imports the sync module, which imports this one
+    from tap_ilevel import get_client, get_security, get_service_url
+
+    key = json.dumps(accounts, sort_keys=True, default=str)
+    cached = ACCOUNT_CLIENTS.get(client)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    clients_by_url = {client.wsdl.url: client}
+    clients = {}
+    for name, account_config in accounts:
+        wsdl_url = get_service_url(account_config) + '?singleWsdl'
+        base = clients_by_url.get(wsdl_url)
+        if base is None:
+            base = get_client(account_config, share_transport(client.options.transport))
+            clients_by_url[wsdl_url] = base
+        account_client = clone_client(base)
+        account_client.set_options(wsse=get_security(account_config))
+        clients[name] = account_client
+    LOGGER.info('Accounts: %s, sharing %s WSDL(s)', len(clients), len(clients_by_url))
+    ACCOUNT_CLIENTS[client] = (key, clients)
+    return clients
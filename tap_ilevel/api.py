@@ -0,0 +1,128 @@
+import copy
+import queue
+import threading
+
+import singer
+from singer.messages import RecordMessage, SchemaMessage, StateMessage
+
+from tap_ilevel.discover import discover
+from tap_ilevel.replay_transport import get_transport
+import tap_ilevel.singer_operations as singer_ops
+
+LOGGER = singer.get_logger()
+
+DEFAULT_QUEUE_SIZE = 1000
+END = object()
+
+
+class SyncCancelled(Exception):
+    pass
+
+
+# Output writer (see singer_operations.OUTPUT) handing messages to the consuming generator
+#  instead of stdout. The queue is bounded, so the sync only runs ahead of the consumer by
+#  queue_size messages.
+class QueueWriter:
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.cancelled = threading.Event()
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise SyncCancelled()
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def handles(self, stream_name): # pylint: disable=unused-argument
+        return True
+
+    def write_schema(self, stream_name, schema, key_properties):
+        self.put(SchemaMessage(stream=stream_name, schema=schema, key_properties=key_properties))
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        self.put(RecordMessage(stream=stream_name, record=record, time_extracted=time_extracted))
+
+    def write_state(self, state):
+        self.put(StateMessage(value=copy.deepcopy(state)))
+
+    def close_stream(self, stream_name):
+        pass
+
+    def flush(self):
+        pass
+
+
+# Select streams (and all their fields) in a catalog, deselecting the others.
+def select_streams(catalog, stream_names):
+    for stream in catalog.streams:
+        for entry in stream.metadata:
+            if entry['breadcrumb'] == ():
+                entry['metadata']['selected'] = stream.tap_stream_id in stream_names
+    return catalog
+
+
+# Run a sync in process, yielding its Singer messages (SchemaMessage, RecordMessage with the
+#  transformed record, StateMessage) instead of writing them to stdout. The sync runs in a
+#  worker thread; closing the generator early stops it at its next message. Errors are raised
+#  in the consumer. output_mode is ignored (no RECORD/BATCH output is written).
+#   client: SOAP client (default: built from config, with any record/replay transport)
+def iter_sync(config, catalog, state=None, client=None, queue_size=DEFAULT_QUEUE_SIZE):
+    # Imported here: the package __init__ imports this module
+    from tap_ilevel import get_client
+    from tap_ilevel.sync import sync
+
+    state = state if state is not None else {}
+    transport = None
+    if client is None:
+        transport = get_transport(config)
+        client = get_client(config, transport)
+
+    writer = QueueWriter(queue_size)
+    errors = []
+
+    def run():
+        try:
+            sync(client=client, config=config, catalog=catalog, state=state, output_writer=writer)
+        except SyncCancelled:
+            LOGGER.info('In process sync cancelled by the consumer')
+        except BaseException as err: # pylint: disable=broad-except
+            errors.append(err)
+        finally:
+            singer_ops.set_output_writer(None)
+            if not writer.cancelled.is_set():
+                writer.queue.put(END)
+
+    worker = threading.Thread(target=run, name='tap-ilevel-sync', daemon=True)
+    worker.start()
+    try:
+        while True:
+            message = writer.queue.get()
+            if message is END:
+                break
+            yield message
+        if errors:
+            raise errors[0]
+    finally:
+        writer.cancelled.set()
+        worker.join()
+        if transport is not None:
+            transport.close()
+
+
+# Records of one stream as transformed dicts, interleaved with state checkpoints: yields
+#  ('record', record) and ('state', state) tuples. The state is a copy as of the checkpoint,
+#  ready to be saved for the next run.
+#   stream_name: stream to sync (see streams.STREAMS)
+#   catalog: optional catalog for field selection (default: all fields of the stream)
+def iter_records(stream_name, config, state=None, catalog=None, client=None):
+    if catalog is None:
+        catalog = select_streams(discover(), [stream_name])
+    for message in iter_sync(config, catalog, state=state, client=client):
+        if isinstance(message, RecordMessage) and message.stream == stream_name:
+            yield 'record', message.record
+        elif isinstance(message, StateMessage):
+            yield 'state', message.value
@@ -0,0 +1,163 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import singer
+
+from tap_ilevel.bookmarks import parse_bookmark, format_bookmark, max_bookmark
+from tap_ilevel.constants import MAX_DATE_WINDOW
+
+LOGGER = singer.get_logger()
+
+# Streams extracted by date window (see ilevel_api.get_date_chunks), which a backfill splits
+BACKFILL_STREAMS = ['periodic_data_standardized', 'investment_transactions', 'currency_rates']
+DEFAULT_BACKFILL_DIR = 'backfill_jobs'
+
+
+# Historical loads split into independent jobs (--backfill-split), e.g. to run on several
+#  machines. Each job is a config (a copy of the config with backfill_job set) extracting one
+#  stream between an explicit start and end date:
+#   backfill_job: {"name", "stream", "start_date", "end_date", "backfill_start"}
+#  (backfill_start: start of the whole backfill, i.e. of the stream's first job)
+# A job syncs only its stream, up to its end_date instead of now, with its state under
+#  backfills.<name> (the job, and whether it completed). --backfill-merge combines the states of
+#  the finished jobs into the bookmarks of a regular state, for incremental runs afterwards.
+class Backfill:
+    def __init__(self):
+        self.job = None
+
+    @property
+    def active(self):
+        return self.job is not None
+
+    def configure(self, config):
+        self.job = config.get('backfill_job')
+        if isinstance(self.job, str):
+            self.job = json.loads(self.job)
+        if self.active and self.job.get('stream') not in BACKFILL_STREAMS:
+            raise Exception('backfill_job: Stream {} is not extracted by date window ({})'.format(
+                self.job.get('stream'), ', '.join(BACKFILL_STREAMS)))
+
+    def allows(self, stream_name):
+        return not self.active or stream_name == self.job['stream']
+
+    # End of the extraction windows: the job's end date, else now. Bookmarks are UTC, so the
+    #  window end is UTC too (not the host's local time).
+    def get_end_date(self):
+        if self.active:
+            return parse_bookmark(self.job['end_date'])
+        return datetime.utcnow()
+
+    # The job's part of the state, under backfills.<name>.
+    def get_state(self, state):
+        job_state = state.setdefault('backfills', {}).setdefault(self.job['name'], {})
+        job_state['job'] = self.job
+        return job_state
+
+    def complete(self, job_state):
+        job_state['completed'] = True
+        LOGGER.info('Backfill job %s complete', self.job['name'])
+
+
+BACKFILL = Backfill()
+
+
+# Split the date range of each stream, from start_date to end_date (default: today, UTC), into up
+#  to job_count jobs of whole date windows (MAX_DATE_WINDOW days).
+def split_backfill(config, stream_names, job_count, end_date=None):
+    start = parse_bookmark(config['start_date'][:10])
+    end = parse_bookmark(end_date[:10]) if end_date else \
+        parse_bookmark(datetime.utcnow().strftime('%Y-%m-%d'))
+    windows = max(1, -(-(end - start).days // MAX_DATE_WINDOW))
+    job_count = max(1, min(job_count, windows))
+    jobs = []
+    for stream_name in stream_names:
+        if stream_name not in BACKFILL_STREAMS:
+            LOGGER.info('Backfill: %s is not extracted by date window, not split', stream_name)
+            continue
+        first_window = 0
+        for index in range(job_count):
+            last_window = windows * (index + 1) // job_count
+            job_start = start + timedelta(days=first_window * MAX_DATE_WINDOW)
+            job_end = min(end, start + timedelta(days=last_window * MAX_DATE_WINDOW))
+            jobs.append({
+                'name': '{}-{:03d}'.format(stream_name, index + 1),
+                'stream': stream_name,
+                'start_date': format_bookmark(job_start),
+                'end_date': format_bookmark(job_end),
+                'backfill_start': format_bookmark(start)
+            })
+            first_window = last_window
+    return jobs
+
+
+# Write a config per job to backfill_dir (default backfill_jobs), returning the jobs and paths.
+def write_backfill_jobs(config, stream_names, job_count):
+    backfill_dir = config.get('backfill_dir') or DEFAULT_BACKFILL_DIR
+    os.makedirs(backfill_dir, exist_ok=True)
+    jobs = []
+    for job in split_backfill(config, stream_names, job_count, config.get('backfill_end_date')):
+        job_config = dict(config, start_date=job['start_date'], backfill_job=job)
+        path = os.path.join(backfill_dir, '{}.json'.format(job['name']))
+        with open(path, 'w') as file:
+            json.dump(job_config, file, indent=2)
+        jobs.append(dict(job, config=path))
+        LOGGER.info('Backfill: %s, %s to %s: %s', job['name'], job['start_date'],
+                    job['end_date'], path)
+    return jobs
+
+
+# Bookmarks by stream from the job states: the end of the completed jobs contiguous from the
+#  start of the backfill (or, for jobs without backfill_start, from the earliest job start).
+#  Later jobs (after an incomplete or missing one) are reported and left out.
+def __merge_jobs(job_states):
+    jobs_by_stream = {}
+    for job_state in job_states.values():
+        job = job_state.get('job') or {}
+        if job.get('stream'):
+            jobs_by_stream.setdefault(job['stream'], []).append(job_state)
+
+    bookmarks = {}
+    for stream_name, stream_jobs in jobs_by_stream.items():
+        stream_jobs.sort(key=lambda job_state: parse_bookmark(job_state['job']['start_date']))
+        first_job = stream_jobs[0]['job']
+        # End of the range covered by the completed jobs so far
+        covered = first_job.get('backfill_start') or first_job['start_date']
+        bookmark = None
+        for job_state in stream_jobs:
+            job = job_state['job']
+            contiguous = parse_bookmark(job['start_date']) <= parse_bookmark(covered)
+            if not contiguous or not job_state.get('completed'):
+                LOGGER.warning('Backfill merge: %s is %s, %s bookmark stops at %s', job['name'],
+                               'not complete' if contiguous else 'after a gap', stream_name,
+                               bookmark)
+                break
+            covered = job['end_date']
+            bookmark = job['end_date']
+        if bookmark is not None:
+            bookmarks[stream_name] = bookmark
+    return bookmarks
+
+
+def __merge_into(state, job_states):
+    for stream_name, bookmark in __merge_jobs(job_states).items():
+        bookmarks = state.setdefault('bookmarks', {})
+        bookmarks[stream_name] = max_bookmark(bookmarks.get(stream_name), bookmark)
+        LOGGER.info('Backfill merge: %s bookmark %s', stream_name, bookmarks[stream_name])
+
+
+# Regular state (base state, default empty) with the bookmarks of the finished backfill jobs
+#  in the job states (also per account, see accounts.py).
+def merge_backfill_states(states, base_state=None):
+    merged = json.loads(json.dumps(base_state or {}))
+    job_states = {}
+    account_job_states = {}
+    for state in states:
+        job_states.update(state.get('backfills', {}))
+        for name, account_state in state.get('accounts', {}).items():
+            account_job_states.setdefault(name, {}).update(account_state.get('backfills', {}))
+
+    __merge_into(merged, job_states)
+    for name, account_states in account_job_states.items():
+        __merge_into(merged.setdefault('accounts', {}).setdefault(name, {}), account_states)
+    return merged
@@ -0,0 +1,238 @@
+import copy
+import gzip
+import os
+from datetime import datetime
+
+import simplejson
+import singer
+from singer import utils
+from singer.messages import Message
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.accounts import get_accounts
+
+# pyarrow is optional; Parquet batches are only available when it is installed.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BATCH_MAX_RECORDS = 100000
+DEFAULT_BATCH_STAGING_DIR = 'batch_staging'
+# Records held in memory per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 10000
+# Extraction time of each batched record (the time_extracted of its RECORD message), added to the
+#  stream's schema as the Singer SDK metadata column
+EXTRACTED_AT_FIELD = '_sdc_extracted_at'
+EXTRACTED_AT_SCHEMA = {'type': ['null', 'string'], 'format': 'date-time'}
+
+
+# Singer BATCH message: points the target at one or more staged files of records for a stream.
+# Reference: https://sdk.meltano.com/en/latest/batch.html
+class BatchMessage(Message):
+    def __init__(self, stream, encoding, manifest):
+        self.stream = stream
+        self.encoding = encoding
+        self.manifest = manifest
+
+    def asdict(self):
+        return {
+            'type': 'BATCH',
+            'stream': self.stream,
+            'encoding': self.encoding,
+            'manifest': self.manifest
+        }
+
+
+# Arrow type of a JSON schema property: nullable (null) types and anyOf [null, type] map to the
+#  non-null type, objects to structs of their properties, arrays to lists of their items. Date-time
+#  values stay strings, as in the jsonl files.
+def get_arrow_type(json_schema):
+    if 'anyOf' in json_schema:
+        options = [option for option in json_schema['anyOf'] if option.get('type') != 'null']
+        return get_arrow_type(options[0]) if len(options) == 1 else pyarrow.string()
+    types = json_schema.get('type', [])
+    if isinstance(types, str):
+        types = [types]
+    types = [json_type for json_type in types if json_type != 'null']
+    json_type = types[0] if len(types) == 1 else 'string'
+    if json_type == 'integer':
+        return pyarrow.int64()
+    if json_type == 'number':
+        return pyarrow.float64()
+    if json_type == 'boolean':
+        return pyarrow.bool_()
+    if json_type == 'object' and json_schema.get('properties'):
+        return pyarrow.struct([pyarrow.field(name, get_arrow_type(property_schema))
+                               for name, property_schema in json_schema['properties'].items()])
+    if json_type == 'array' and json_schema.get('items'):
+        return pyarrow.list_(get_arrow_type(json_schema['items']))
+    return pyarrow.string()
+
+
+# Arrow schema of a stream's JSON schema (SCHEMA message), the same for all the stream's files.
+def get_arrow_schema(json_schema):
+    return pyarrow.schema([pyarrow.field(name, get_arrow_type(property_schema))
+                           for name, property_schema in json_schema.get('properties', {}).items()])
+
+
+# A single staged file for a stream. Files are written under a '.part' name and renamed once
+#  closed, so a BATCH manifest only ever references complete files. Parquet files are written in
+#  row groups of PARQUET_ROW_GROUP_SIZE records, with the stream's Arrow schema (or, for a stream
+#  without a SCHEMA message, the schema inferred from the first row group).
+class BatchFile:
+    def __init__(self, path, batch_format, arrow_schema=None):
+        self.path = path
+        self.part_path = path + '.part'
+        self.batch_format = batch_format
+        self.arrow_schema = arrow_schema
+        self.record_count = 0
+        self.records = []
+        self.file = None
+        self.parquet_writer = None
+        if batch_format == 'jsonl':
+            self.file = gzip.open(self.part_path, 'wt', encoding='utf-8')
+
+    def write(self, record):
+        if self.file is not None:
+            self.file.write(simplejson.dumps(record, use_decimal=True))
+            self.file.write('\n')
+        else:
+            self.records.append(record)
+            if len(self.records) >= PARQUET_ROW_GROUP_SIZE:
+                self.__write_row_group()
+        self.record_count = self.record_count + 1
+
+    def __write_row_group(self):
+        table = pyarrow.Table.from_pylist(self.records, schema=self.arrow_schema)
+        if self.parquet_writer is None:
+            self.arrow_schema = table.schema
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(
+                self.part_path, self.arrow_schema, compression='snappy')
+        self.parquet_writer.write_table(table)
+        self.records = []
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        else:
+            if self.records or self.parquet_writer is None:
+                self.__write_row_group()
+            self.parquet_writer.close()
+        os.replace(self.part_path, self.path)
+
+
+# Writes records into rotating compressed files per stream and emits BATCH messages on stdout.
+#  STATE is held back while a file with records is open and emitted after the file is closed,
+#  so a target never receives a bookmark ahead of the records it covers.
+class BatchWriter:
+    def __init__(self, staging_dir, batch_format='jsonl', max_records=DEFAULT_BATCH_MAX_RECORDS,
+                 streams=None):
+        if batch_format not in ('jsonl', 'parquet'):
+            raise ValueError('Unsupported batch_format: {}'.format(batch_format))
+        if batch_format == 'parquet' and pyarrow is None:
+            raise ImportError('batch_format "parquet" requires pyarrow to be installed')
+
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.batch_format = batch_format
+        self.max_records = max_records
+        self.streams = streams
+        self.files = {}
+        self.file_index = {}
+        # Arrow schema by stream, from its SCHEMA message (parquet)
+        self.arrow_schemas = {}
+        self.pending_state = None
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def handles(self, stream_name):
+        return self.streams is None or stream_name in self.streams
+
+    def __new_file(self, stream_name):
+        index = self.file_index.get(stream_name, 0) + 1
+        self.file_index[stream_name] = index
+        extension = 'jsonl.gz' if self.batch_format == 'jsonl' else 'parquet'
+        file_name = '{}-{}-{:05d}.{}'.format(
+            stream_name, datetime.utcnow().strftime('%Y%m%dT%H%M%S'), index, extension)
+        return BatchFile(os.path.join(self.staging_dir, file_name), self.batch_format,
+                         self.arrow_schemas.get(stream_name))
+
+    def write_schema(self, stream_name, schema, key_properties):
+        if self.handles(stream_name):
+            properties = dict(schema.get('properties', {}))
+            properties[EXTRACTED_AT_FIELD] = EXTRACTED_AT_SCHEMA
+            schema = dict(schema, properties=properties)
+        if self.batch_format == 'parquet':
+            self.arrow_schemas[stream_name] = get_arrow_schema(schema)
+        singer.write_schema(stream_name, schema, key_properties)
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        record = dict(record)
+        record[EXTRACTED_AT_FIELD] = utils.strftime(time_extracted) if time_extracted else None
+        batch_file = self.files.get(stream_name)
+        if batch_file is None:
+            batch_file = self.__new_file(stream_name)
+            self.files[stream_name] = batch_file
+
+        batch_file.write(record)
+        if batch_file.record_count >= self.max_records:
+            self.close_stream(stream_name)
+
+    def write_state(self, state):
+        self.pending_state = copy.deepcopy(state)
+        if not self.files:
+            self.__emit_pending_state()
+
+    def __emit_pending_state(self):
+        if self.pending_state is not None:
+            singer.write_state(self.pending_state)
+            self.pending_state = None
+
+    def close_stream(self, stream_name):
+        batch_file = self.files.pop(stream_name, None)
+        if batch_file is None:
+            return
+        batch_file.close()
+
+        if self.batch_format == 'jsonl':
+            encoding = {'format': 'jsonl', 'compression': 'gzip'}
+        else:
+            encoding = {'format': 'parquet', 'compression': 'snappy'}
+        LOGGER.info('%s: Closed batch file %s (%s records)',
+                    stream_name, batch_file.path, batch_file.record_count)
+        singer.write_message(BatchMessage(
+            stream=stream_name,
+            encoding=encoding,
+            manifest=['file://{}'.format(batch_file.path)]))
+
+        if not self.files:
+            self.__emit_pending_state()
+
+    def flush(self):
+        for stream_name in list(self.files):
+            self.close_stream(stream_name)
+        self.__emit_pending_state()
+
+
+# Build a BatchWriter from config when output_mode is "batch", otherwise None (RECORD output).
+#   batch_format: jsonl (gzip, default) or parquet (requires pyarrow)
+#   batch_staging_dir: local directory for staged files
+#   batch_max_records: records per file before rotating
+#   batch_streams: optional list of streams to batch; others are still emitted as RECORDs
+# The writer is handed output names: in multi-account runs, batch_streams is expanded with the
+#  stream_prefix of each account.
+def get_batch_writer(config):
+    if config.get('output_mode', 'records') != 'batch':
+        return None
+    streams = tap_config.get_list(config, 'batch_streams')
+    if streams is not None:
+        prefixes = [account_config['stream_prefix']
+                    for _, account_config in get_accounts(config)] or ['']
+        streams = [prefix + stream_name for prefix in prefixes for stream_name in streams]
+    return BatchWriter(
+        staging_dir=config.get('batch_staging_dir', DEFAULT_BATCH_STAGING_DIR),
+        batch_format=config.get('batch_format', 'jsonl'),
+        max_records=tap_config.get_int(config, 'batch_max_records', DEFAULT_BATCH_MAX_RECORDS),
+        streams=streams)
@@ -0,0 +1,81 @@
+import json
+from datetime import datetime, timedelta
+
+import singer
+from singer import utils
+
+LOGGER = singer.get_logger()
+
+# Bookmarks are kept at full precision as UTC timestamps, in the format the Singer Transformer
+#  writes date-time fields. Date only bookmarks (from earlier states, or start_date) are read as
+#  midnight.
+BOOKMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Overlap (days) re-extracted before the bookmark on each run, unless set in lookback_days.
+#  Calculated data recalculates the past year.
+DEFAULT_LOOKBACK_DAYS = {
+    'periodic_data_calculated': 365
+}
+# Days before the window start from which extracted records are still published, unless set in
+#  record_lookback_days. Only filters records, nothing more is extracted: standardized data
+#  updated in the window keeps values reported up to 14 days before it.
+DEFAULT_RECORD_LOOKBACK_DAYS = {
+    'periodic_data_standardized': 14
+}
+
+
+def parse_bookmark(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, BOOKMARK_FORMAT)
+    except ValueError:
+        pass
+    if len(value) == 10:
+        return datetime.strptime(value, '%Y-%m-%d')
+    return utils.strptime_to_utc(value).replace(tzinfo=None)
+
+
+def format_bookmark(dttm):
+    return parse_bookmark(dttm).strftime(BOOKMARK_FORMAT)
+
+
+# Later of two bookmarks (either may be None), as a formatted bookmark.
+def max_bookmark(value, other):
+    values = [parse_bookmark(i) for i in (value, other) if i is not None]
+    return format_bookmark(max(values)) if values else None
+
+
+# lookback_days (or record_lookback_days, with key and defaults): a number of days for all
+#  streams, or an object of days by stream (streams not listed keep the defaults). Fractions of
+#  a day are allowed.
+def get_lookback(config, stream_name, key='lookback_days', defaults=None):
+    value = config.get(key)
+    if isinstance(value, str) and value.strip().startswith('{'):
+        value = json.loads(value)
+    days = (DEFAULT_LOOKBACK_DAYS if defaults is None else defaults).get(stream_name, 0)
+    if isinstance(value, dict):
+        days = value.get(stream_name, days)
+    elif value is not None and value != '':
+        days = value
+    return timedelta(days=float(days))
+
+
+# Start of the extraction window: the stream's bookmark (high water mark) less its lookback,
+#  but not before start_date.
+def get_window_start(config, stream_name, bookmark, start_date):
+    window_start = parse_bookmark(bookmark) - get_lookback(config, stream_name)
+    window_start = format_bookmark(max(window_start, parse_bookmark(start_date)))
+    LOGGER.info('%s: Bookmark %s, lookback %s, window start %s', stream_name, bookmark,
+                get_lookback(config, stream_name), window_start)
+    return window_start
+
+
+# Earliest bookmark value of the records published: the window start less the stream's record
+#  lookback, but not before start_date.
+def get_records_start(config, stream_name, window_start, start_date):
+    records_start = parse_bookmark(window_start) - get_lookback(
+        config, stream_name, 'record_lookback_days', DEFAULT_RECORD_LOOKBACK_DAYS)
+    return format_bookmark(max(records_start, parse_bookmark(start_date)))
@@ -0,0 +1,36 @@
+# Helpers for reading optional settings from the tap config. Values supplied through config.json
+#  are frequently strings ("true", "100"), so they are normalized here rather than at each
+#  call site.
+
+
+def get_bool(config, key, default=False):
+    value = config.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip() in {'true', 'True', 'TRUE', '1'}
+
+
+def get_int(config, key, default=None):
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def get_float(config, key, default=None):
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    return float(value)
+
+
+# Lists may be supplied as JSON arrays or as comma separated strings ("Actual, Budget").
+def get_list(config, key, default=None):
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item.strip() for item in str(value).split(',') if item.strip()]
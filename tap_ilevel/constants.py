@@ -6,8 +6,18 @@ ALL_RECORDS_STREAMS = ["assets", "funds", "investments", "securities", "scenario
     "asset_to_asset_relations", "fund_to_asset_relations", "fund_to_fund_relations"]
 INCREMENTAL_STREAMS = [] # data_items moved to ALL_ b/c missing fields w/ incremental calls
 OTHER_STREAMS = ['investment_transactions']
+# ALL_RECORDS_STREAMS that may be run incrementally (GetUpdatedObjects/GetDeletedObjects) between
+#  periodic full sweeps, see hybrid_incremental_streams config.
+HYBRID_STREAMS = ["assets", "funds", "investments", "securities", "data_items",\
+    "asset_to_asset_relations", "fund_to_asset_relations", "fund_to_fund_relations"]
 STANDARDIZED_PERIODIC_DATA_STREAMS = ["periodic_data_standardized"]
 
+# Calculated data: iGetBatch requests per batch
+CALC_BATCH_SIZE = 10000
+# Calculated data: default scenarios and currencies (calc_scenarios, calc_currencies config)
+DEFAULT_CALC_SCENARIOS = ['Actual']
+DEFAULT_CALC_CURRENCIES = ['USD']
+
 #API calls frequently limit request operations to max window periods, define max period here: Note
 #API consistently uses same limitation across calls, so single limit is appropriate
 MAX_DATE_WINDOW = 14
@@ -0,0 +1,166 @@
+import multiprocessing
+import os
+import re
+import tempfile
+
+import singer
+from singer import metadata, Transformer
+from suds.cache import NoCache
+from suds.client import Client
+from suds.transport import Request
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.fx import FX
+import tap_ilevel.ilevel_api as ilevel
+
+LOGGER = singer.get_logger()
+
+# Values per chunk handed to a worker. A chunk of 2,000 values is roughly 1-2 MB of reply XML
+#  and takes about a second to parse, unmarshal and transform, against a few milliseconds to
+#  pickle the chunk and its records; replies under one chunk are converted in process.
+DEFAULT_CHUNK_SIZE = 2000
+
+# Top level DataValue elements (not DataValueType) and the end of the result in iGetBatch replies
+DATA_VALUE_START_RE = re.compile(rb'<(?:[\w.-]+:)?DataValue[\s/>]')
+RESULT_END_RE = re.compile(rb'</(?:[\w.-]+:)?iGetBatchResult>')
+
+# SOAP client of a worker process, built from the WSDL by init_worker
+WORKER = {'client': None}
+
+
+def init_worker(wsdl_path, port):
+    client = Client('file://{}'.format(wsdl_path), cache=NoCache())
+    client.set_options(port=port)
+    WORKER['client'] = client
+
+
+# Parse, unmarshal and convert an iGetBatch reply into transformed (ready to serialize)
+#  periodic data records, as process_records would before publishing them.
+#   fx: fx.FxTable deriving rows in other currencies (default: none)
+def convert_reply(client, reply, stream_name, schema, stream_metadata, first_entity_only,
+                  fx=None):
+    data_values = client.service.iGetBatch(__inject={'reply': reply})
+    rows = ilevel.get_data_value_rows(data_values, stream_name, first_entity_only, fx=fx)
+    records = []
+    with Transformer() as transformer:
+        for row in rows:
+            record = row.to_dict()
+            record['is_soft_deleted'] = False
+            records.append(transformer.transform(record, schema, stream_metadata))
+    return records
+
+
+def convert_reply_chunk(task):
+    try:
+        return convert_reply(WORKER['client'], *task)
+    except Exception as err:
+        # suds faults hold parsed documents, which do not pickle back to the parent
+        raise RuntimeError('{}: {}'.format(type(err).__name__, err)) from None
+
+
+# Split an iGetBatch reply into replies of up to chunk_size DataValues each: the envelope up to
+#  the first DataValue and from the end of the result is repeated around each run of values.
+def split_reply(reply, chunk_size):
+    starts = [match.start() for match in DATA_VALUE_START_RE.finditer(reply)]
+    result_ends = [match.start() for match in RESULT_END_RE.finditer(reply)]
+    if len(starts) <= chunk_size or not result_ends:
+        return [reply]
+
+    end = result_ends[-1]
+    head = reply[:starts[0]]
+    tail = reply[end:]
+    chunks = []
+    for index in range(0, len(starts), chunk_size):
+        stop = starts[index + chunk_size] if index + chunk_size < len(starts) else end
+        chunks.append(head + reply[starts[index]:stop] + tail)
+    return chunks
+
+
+# Optional process pool converting iGetBatch replies (periodic_data_standardized and
+#  periodic_data_calculated) off the main process. The main process fetches the raw reply XML
+#  (see ilevel_api.get_igetbatch_reply_xml) and splits it into chunks; workers parse, unmarshal
+#  and transform each chunk with their own SOAP client, and the records are returned in order.
+class ConversionPool:
+    def __init__(self):
+        self.pool = None
+        self.client = None
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.processes = None
+        self.wsdl_path = None
+        # Keep the workers between syncs with the same client and settings (daemon mode)
+        self.keep_open = False
+
+    @property
+    def enabled(self):
+        return self.pool is not None
+
+    def start(self, client, processes, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.close()
+        # Workers load the WSDL from a local copy, fetched through the client's transport (so
+        #  it is also recorded or replayed)
+        wsdl = client.options.transport.open(Request(client.wsdl.url)).read()
+        handle, self.wsdl_path = tempfile.mkstemp(prefix='tap-ilevel-', suffix='.wsdl')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(wsdl)
+
+        self.client = client
+        self.chunk_size = chunk_size
+        self.processes = processes
+        # spawn: the sync may run in a thread (api.iter_sync), which fork does not handle safely
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(processes, initializer=init_worker,
+                                 initargs=(self.wsdl_path, client.options.port))
+        LOGGER.info('Conversion pool: %s processes, %s values per chunk', processes, chunk_size)
+
+    # Transformed records of a reply, yielded as lists in reply order.
+    def convert(self, req_state, reply, first_entity_only=False):
+        stream = req_state.catalog.get_stream(req_state.stream_name)
+        schema = stream.schema.to_dict()
+        stream_metadata = metadata.to_map(stream.metadata)
+
+        chunks = split_reply(reply, self.chunk_size)
+        if len(chunks) == 1:
+            yield convert_reply(self.client, reply, req_state.stream_name, schema,
+                                stream_metadata, first_entity_only,
+                                fx=FX if FX.enabled else None)
+            return
+
+        # Workers get only the rate pairs used for derived rows
+        fx = FX.subset() if FX.enabled else None
+        tasks = [(chunk, req_state.stream_name, schema, stream_metadata, first_entity_only, fx)
+                 for chunk in chunks]
+        for records in self.pool.imap(convert_reply_chunk, tasks):
+            yield records
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.wsdl_path is not None:
+            os.remove(self.wsdl_path)
+            self.wsdl_path = None
+        self.client = None
+
+    # End of a sync: close the pool, unless kept for the next one.
+    def release(self):
+        if not self.keep_open:
+            self.close()
+
+
+CONVERSION = ConversionPool()
+
+
+# Config:
+#   conversion_processes: worker processes converting iGetBatch replies (default: none, convert
+#     in process)
+#   conversion_chunk_size: DataValues per chunk handed to a worker (default 2000)
+def configure_conversion(config, client):
+    processes = tap_config.get_int(config, 'conversion_processes')
+    chunk_size = tap_config.get_int(config, 'conversion_chunk_size', DEFAULT_CHUNK_SIZE)
+    if CONVERSION.enabled and CONVERSION.client is client \
+        and (CONVERSION.processes, CONVERSION.chunk_size) == (processes, chunk_size):
+        return
+    CONVERSION.close()
+    if processes:
+        CONVERSION.start(client, processes, chunk_size)
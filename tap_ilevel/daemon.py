@@ -0,0 +1,76 @@
+import signal
+import sys
+import threading
+import time
+
+import singer
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.conversion_pool import CONVERSION
+from tap_ilevel.reference_cache import REFERENCES
+from tap_ilevel.sync import sync
+from tap_ilevel.time_budget import BUDGET
+import tap_ilevel.singer_operations as singer_ops
+
+LOGGER = singer.get_logger()
+
+DEFAULT_INTERVAL_SECONDS = 300
+DEFAULT_REFERENCE_TTL_SECONDS = 3600
+
+
+# Daemon mode (--daemon): one long running process syncing the catalog's selected streams every
+#  daemon_interval_seconds, with continuous Singer output. The SOAP client (parsed WSDL, HTTP
+#  connections), account clients, conversion workers and reference data (see reference_cache)
+#  stay warm between cycles, and the state carries over: each cycle starts from the bookmarks of
+#  the last one, and ends with a STATE message. Select incremental (or hybrid) streams, since
+#  full table streams are extracted again each cycle.
+# SIGTERM/SIGINT stop the daemon: a running cycle stops at its next safe point (as for
+#  max_runtime_seconds) and records where to resume.
+# Config:
+#   daemon_interval_seconds: seconds between the starts of two cycles (default 300)
+#   daemon_max_cycles: stop after this many cycles (default: run until stopped)
+#   reference_cache_ttl_seconds: age of the reference data reused between cycles (default 3600,
+#     0 to fetch it each cycle)
+def run_daemon(client, config, catalog, state, output_writer=None):
+    interval = tap_config.get_float(config, 'daemon_interval_seconds', DEFAULT_INTERVAL_SECONDS)
+    max_cycles = tap_config.get_int(config, 'daemon_max_cycles')
+    REFERENCES.configure(tap_config.get_float(
+        config, 'reference_cache_ttl_seconds', DEFAULT_REFERENCE_TTL_SECONDS))
+    CONVERSION.keep_open = True
+
+    stopping = threading.Event()
+
+    def stop(signum, frame): # pylint: disable=unused-argument
+        LOGGER.info('Daemon: Signal %s, stopping', signum)
+        stopping.set()
+        BUDGET.cancel()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[signum] = signal.signal(signum, stop)
+
+    cycle = 0
+    try:
+        while not stopping.is_set():
+            cycle = cycle + 1
+            started = time.monotonic()
+            LOGGER.info('Daemon: Starting cycle %s', cycle)
+            sync(client=client, config=config, catalog=catalog, state=state,
+                 output_writer=output_writer)
+            # The state as of the end of the cycle, flushed for the target
+            singer_ops.write_state(state)
+            sys.stdout.flush()
+            elapsed = time.monotonic() - started
+            LOGGER.info('Daemon: Cycle %s done in %.1fs (%s reference replies reused)',
+                        cycle, elapsed, REFERENCES.hits)
+            if max_cycles and cycle >= max_cycles:
+                break
+            stopping.wait(max(0, interval - elapsed))
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        CONVERSION.keep_open = False
+        CONVERSION.close()
+        REFERENCES.configure(None)
+    LOGGER.info('Daemon: Stopped after %s cycles', cycle)
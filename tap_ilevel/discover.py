@@ -1,7 +1,10 @@
 from singer.catalog import Catalog, CatalogEntry, Schema
 from tap_ilevel.schema import get_schemas, STREAMS
+from tap_ilevel.pivot import get_wide_streams
 
-def discover():
+# client: with a SOAP client, also the wide streams of the periodic data (see pivot.py), whose
+#  columns are the data items from GetDataItems
+def discover(client=None):
     schemas, field_metadata = get_schemas()
     catalog = Catalog([])
 
@@ -17,4 +20,7 @@ def discover():
             metadata=mdata
         ))
 
+    if client is not None:
+        catalog.streams.extend(get_wide_streams(client))
+
     return catalog
@@ -0,0 +1,172 @@
+import bisect
+import gzip
+import json
+import os
+
+import singer
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.transform import periodic_hash_key, PeriodicDataRow, PERIODIC_DATA_FIELDS
+from tap_ilevel.constants import DEFAULT_CALC_CURRENCIES
+
+LOGGER = singer.get_logger()
+
+DEFAULT_FX_TABLE_PATH = 'fx_rates.json.gz'
+DEFAULT_BASE_CURRENCY = 'USD'
+# Data value types converted with the rate; others (numbers, text, dates) do not depend on the
+#  currency and are copied as they are, as iGetBatch would return them
+CURRENCY_VALUE_TYPES = {'Currency'}
+
+
+# Local table of mid rates by currency pair and date, kept from the currency_rates stream and
+#  persisted between runs (fx_table_path). With fx_currencies, periodic data rows in the base
+#  currency (fx_base_currency) are also published in each of those currencies, converted with the
+#  latest rate on or before the row's end of period, instead of requesting each currency from
+#  iGetBatch (see calc_currencies). Rates are looked up for the pair, or inverted from the
+#  reverse pair.
+class FxTable:
+    def __init__(self, currencies=None, base_currency=DEFAULT_BASE_CURRENCY, requested=None):
+        self.currencies = currencies or []
+        self.base_currency = base_currency
+        # stream_name: currencies requested from iGetBatch, not derived for the stream
+        self.requested = requested or {}
+        self.path = None
+        # (currency_from, currency_to): {date (YYYY-MM-DD): mid}
+        self.rates = {}
+        # (currency_from, currency_to): (sorted dates, mids), rebuilt after changes
+        self.index = {}
+        self.version = 0
+        self.missing = 0
+
+    @property
+    def enabled(self):
+        return bool(self.currencies)
+
+    def add(self, record):
+        date = (record.get('date') or '')[:10]
+        pair = (record.get('currency_from'), record.get('currency_to'))
+        if not date or None in pair:
+            return
+        if record.get('is_soft_deleted'):
+            self.rates.get(pair, {}).pop(date, None)
+        elif record.get('mid') is not None:
+            self.rates.setdefault(pair, {})[date] = float(record['mid'])
+        else:
+            return
+        self.index.pop(pair, None)
+        self.version = self.version + 1
+
+    def __lookup(self, pair, date):
+        if pair not in self.index:
+            rates = self.rates.get(pair)
+            if not rates:
+                return None
+            dates = sorted(rates)
+            self.index[pair] = (dates, [rates[day] for day in dates])
+        dates, mids = self.index[pair]
+        position = bisect.bisect_right(dates, date)
+        return mids[position - 1] if position else None
+
+    # Rate converting an amount in currency_from into currency_to as of a date.
+    def rate(self, currency_from, currency_to, date):
+        if currency_from == currency_to:
+            return 1.0
+        mid = self.__lookup((currency_from, currency_to), date)
+        if mid is not None:
+            return mid
+        mid = self.__lookup((currency_to, currency_from), date)
+        if mid:
+            return 1.0 / mid
+        return None
+
+    # Copy of the table with only the pairs used for derived rows (handed to conversion workers).
+    def subset(self):
+        table = FxTable(self.currencies, self.base_currency, self.requested)
+        for pair, rates in self.rates.items():
+            if self.base_currency in pair and (set(pair) & set(self.currencies)):
+                table.rates[pair] = rates
+        return table
+
+    # Currencies derived for a stream: the fx currencies, other than the base currency and those
+    #  the stream already requests from iGetBatch (their rows would have the same hash_key).
+    def get_currencies(self, stream_name=None):
+        requested = self.requested.get(stream_name, [])
+        return [currency for currency in self.currencies
+                if currency != self.base_currency and currency not in requested]
+
+    # Rows in each of the fx currencies derived from the base currency rows. Rows without a rate
+    #  for their end of period are skipped (counted in missing).
+    def derive_rows(self, rows, stream_name=None):
+        derived = []
+        currencies = self.get_currencies(stream_name)
+        for row in rows:
+            if row.currency_code != self.base_currency or not row.end_of_period_value:
+                continue
+            date = row.end_of_period_value[:10]
+            for currency in currencies:
+                values = {field: getattr(row, field) for field in PERIODIC_DATA_FIELDS}
+                if row.data_value_type in CURRENCY_VALUE_TYPES:
+                    rate = self.rate(self.base_currency, currency, date)
+                    if rate is None or row.value_numeric is None:
+                        self.missing = self.missing + 1
+                        continue
+                    value = row.value_numeric * rate
+                    values.update(value=value, value_string=str(value), value_numeric=value)
+                values.update(
+                    currency_code=currency,
+                    excel_formula=None,
+                    request_id=None,
+                    hash_key=periodic_hash_key(
+                        row.data_item_id, row.entity_id, row.scenario_id, row.period_type,
+                        row.end_of_period_value, currency, row.exchange_rate_type,
+                        row.data_value_type))
+                derived.append(PeriodicDataRow(**values))
+        return derived
+
+    def load(self, path):
+        self.path = path
+        self.rates = {}
+        self.index = {}
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                for key, rates in json.load(file).items():
+                    self.rates[tuple(key.split('|'))] = rates
+        self.version = self.version + 1
+        LOGGER.info('FX: Loaded %s rates for %s currency pairs from %s',
+                    sum(len(rates) for rates in self.rates.values()), len(self.rates), path)
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump({'|'.join(pair): rates for pair, rates in self.rates.items()}, file)
+        os.replace(tmp_path, self.path)
+        LOGGER.info('FX: Saved %s currency pairs to %s', len(self.rates), self.path)
+        if self.missing:
+            LOGGER.warning('FX: %s values without a rate were not derived', self.missing)
+
+
+FX = FxTable()
+
+
+# Config:
+#   fx_currencies: currencies derived from the base currency periodic data (default: none)
+#   fx_base_currency: currency of the rows converted (default USD)
+#   fx_table_path: local rate table (default fx_rates.json.gz)
+# Currencies listed more than once are derived once; calculated data is not derived in its
+#  calc_currencies, which iGetBatch returns.
+def configure_fx(config):
+    FX.currencies = list(dict.fromkeys(tap_config.get_list(config, 'fx_currencies', [])))
+    FX.base_currency = config.get('fx_base_currency') or DEFAULT_BASE_CURRENCY
+    calc_currencies = tap_config.get_list(config, 'calc_currencies', DEFAULT_CALC_CURRENCIES)
+    FX.requested = {'periodic_data_calculated': calc_currencies}
+    overlap = [currency for currency in FX.currencies if currency in calc_currencies]
+    if overlap:
+        LOGGER.info('FX: %s requested from iGetBatch (calc_currencies), not derived for '
+                    'periodic_data_calculated', ', '.join(overlap))
+    FX.missing = 0
+    FX.path = None
+    if FX.enabled:
+        FX.load(config.get('fx_table_path') or DEFAULT_FX_TABLE_PATH)
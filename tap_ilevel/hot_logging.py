@@ -0,0 +1,81 @@
+import logging
+import singer
+
+from tap_ilevel import config as tap_config
+
+LOGGER = singer.get_logger()
+
+# Record level dumps are disabled unless log_record_sample_every is configured.
+DEFAULT_RECORD_SAMPLE_EVERY = 0
+
+
+# Defers an expensive string conversion (e.g. sobject_to_dict of a full iGetBatch reply) until
+#  the log record is actually formatted by a handler.
+class LazyStr:
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+# Logging surface for the per-batch and per-record paths. Messages are emitted as
+#  'event key=value ...' and are only formatted when the level is enabled; record level output
+#  is additionally sampled so that only every Nth record per label is dumped.
+class HotPathLogger:
+    def __init__(self, logger, sample_every=DEFAULT_RECORD_SAMPLE_EVERY):
+        self.logger = logger
+        self.sample_every = sample_every
+        self.counters = {}
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def event(self, level, event_name, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        keys = sorted(fields)
+        fmt = ' '.join([event_name] + ['{}=%s'.format(key) for key in keys])
+        self.logger.log(level, fmt, *[fields[key] for key in keys])
+
+    def debug(self, event_name, **fields):
+        self.event(logging.DEBUG, event_name, **fields)
+
+    def info(self, event_name, **fields):
+        self.event(logging.INFO, event_name, **fields)
+
+    # Emit a DEBUG dump of a single record, once every sample_every calls for the given label.
+    def sample(self, label, record):
+        if not self.sample_every or not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        count = self.counters.get(label, 0)
+        self.counters[label] = count + 1
+        if count % self.sample_every == 0:
+            self.logger.debug('%s #%s (1 in %s): %s', label, count + 1, self.sample_every, record)
+
+
+HOT_LOGGER = HotPathLogger(LOGGER)
+
+
+# Apply logging config options:
+#   log_level: verbosity of the tap logger (DEBUG, INFO, WARNING, ...); default INFO
+#   log_record_sample_every: dump every Nth record at DEBUG level; 0 (default) disables dumps
+# The tap logs through the root logger (singer.get_logger), so the suds loggers are kept at INFO
+#  or above: at DEBUG they dump every SOAP envelope.
+def configure_logging(config):
+    level_name = str(config.get('log_level', 'INFO')).upper()
+    level = logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        LOGGER.warning('Unknown log_level %s, using INFO', level_name)
+        level = logging.INFO
+    LOGGER.setLevel(level)
+    logging.getLogger('suds').setLevel(max(level, logging.INFO))
+
+    HOT_LOGGER.sample_every = tap_config.get_int(
+        config, 'log_record_sample_every', DEFAULT_RECORD_SAMPLE_EVERY)
+    HOT_LOGGER.counters = {}
@@ -0,0 +1,107 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import humps
+import singer
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.constants import HYBRID_STREAMS
+import tap_ilevel.singer_operations as singer_ops
+
+LOGGER = singer.get_logger()
+
+DEFAULT_FULL_SWEEP_INTERVAL_DAYS = 7
+DEFAULT_SNAPSHOT_DIR = 'snapshots'
+
+# Hybrid mode for the full table entity and relation streams:
+#   - Day to day runs use GetUpdatedObjects/GetDeletedObjects ids and fetch details by id. The
+#     details returned for some object types are missing fields, these are backfilled from a
+#     locally cached snapshot of the last full sweep (updated with each incremental run).
+#   - A full sweep (Get<Objects>) runs every full_sweep_interval_days to reconcile, and rewrites
+#     the snapshot. The date of the last sweep is kept in state under 'full_sweeps'.
+# Config:
+#   hybrid_incremental_streams: list of streams to run in hybrid mode (see HYBRID_STREAMS)
+#   full_sweep_interval_days: days between full sweeps (default 7)
+#   snapshot_dir: local directory for the snapshot cache (default 'snapshots')
+
+
+def is_hybrid_stream(req_state):
+    streams = tap_config.get_list(req_state.config, 'hybrid_incremental_streams', [])
+    return req_state.stream_name in streams and req_state.stream_name in HYBRID_STREAMS
+
+
+def __get_snapshot_path(config, stream_name):
+    snapshot_dir = config.get('snapshot_dir', DEFAULT_SNAPSHOT_DIR)
+    return os.path.join(snapshot_dir, '{}.json.gz'.format(stream_name))
+
+
+def get_last_full_sweep(state, stream_name):
+    return (state or {}).get('full_sweeps', {}).get(stream_name)
+
+
+# A full sweep is due when none has been recorded, the snapshot is missing, or the configured
+#  interval has elapsed since the last sweep.
+def is_full_sweep_due(req_state):
+    last_sweep = get_last_full_sweep(req_state.state, req_state.stream_name)
+    if last_sweep is None:
+        return True
+    if not os.path.exists(__get_snapshot_path(req_state.config, req_state.stream_name)):
+        LOGGER.info('%s: Snapshot missing, full sweep required', req_state.stream_name)
+        return True
+
+    interval_days = tap_config.get_int(
+        req_state.config, 'full_sweep_interval_days', DEFAULT_FULL_SWEEP_INTERVAL_DAYS)
+    last_sweep_dttm = datetime.strptime(last_sweep[:10], '%Y-%m-%d')
+    return req_state.end_date - last_sweep_dttm >= timedelta(days=interval_days)
+
+
+def write_full_sweep(req_state):
+    sweep_date = req_state.end_date.strftime('%Y-%m-%d')
+    req_state.state.setdefault('full_sweeps', {})[req_state.stream_name] = sweep_date
+    LOGGER.info('%s: Recorded full sweep on %s', req_state.stream_name, sweep_date)
+    singer_ops.write_state(req_state.state)
+
+
+# Snapshot records are the raw (CamelCase) dicts returned by sobject_to_dict, keyed by Id.
+def load_snapshot(config, stream_name):
+    path = __get_snapshot_path(config, stream_name)
+    if not os.path.exists(path):
+        return {}
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        records = json.load(file)
+    LOGGER.info('%s: Loaded snapshot of %s records', stream_name, len(records))
+    return {record.get('Id'): record for record in records}
+
+
+def save_snapshot(config, stream_name, records_by_id):
+    path = __get_snapshot_path(config, stream_name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+        json.dump(list(records_by_id.values()), file)
+    os.replace(tmp_path, path)
+    LOGGER.info('%s: Saved snapshot of %s records', stream_name, len(records_by_id))
+
+
+# Fill fields missing (or null) in id based detail records from the snapshot, and update the
+#  snapshot with the merged records. The ids were updated (or deleted) in the window ending at
+#  window_end: a detail record without its replication key (bookmark_field) gets the window end
+#  rather than the snapshot's older value, which process_records would filter out.
+def backfill_records(records, snapshot, bookmark_field=None, window_end=None):
+    replication_key = humps.pascalize(bookmark_field) if bookmark_field else None
+    merged_records = []
+    for record in records:
+        snapshot_record = snapshot.get(record.get('Id'))
+        if snapshot_record:
+            merged = dict(snapshot_record)
+            merged.update({key: val for key, val in record.items() if val is not None})
+        else:
+            merged = record
+        if replication_key and window_end is not None and record.get(replication_key) is None:
+            merged = dict(merged)
+            merged[replication_key] = window_end.strftime('%Y-%m-%dT%H:%M:%SZ')
+        snapshot[merged.get('Id')] = merged
+        merged_records.append(merged)
+    return merged_records
@@ -1,15 +1,26 @@
 from datetime import time, datetime, timedelta
-import json
+import threading
+import weakref
 import dateutil.parser
 
 import singer
 from singer import metrics
+from suds.transport import Request, TransportError
 
 from tap_ilevel.constants import MAX_ID_CHUNK_SIZE, MAX_DATE_WINDOW
-from tap_ilevel.transform import transform_json, hash_data
+from tap_ilevel.transform import decamelize_key, periodic_hash_key, PeriodicDataRow
+from tap_ilevel.hot_logging import HOT_LOGGER, LazyStr
+from tap_ilevel.run_profile import PROFILE
+from tap_ilevel.accounts import clone_client
+from tap_ilevel.bookmarks import parse_bookmark
+from tap_ilevel.fx import FX
 
 LOGGER = singer.get_logger()
 
+# Clones of the SOAP clients marshalling requests without sending them (see get_nosend_client)
+NOSEND_CLIENTS = weakref.WeakKeyDictionary()
+NOSEND_LOCK = threading.Lock()
+
 
 # Certain API calls have a limitation of 30 day periods, where the process might be launched
 #  with an overall activity window of a greater period of time. Date ranges sorted into 30
@@ -21,7 +32,7 @@ def get_date_chunks(start_date, end_date, max_days):
     result = []
 
     if isinstance(start_date, str):
-        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+        start_date = parse_bookmark(start_date)
 
     days_dif = abs((start_date - end_date).days)
     if days_dif < max_days:
@@ -79,9 +90,11 @@ def obj_to_dict(obj):
 # :param json_serialize: If set, changes date and time types to iso string.
 # :param key_to_lower: If set, changes index key name to lower case.
 # :param obj: suds object
+# :param fields: snake_case names of the fields of obj to keep (see
+#   transform.get_selected_fields); other fields are skipped without converting their values.
 # :return: dict object
 # Reference: https://stackoverflow.com/questions/17581731/parsing-suds-soap-complex-data-type-into-python-dict
-def sobject_to_dict(obj, key_to_lower=False, json_serialize=True):
+def sobject_to_dict(obj, key_to_lower=False, json_serialize=True, fields=None):
 
     if not hasattr(obj, '__keylist__'):
         if json_serialize and isinstance(obj, (datetime, time)):
@@ -95,8 +108,9 @@ def sobject_to_dict(obj, key_to_lower=False, json_serialize=True):
         else:
             return str(obj)
     data = {}
-    fields = obj.__keylist__
-    for field in fields:
+    for field in obj.__keylist__:
+        if fields is not None and decamelize_key(field) not in fields:
+            continue
         val = getattr(obj, field)
         if key_to_lower:
             field = field.lower()
@@ -109,6 +123,18 @@ def sobject_to_dict(obj, key_to_lower=False, json_serialize=True):
     return data
 
 
+# Records (dicts) in the data_key list of a response, converted with sobject_to_dict.
+def get_response_records(call_response, data_key, fields=None):
+    if fields is None:
+        return sobject_to_dict(call_response).get(data_key, [])
+    if data_key not in call_response.__keylist__:
+        return []
+    records = getattr(call_response, data_key)
+    if isinstance(records, list):
+        return [sobject_to_dict(record, fields=fields) for record in records]
+    return sobject_to_dict(records, fields=fields)
+
+
 # Convert ISO 8601 formatted date string into time zone unaware
 def convert_iso_8601_date(date_str):
     if isinstance(date_str, datetime):
@@ -154,10 +180,11 @@ def __get_asset_ref(attr, stream_ref):
 
 
 # Used for objects with fewer records to get ALL records
-def get_all_objects(stream_name, client):
+#  fields: fields to convert (see sobject_to_dict), default all
+def get_all_objects(stream_name, client, fields=None):
     # pylint: disable=unused-variable
     objectType = client.factory.create('ObjectTypes')
-    with metrics.http_request_timer('{}: Retrieve all objects') as timer:
+    with metrics.http_request_timer('{}: Retrieve all objects'.format(stream_name)) as timer:
         if stream_name == 'funds':
             call_response = client.service.GetFunds()
             data_key = 'Fund'
@@ -200,14 +227,15 @@ def get_all_objects(stream_name, client):
         response = []
 
     response = []
-    if data_key == 'ObjectRelationship':
-        for relation in call_response:
-            response.append(sobject_to_dict(relation))
-    else:
-        try:
-            response = sobject_to_dict(call_response).get(data_key, [])
-        except AttributeError:
-            LOGGER.info('ERROR call_response = %s', sobject_to_dict(call_response))
+    with PROFILE.timer('sobject_to_dict'):
+        if data_key == 'ObjectRelationship':
+            for relation in call_response:
+                response.append(sobject_to_dict(relation, fields=fields))
+        else:
+            try:
+                response = get_response_records(call_response, data_key, fields)
+            except AttributeError:
+                LOGGER.info('ERROR call_response = %s', sobject_to_dict(call_response))
 
     return response
 
@@ -216,16 +244,16 @@ def get_all_objects(stream_name, client):
 #  date window operations will return subsets of possible available attributes. This method
 #  provides the ability to take the id's produced by date specific calls and translate them into
 #  objects with additional attributes.
-def get_object_details_by_ids(object_ids, stream_name, client):
+def get_object_details_by_ids(object_ids, stream_name, client, fields=None):
     object_type = client.factory.create('tns:UpdatedObjectTypes')
     asset_ref, data_key = __get_asset_ref(object_type, stream_name)
     array_of_int = client.factory.create('ns3:ArrayOfint')
     array_of_int.int = object_ids
 
     # pylint: disable=unused-variable
-    with metrics.http_request_timer('Retrieve detailed info for objects by ids') as timer:
+    with metrics.http_request_timer('{}: Retrieve detailed info for objects by ids'.format(stream_name)) as timer:
         call_response = client.service.GetObjectsByIds(asset_ref, array_of_int)
-    # LOGGER.info('call_response dict = {}'.format(sobject_to_dict(call_response))) # COMMENT OUT
+    HOT_LOGGER.debug('call_response', response=LazyStr(sobject_to_dict, call_response))
 
     #Perform check to ensure that data was actually retruned. Observing instances where alghough
     #Ids identified for a type/ date window criteria set, No details are returned for this call.
@@ -235,7 +263,8 @@ def get_object_details_by_ids(object_ids, stream_name, client):
     response = []
     try:
         # response = call_response.NamedEntity
-        response = sobject_to_dict(call_response).get(data_key, [])
+        with PROFILE.timer('sobject_to_dict'):
+            response = get_response_records(call_response, data_key, fields)
     except AttributeError:
         LOGGER.info('ERROR call_response = %s', sobject_to_dict(call_response))
 
@@ -257,7 +286,7 @@ def get_deleted_object_id_sets(start_dt, end_dt, client, stream_name):
     object_type = client.factory.create('tns:UpdatedObjectTypes')
     asset_ref, _ = __get_asset_ref(object_type, stream_name)
 
-    with metrics.http_request_timer('Retrieve deleted object data summary'):
+    with metrics.http_request_timer('{}: Retrieve deleted object data summary'.format(stream_name)):
         call_response = client.service.GetDeletedObjects(asset_ref, start_dt, end_dt)
 
     if isinstance(call_response, str):
@@ -285,9 +314,9 @@ def get_updated_object_id_sets(start_dt, end_dt, client, stream_name):
         raise AssertionError('Values supplied for max date window exceed threshold, '+
                              start_dt.strftime(fmt) +' - '+ end_dt.strftime(fmt))
     # pylint: disable=unused-variable
-    with metrics.http_request_timer('Retrieve updated object data summary') as timer:
+    with metrics.http_request_timer('{}: Retrieve updated object data summary'.format(stream_name)) as timer:
         call_response = client.service.GetUpdatedObjects(asset_ref, start_dt, end_dt)
-    # LOGGER.info('call_response dict = {}'.format(sobject_to_dict(call_response))) # COMMENT OUT
+    HOT_LOGGER.debug('call_response', response=LazyStr(sobject_to_dict, call_response))
 
     if isinstance(call_response, str):
         return []
@@ -308,25 +337,26 @@ def get_updated_object_id_sets(start_dt, end_dt, client, stream_name):
 #  date window operations will return subsets of possible available attributes. This method
 #  provides the ability to take the id's produced by date specific calls and translate them into
 #  objects with additional attributes.
-def get_investment_transaction_details_by_ids(object_ids, client):
+def get_investment_transaction_details_by_ids(object_ids, client, fields=None):
     criteria = client.factory.create('InvestmentTransactionsSearchCriteria')
     criteria.TransactionIds.int = object_ids
 
     # pylint: disable=unused-variable
-    with metrics.http_request_timer('Retrieve detailed info for objects by ids') as timer:
+    with metrics.http_request_timer('investment_transactions: Retrieve detailed info for objects by ids') as timer:
         call_response = client.service.GetInvestmentTransactions(criteria)
 
     # Validate that there is data to process
     if isinstance(call_response, str):
         return []
 
-    # LOGGER.info('call_response dict = {}'.format(sobject_to_dict(call_response))) # COMMENT OUT
+    HOT_LOGGER.debug('call_response', response=LazyStr(sobject_to_dict, call_response))
 
     # TODO: Fix issue w/ missing .InvestmentTransaction for last batch
     response = []
     try:
         # response = call_response.InvestmentTransaction
-        response = sobject_to_dict(call_response).get('InvestmentTransaction', [])
+        with PROFILE.timer('sobject_to_dict'):
+            response = get_response_records(call_response, 'InvestmentTransaction', fields)
     except AttributeError as err:
         LOGGER.info('%s', err)
         LOGGER.info('ERROR criteria = %s', criteria)
@@ -341,7 +371,7 @@ def get_standardized_data_id_chunks(start_dt, end_dt, client):
     adj_end_date = end_dt + timedelta(days=2)
 
     # Perform API call to retrieve 'standardized ids' in preparation for next call
-    with metrics.http_request_timer('Retrieve standardized ids') as timer:
+    with metrics.http_request_timer('periodic_data_standardized: Retrieve standardized ids') as timer:
         updated_data_ids = client.service.GetUpdatedData(adj_start_date, adj_end_date)
         LOGGER.info('Request time %s', timer.elapsed)
 
@@ -357,7 +387,8 @@ def get_standardized_data_id_chunks(start_dt, end_dt, client):
 
 # Perform iGetBatch operations for a given set of 'standardized ids', which will return
 #  periodic data.
-def perform_igetbatch_operation_for_standardized_id_set(id_set, req_state): # pylint: disable=too-many-statements
+#  With raw_reply, the reply XML is returned unparsed (see get_igetbatch_reply_xml).
+def perform_igetbatch_operation_for_standardized_id_set(id_set, req_state, raw_reply=False): # pylint: disable=too-many-statements
     data_value_types = req_state.client.factory.create('DataValueTypes')
 
     # current_date
@@ -384,18 +415,81 @@ def perform_igetbatch_operation_for_standardized_id_set(id_set, req_state): # py
 
         i_get_params_list.BaseRequestParameters.append(i_get_params)
 
-    i_get_request = req_state.client.factory.create('DataServiceRequest')
-    i_get_request.IncludeStandardizedDataInfo = True
-    i_get_request.IncludeExcelFormula = True
-    i_get_request.ParametersList = i_get_params_list
+    i_get_request = create_igetbatch_request(req_state, i_get_params_list)
 
     # pylint: disable=unused-variable
     metrics_string = ('Standardized Data Item iGetBatch: {} requests'.format(id_set_len))
     with metrics.http_request_timer(metrics_string) as timer:
+        if raw_reply:
+            return get_igetbatch_reply_xml(req_state.client, i_get_request)
         data_values = req_state.client.service.iGetBatch(i_get_request)
 
-    # LOGGER.info('data_values dict = {}'.format(sobject_to_dict(data_values))) # COMMENT OUT
+    HOT_LOGGER.debug('periodic_data_standardized.igetbatch_reply',
+                     reply=LazyStr(sobject_to_dict, data_values))
+
+    return get_data_value_rows(data_values, 'periodic_data_standardized',
+                               fx=FX if FX.enabled else None)
+
 
+# iGetBatch request for a list of request parameters. The Excel formula (text of each DataValue)
+#  is only requested when excel_formula is selected in the catalog. Standardized data info is
+#  always requested: rows are built from it (periodic_data_standardized requests only carry a
+#  standardized data id), and its resolved EndOfPeriod and ReportedDate values (part of hash_key,
+#  and the bookmark) are not known from the request.
+def create_igetbatch_request(req_state, i_get_params_list):
+    i_get_request = req_state.client.factory.create('DataServiceRequest')
+    i_get_request.IncludeStandardizedDataInfo = True
+    i_get_request.IncludeExcelFormula = req_state.fields is None or \
+        'excel_formula' in req_state.fields
+    i_get_request.ParametersList = i_get_params_list
+    return i_get_request
+
+
+# Clone of a client (sharing its parsed WSDL and options, see accounts.clone_client) with the
+#  nosend option set, which marshals requests without sending them. The options of the client
+#  itself, shared by threads (api.iter_sync) and cloned for accounts, are never changed.
+def get_nosend_client(client):
+    with NOSEND_LOCK:
+        nosend_client = NOSEND_CLIENTS.get(client)
+        if nosend_client is None:
+            nosend_client = clone_client(client)
+            nosend_client.set_options(nosend=True)
+            NOSEND_CLIENTS[client] = nosend_client
+    return nosend_client
+
+
+# Call iGetBatch and return the reply XML (bytes) without parsing it, so that parsing and
+#  conversion can be done elsewhere (see conversion_pool.py). Errors (HTTP and SOAP faults) are
+#  raised as for a regular call.
+def get_igetbatch_reply_xml(client, i_get_request):
+    PROFILE.begin_call('iGetBatch')
+    try:
+        # Marshal only, then send the envelope through the client's transport
+        method = get_nosend_client(client).service.iGetBatch
+        context = method(i_get_request)
+
+        request = Request(client.options.location, context.envelope)
+        request.headers = {'Content-Type': 'text/xml; charset=utf-8',
+                           'SOAPAction': method.method.soap.action}
+        request.headers.update(client.options.headers)
+        try:
+            reply = client.options.transport.send(request)
+        except TransportError as err:
+            content = err.fp.read() if err.fp is not None else b''
+            # Raises the SOAP fault (WebFault) or HTTP error, as suds does for a regular call
+            context.process_reply(content, err.httpcode, str(err))
+            raise
+        if reply is None:
+            raise Exception('iGetBatch: No reply content')
+        PROFILE.mark('received')
+        return reply.message
+    finally:
+        PROFILE.end_call()
+
+
+# Periodic data rows of an (unmarshalled) iGetBatch reply, skipping values with an Error or
+#  NoDataAvailable. With fx (fx.FxTable), rows derived in its currencies are added.
+def get_data_value_rows(data_values, stream_name, first_entity_only=False, fx=None):
     if isinstance(data_values, str):
         return []
 
@@ -414,77 +508,82 @@ def perform_igetbatch_operation_for_standardized_id_set(id_set, req_state): # py
         if "NoDataAvailable" in periodic_data_record:
             continue
 
-        periodic_data_record_dict = sobject_to_dict(periodic_data_record)
-        # LOGGER.info('period_data_record_dict = {}'.format(periodic_data_record_dict)) # COMMENT OUT
-
-        transformed_record = transform_json(periodic_data_record_dict)
-        # LOGGER.info('transformed_record = {}'.format(transformed_record)) # COMMENT OUT
-
-        if 'value' in transformed_record:
-            value = transformed_record.get('value')
-            value_string = str(value)
-            if type(value) in (int, float):
-                value_numeric = float(value)
-            else:
-                value_numeric = None
-            if value == 'No Data Available':
-                continue
-
-            sd_parameters = transformed_record.get('sd_parameters', {})
-            excel_formula = transformed_record.get('excel_formula')
-            currency_code = sd_parameters.get('currency_code')
-            data_item_id = sd_parameters.get('data_item_id')
-            data_value_type = sd_parameters.get('data_value_type')
-            detail_id = sd_parameters.get('detail_id')
-            scenario_id = sd_parameters.get('scenario_id')
-            period_type = sd_parameters.get('period', {}).get('type')
-            end_of_period_value = sd_parameters.get('end_of_period', {}).get('value')
-            reported_date_value = sd_parameters.get('reported_date', {}).get('value')
-            exchange_rate_type = sd_parameters.get('exchange_rate', {}).get('type')
-            request_id = sd_parameters.get('request_identifier')
-            standardized_data_id = sd_parameters.get('standardized_data_id')
-
-            entity_ids = sd_parameters.get('entities_path', {}).get('path', {}).get('int', [])
-            for entity_id in entity_ids:
-                # Primary key dimensions, create md5 hash key
-                dimensions = {
-                    'data_item_id': data_item_id,
-                    'entity_id': entity_id,
-                    'scenario_id': scenario_id,
-                    'period_type': period_type,
-                    'end_of_period_value': end_of_period_value,
-                    'currency_code': currency_code,
-                    'exchange_rate_type': exchange_rate_type,
-                    'data_value_type': data_value_type
-                }
-                hash_key = str(hash_data(json.dumps(dimensions, sort_keys=True)))
-                new_record = {
-                    'hash_key': hash_key,
-                    'excel_formula': excel_formula,
-                    'currency_code': currency_code,
-                    'data_item_id': data_item_id,
-                    'data_value_type': data_value_type,
-                    'detail_id': detail_id,
-                    'entity_id': entity_id,
-                    'scenario_id': scenario_id,
-                    'period_type': period_type,
-                    'end_of_period_value': end_of_period_value,
-                    'reported_date_value': reported_date_value,
-                    'exchange_rate_type': exchange_rate_type,
-                    'request_id': request_id,
-                    'standardized_data_id': standardized_data_id,
-                    'value': value,
-                    'value_string': value_string,
-                    'value_numeric': value_numeric
-                }
-
-                results.append(new_record)
-            # end for rec in periodic_data_records
-
-    # LOGGER.info('results = {}'.format(results)) # COMMENT OUT
+        results.extend(get_periodic_data_rows(
+            periodic_data_record, stream_name, first_entity_only=first_entity_only))
+
+    if fx is not None:
+        results.extend(fx.derive_rows(results, stream_name))
     return results
 
 
+# Build compact periodic data rows from a single iGetBatch DataValue. Keys are read in their SOAP
+#  (CamelCase) form, so the reply is not decamelized. A row is returned for each entity in the
+#  entities path, or only the first entity when first_entity_only is set (calculated data, where
+#  each request is made for a single entity).
+def get_periodic_data_rows(periodic_data_record, stream_name, first_entity_only=False):
+    with PROFILE.timer('sobject_to_dict'):
+        record_dict = sobject_to_dict(periodic_data_record)
+    HOT_LOGGER.sample('{}.record_dict'.format(stream_name), record_dict)
+
+    if 'Value' not in record_dict:
+        return []
+
+    value = record_dict.get('Value')
+    if value == 'No Data Available':
+        HOT_LOGGER.debug('{}.no_data_available'.format(stream_name))
+        return []
+    value_string = str(value)
+    if type(value) in (int, float):
+        value_numeric = float(value)
+    else:
+        value_numeric = None
+
+    sd_parameters = record_dict.get('SDParameters', {})
+    excel_formula = record_dict.get('ExcelFormula')
+    currency_code = sd_parameters.get('CurrencyCode')
+    data_item_id = sd_parameters.get('DataItemId')
+    data_value_type = sd_parameters.get('DataValueType')
+    detail_id = sd_parameters.get('DetailId')
+    scenario_id = sd_parameters.get('ScenarioId')
+    period_type = sd_parameters.get('Period', {}).get('Type')
+    end_of_period_value = sd_parameters.get('EndOfPeriod', {}).get('Value')
+    reported_date_value = sd_parameters.get('ReportedDate', {}).get('Value')
+    exchange_rate_type = sd_parameters.get('ExchangeRate', {}).get('Type')
+    request_id = sd_parameters.get('RequestIdentifier')
+    standardized_data_id = sd_parameters.get('StandardizedDataId')
+
+    entity_ids = sd_parameters.get('EntitiesPath', {}).get('Path', {}).get('int', [])
+    if first_entity_only:
+        entity_ids = [next(iter(entity_ids), None)]
+
+    rows = []
+    for entity_id in entity_ids:
+        # Primary key dimensions, create md5 hash key
+        hash_key = periodic_hash_key(data_item_id, entity_id, scenario_id, period_type,
+                                     end_of_period_value, currency_code, exchange_rate_type,
+                                     data_value_type)
+        rows.append(PeriodicDataRow(
+            hash_key=hash_key,
+            excel_formula=excel_formula,
+            currency_code=currency_code,
+            data_item_id=data_item_id,
+            data_value_type=data_value_type,
+            detail_id=detail_id,
+            entity_id=entity_id,
+            scenario_id=scenario_id,
+            period_type=period_type,
+            end_of_period_value=end_of_period_value,
+            reported_date_value=reported_date_value,
+            exchange_rate_type=exchange_rate_type,
+            request_id=request_id,
+            standardized_data_id=standardized_data_id,
+            value=value,
+            value_string=value_string,
+            value_numeric=value_numeric))
+
+    return rows
+
+
 # Creates entity_path object with an Asset id_list (array of id's)
 def create_entity_path(req_state, id_list):
     id_array = req_state.client.factory.create('ns3:ArrayOfint')
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+
+import singer
+from singer import metadata
+from singer.catalog import CatalogEntry, Schema
+
+from tap_ilevel.reference_cache import REFERENCES
+
+LOGGER = singer.get_logger()
+
+# Pivoted (wide) streams of the periodic data streams: one row per entity, scenario, period and
+#  currency, with a column per data item, instead of a row per value.
+WIDE_STREAMS = {
+    'periodic_data_standardized_wide': 'periodic_data_standardized',
+    'periodic_data_calculated_wide': 'periodic_data_calculated'
+}
+WIDE_KEY_PROPERTIES = ['entity_id', 'scenario_id', 'period_type', 'end_of_period_value',
+                       'currency_code']
+# Fields of the periodic data records the pivot reads
+PIVOT_FIELDS = frozenset(WIDE_KEY_PROPERTIES + ['data_item_id', 'value', 'value_numeric',
+                                                'value_string'])
+
+# DataItemObjectEx.DataValueType is an index into DataValueTypes (order of the WSDL enumeration)
+DATA_VALUE_TYPES = ['Numeric', 'Text', 'Date', 'Boolean', 'ObjectId', 'Currency']
+NUMBER_VALUE_TYPES = {'Numeric', 'ObjectId', 'Currency'}
+
+DEFAULT_STORE_PATH = 'pivot_store.sqlite'
+# Keys per store query
+STORE_CHUNK_SIZE = 500
+
+
+def get_column(data_item_id):
+    return 'data_item_{}'.format(data_item_id)
+
+
+def __get_value_type(data_item):
+    value_type = data_item.DataValueType
+    if isinstance(value_type, int) and 0 <= value_type < len(DATA_VALUE_TYPES):
+        return DATA_VALUE_TYPES[value_type]
+    return str(value_type)
+
+
+# Wide schema: the key dimensions, then a column per data item (number or string, after its
+#  value type), described with the data item name.
+def get_wide_schema(data_items):
+    properties = {
+        'entity_id': {'type': ['null', 'integer']},
+        'scenario_id': {'type': ['null', 'integer']},
+        'period_type': {'type': ['null', 'string']},
+        'end_of_period_value': {'type': ['null', 'string'], 'format': 'date-time'},
+        'currency_code': {'type': ['null', 'string']}
+    }
+    for data_item in sorted(data_items, key=lambda item: item.Id):
+        value_type = __get_value_type(data_item)
+        properties[get_column(data_item.Id)] = {
+            'type': ['null', 'number' if value_type in NUMBER_VALUE_TYPES else 'string'],
+            'description': '{} ({})'.format(data_item.Name, value_type)
+        }
+    return {'type': 'object', 'additionalProperties': False, 'properties': properties}
+
+
+# Catalog entries of the wide streams, with the data items from GetDataItems as columns:
+#  periodic_data_standardized_wide has all data items, periodic_data_calculated_wide the global
+#  calculated ones (see sync.__process_periodic_data_calcs).
+def get_wide_streams(client):
+    criteria = client.factory.create('DataItemsSearchCriteria')
+    criteria.GetGlobalDataItemsOnly = False
+    data_items = REFERENCES.call(client, 'GetDataItems', criteria).DataItemObjectEx
+    data_items_by_stream = {
+        'periodic_data_standardized_wide': data_items,
+        'periodic_data_calculated_wide': [
+            item for item in data_items if item.IsGlobal and item.FormulaTypeIDsString]
+    }
+    entries = []
+    for wide_name, stream_data_items in data_items_by_stream.items():
+        schema = get_wide_schema(stream_data_items)
+        entries.append(CatalogEntry(
+            stream=wide_name,
+            tap_stream_id=wide_name,
+            key_properties=WIDE_KEY_PROPERTIES,
+            schema=Schema.from_dict(schema),
+            metadata=metadata.get_standard_metadata(
+                schema=schema,
+                key_properties=WIDE_KEY_PROPERTIES,
+                replication_method='INCREMENTAL')))
+        LOGGER.info('%s: %s data item columns', wide_name, len(stream_data_items))
+    return entries
+
+
+class PivotStream:
+    def __init__(self, wide_name, output_name, schema, emit_rows):
+        self.wide_name = wide_name
+        self.output_name = output_name
+        self.schema = schema
+        self.emit_rows = emit_rows
+        # data_item_id: (column, number)
+        self.columns = {}
+        for column, column_schema in schema.get('properties', {}).items():
+            if column.startswith('data_item_'):
+                self.columns[int(column[len('data_item_'):])] = (
+                    column, 'number' in column_schema.get('type', []))
+        # key (WIDE_KEY_PROPERTIES values): {column: value}
+        self.rows = {}
+        self.skipped = 0
+
+
+# Pivots the records of the periodic data streams whose wide stream is selected. Each value is
+#  set in its wide row, and the rows are emitted before the next state (see
+#  singer_operations.write_state), merged with the columns already emitted for the row from the
+#  local store (pivot_store_path), so a row published for a few updated values (incremental
+#  windows, or batches splitting a row) still has all its columns.
+class Pivot:
+    def __init__(self):
+        self.streams = {}
+        self.path = DEFAULT_STORE_PATH
+        self.connection = None
+
+    def configure(self, path):
+        self.close()
+        self.path = path or DEFAULT_STORE_PATH
+
+    def handles(self, stream_name):
+        return stream_name in self.streams
+
+    # Pivot the records of a periodic data stream into its wide stream (catalog entry).
+    #   output_name: output name of the wide stream (its rows in the store)
+    #   emit_rows: also emit the records of the stream itself
+    def start(self, stream_name, wide_stream, output_name, emit_rows):
+        self.streams[stream_name] = PivotStream(
+            wide_stream.tap_stream_id, output_name, wide_stream.schema.to_dict(), emit_rows)
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS wide_rows '
+                '(stream TEXT, key TEXT, row TEXT, PRIMARY KEY (stream, key))')
+
+    def add(self, stream_name, record):
+        pivot = self.streams[stream_name]
+        column = pivot.columns.get(record.get('data_item_id'))
+        if column is None:
+            # Data item added since the discovery
+            pivot.skipped = pivot.skipped + 1
+            return
+        name, number = column
+        if number:
+            value = record.get('value_numeric')
+        else:
+            value = record.get('value_string')
+            if value is None:
+                value = record.get('value')
+        key = tuple(record.get(field) for field in WIDE_KEY_PROPERTIES)
+        pivot.rows.setdefault(key, {})[name] = value
+
+    # Wide rows (wide stream name, record) pivoted since the last flush, merged with the store.
+    def flush(self):
+        records = []
+        for pivot in self.streams.values():
+            if not pivot.rows:
+                continue
+            keys = {json.dumps(key, default=str): key for key in pivot.rows}
+            stored = {}
+            key_list = list(keys)
+            for index in range(0, len(key_list), STORE_CHUNK_SIZE):
+                chunk = key_list[index:index + STORE_CHUNK_SIZE]
+                cursor = self.connection.execute(
+                    'SELECT key, row FROM wide_rows WHERE stream = ? AND key IN ({})'.format(
+                        ', '.join('?' * len(chunk))), [pivot.output_name] + chunk)
+                stored.update((key, json.loads(row)) for key, row in cursor)
+
+            merged_rows = []
+            for key_json, key in keys.items():
+                row = stored.get(key_json, {})
+                row.update(pivot.rows[key])
+                merged_rows.append((pivot.output_name, key_json, json.dumps(row)))
+                record = dict(zip(WIDE_KEY_PROPERTIES, key))
+                record.update(row)
+                records.append((pivot.wide_name, record))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO wide_rows (stream, key, row) VALUES (?, ?, ?)',
+                merged_rows)
+            pivot.rows = {}
+        if records:
+            self.connection.commit()
+        return records
+
+    def finish(self, stream_name):
+        pivot = self.streams.pop(stream_name, None)
+        if pivot is not None and pivot.skipped:
+            LOGGER.warning('%s: %s values of data items without a column (run discovery again '
+                           'to add them)', pivot.wide_name, pivot.skipped)
+
+    def close(self):
+        self.streams = {}
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+PIVOT = Pivot()
+
+
+# Config:
+#   pivot_periodic_data: discover the wide streams (WIDE_STREAMS), with GetDataItems
+#   pivot_store_path: local store of the wide rows emitted (default pivot_store.sqlite)
+def configure_pivot(config):
+    PIVOT.configure(config.get('pivot_store_path'))
@@ -0,0 +1,358 @@
+import json
+import math
+import os
+import time
+from datetime import datetime
+
+import singer
+
+from tap_ilevel import config as tap_config
+import tap_ilevel.singer_operations as singer_ops
+import tap_ilevel.ilevel_api as ilevel
+import tap_ilevel.hybrid as hybrid
+from tap_ilevel.streams import STREAMS
+from tap_ilevel.sync import uses_tombstones, get_calc_plan_key
+from tap_ilevel.bookmarks import parse_bookmark, get_window_start
+from tap_ilevel.backfill import BACKFILL
+from tap_ilevel.scope import SCOPE
+from tap_ilevel.pivot import WIDE_STREAMS
+from tap_ilevel.time_budget import get_resume
+from tap_ilevel.accounts import get_accounts, get_account_clients, get_account_order, \
+    get_account_state
+from tap_ilevel.constants import ALL_RECORDS_STREAMS, OTHER_STREAMS, MAX_DATE_WINDOW, \
+    MAX_ID_CHUNK_SIZE, CALC_BATCH_SIZE, DEFAULT_CALC_SCENARIOS, DEFAULT_CALC_CURRENCIES
+
+LOGGER = singer.get_logger()
+
+# Rough seconds per call, used when no previous run profile covers an operation.
+DEFAULT_CALL_SECONDS = {
+    'GetObjectsByIds': 5.0,
+    'GetInvestmentTransactions': 5.0,
+    'iGetBatch': 30.0
+}
+DEFAULT_SECONDS = 2.0
+
+FULL_TABLE_OPERATIONS = {
+    'assets': 'GetAssets',
+    'funds': 'GetFunds',
+    'scenarios': 'GetScenarios',
+    'securities': 'GetSecurities',
+    'investments': 'GetInvestments',
+    'data_items': 'GetDataItems',
+    'asset_to_asset_relations': 'GetObjectRelationships',
+    'fund_to_asset_relations': 'GetObjectRelationships',
+    'fund_to_fund_relations': 'GetObjectRelationships'
+}
+
+
+# Seconds per SOAP call: measured during planning (the id listing calls), else the mean 'call'
+#  time from a previous run profile (run_profile.py JSON, for the stream or across streams), else
+#  DEFAULT_CALL_SECONDS.
+class CallEstimator:
+    def __init__(self, profile_path=None):
+        self.measured = {}
+        self.profiled = {}
+        if profile_path and os.path.exists(profile_path):
+            with open(profile_path) as file:
+                phases = json.load(file).get('phases', [])
+            totals = {}
+            for phase in phases:
+                if phase.get('phase') != 'call' or not phase.get('count'):
+                    continue
+                for key in ((phase.get('stream'), phase.get('operation')),
+                            (None, phase.get('operation'))):
+                    count, total = totals.get(key, (0, 0.0))
+                    totals[key] = (count + phase['count'], total + phase['total_seconds'])
+            self.profiled = {key: total / count for key, (count, total) in totals.items()}
+            LOGGER.info('plan: Using call timings from run profile %s', profile_path)
+
+    def measure(self, stream_name, operation, seconds):
+        count, total = self.measured.get((stream_name, operation), (0, 0.0))
+        self.measured[(stream_name, operation)] = (count + 1, total + seconds)
+
+    def seconds(self, stream_name, operation):
+        measured = self.measured.get((stream_name, operation))
+        if measured:
+            return measured[1] / measured[0]
+        for key in ((stream_name, operation), (None, operation)):
+            if key in self.profiled:
+                return self.profiled[key]
+        return DEFAULT_CALL_SECONDS.get(operation, DEFAULT_SECONDS)
+
+
+class StreamPlan:
+    def __init__(self, stream_name, mode, last_date):
+        self.stream_name = stream_name
+        # Stream name in the output (<stream_prefix><stream> in multi-account runs)
+        self.output_name = stream_name
+        self.mode = mode
+        self.last_date = last_date
+        self.windows = 0
+        self.calls = {}
+        self.ids = {}
+        self.batches = 0
+        # Batches published by an interrupted run (resume), not requested again
+        self.skipped_batches = 0
+        self.records = None
+
+    def add_calls(self, operation, count=1):
+        if count:
+            self.calls[operation] = self.calls.get(operation, 0) + count
+
+    def add_ids(self, kind, count):
+        self.ids[kind] = self.ids.get(kind, 0) + count
+
+    def to_dict(self, estimator):
+        return {
+            'mode': self.mode,
+            'last_date': self.last_date,
+            'windows': self.windows,
+            'calls': self.calls,
+            'ids': self.ids,
+            'batches': self.batches,
+            'skipped_batches': self.skipped_batches,
+            'records_estimate': self.records,
+            'estimated_seconds': round(sum(
+                count * estimator.seconds(self.stream_name, operation)
+                for operation, count in self.calls.items()), 1)
+        }
+
+
+def __timed(estimator, stream_name, operation, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    estimator.measure(stream_name, operation, time.perf_counter() - start)
+    return result
+
+
+# Date windows of a stream. Resumed (see time_budget.get_resume), the first window is the one
+#  interrupted, as in sync.__process_standardized_data_stream.
+def __date_windows(req_state, resume=None):
+    if resume:
+        date_chunks = [parse_bookmark(resume['window_start'])] + ilevel.get_date_chunks(
+            resume['window_end'], req_state.end_date, MAX_DATE_WINDOW)
+    else:
+        date_chunks = ilevel.get_date_chunks(req_state.last_date, req_state.end_date,
+                                             MAX_DATE_WINDOW)
+    return list(zip(date_chunks[:-1], date_chunks[1:]))
+
+
+# Updated/deleted ids per window (GetUpdatedObjects/GetDeletedObjects), projecting the detail
+#  calls made for each id chunk.
+def __plan_incremental_stream(req_state, plan, estimator):
+    detail_operation = 'GetInvestmentTransactions' if req_state.stream_name in OTHER_STREAMS \
+        else 'GetObjectsByIds'
+    tombstones = uses_tombstones(req_state)
+    plan.records = 0
+    for start_dt, end_dt in __date_windows(req_state):
+        plan.windows = plan.windows + 1
+        for kind, operation, func in (
+                ('updated', 'GetUpdatedObjects', ilevel.get_updated_object_id_sets),
+                ('deleted', 'GetDeletedObjects', ilevel.get_deleted_object_id_sets)):
+            plan.add_calls(operation)
+            id_sets = __timed(estimator, req_state.stream_name, operation, func,
+                              start_dt, end_dt, req_state.client, req_state.stream_name)
+            # Only the ids in scope are fetched
+            if SCOPE.active:
+                id_sets = [id_set for id_set in (
+                    SCOPE.filter_ids(req_state.stream_name, list(id_set)) for id_set in id_sets)
+                           if id_set]
+            id_count = sum(len(id_set) for id_set in id_sets)
+            plan.add_ids(kind, id_count)
+            plan.records = plan.records + id_count
+            if kind == 'updated' or not tombstones:
+                plan.add_calls(detail_operation, len(id_sets))
+                plan.batches = plan.batches + len(id_sets)
+
+
+# The batches of the interrupted window published before are skipped, while its ids are the same.
+def __plan_standardized_data_stream(req_state, plan, estimator):
+    resume = get_resume(req_state.state, req_state.stream_name)
+    plan.records = 0
+    for start_dt, end_dt in __date_windows(req_state, resume):
+        plan.windows = plan.windows + 1
+        plan.add_calls('GetUpdatedData')
+        id_sets = __timed(estimator, req_state.stream_name, 'GetUpdatedData',
+                          ilevel.get_standardized_data_id_chunks, start_dt, end_dt,
+                          req_state.client)
+        id_count = sum(len(id_set) for id_set in id_sets)
+        if resume and resume.get('ids') == id_count:
+            plan.skipped_batches = min(resume.get('batches', 0), len(id_sets))
+            id_sets = id_sets[plan.skipped_batches:]
+        resume = None
+        plan.add_ids('standardized', id_count)
+        plan.records = plan.records + sum(len(id_set) for id_set in id_sets)
+        plan.add_calls('iGetBatch', len(id_sets))
+        plan.batches = plan.batches + len(id_sets)
+
+
+# Mirrors the request loop in sync.__process_periodic_data_calcs: one iGetBatch request per
+#  calculated data item, asset, period type, offset period, scenario and currency, for the data
+#  items and assets in scope. The batches published by an interrupted run are skipped, while the
+#  requests are the same (see sync.get_calc_plan_key).
+def __plan_periodic_data_calcs(req_state, plan, estimator):
+    client = req_state.client
+    period_types = req_state.period_types.strip().replace(' ', '').split(',')
+    plan.add_calls('GetScenarios')
+    plan.add_calls('GetDataItems')
+    plan.add_calls('GetAssets')
+
+    scenarios = __timed(estimator, req_state.stream_name, 'GetScenarios',
+                        client.service.GetScenarios)
+    scenario_ids = {i.Name: i.Id for i in scenarios.NamedEntity} \
+        if not isinstance(scenarios, str) else {}
+    criteria = client.factory.create('DataItemsSearchCriteria')
+    criteria.GetGlobalDataItemsOnly = True
+    data_items = __timed(estimator, req_state.stream_name, 'GetDataItems',
+                         client.service.GetDataItems, criteria)
+    calc_data_items = [i for i in data_items.DataItemObjectEx if i.FormulaTypeIDsString] \
+        if not isinstance(data_items, str) else []
+    if 'data_items' in SCOPE.ids:
+        calc_data_items = [i for i in calc_data_items if i.Id in SCOPE.ids['data_items']]
+    assets = __timed(estimator, req_state.stream_name, 'GetAssets', client.service.GetAssets)
+    entity_objs = assets.Asset if not isinstance(assets, str) else []
+    if 'assets' in SCOPE.ids:
+        entity_objs = [i for i in entity_objs if i.Id in SCOPE.ids['assets']]
+    plan.add_ids('calc_data_items', len(calc_data_items))
+    plan.add_ids('assets', len(entity_objs))
+
+    last_dttm = parse_bookmark(req_state.last_date)
+    requests_per_data_item = 0
+    for entity in entity_objs:
+        initial_period = ilevel.sobject_to_dict(entity).get('InitialPeriod')
+        start_dttm = last_dttm
+        if initial_period:
+            start_dttm = max(last_dttm, datetime.strptime(initial_period[:10], '%Y-%m-%d'))
+        for period_type in period_types:
+            _, period_diff = ilevel.get_periods(req_state, start_dttm, req_state.end_date,
+                                                period_type)
+            requests_per_data_item = requests_per_data_item + period_diff + 2
+
+    variants = [(scenario_ids.get(scenario_name), currency_code)
+                for scenario_name in tap_config.get_list(
+                    req_state.config, 'calc_scenarios', DEFAULT_CALC_SCENARIOS)
+                for currency_code in tap_config.get_list(
+                    req_state.config, 'calc_currencies', DEFAULT_CALC_CURRENCIES)]
+    requests = requests_per_data_item * len(calc_data_items) * len(variants)
+    plan.add_ids('requests', requests)
+    batches = math.ceil(requests / CALC_BATCH_SIZE)
+    resume = get_resume(req_state.state, req_state.stream_name)
+    if resume and resume.get('plan') == get_calc_plan_key(
+            req_state, period_types, calc_data_items, entity_objs, variants):
+        plan.skipped_batches = min(resume.get('batches', 0), batches)
+    plan.batches = batches - plan.skipped_batches
+    plan.add_calls('iGetBatch', plan.batches)
+    plan.records = max(0, requests - plan.skipped_batches * CALC_BATCH_SIZE)
+
+
+# Plans of the streams of one account (the whole run, unless multi-account), as
+#  sync.__sync_account syncs them: only the backfill job's stream up to its end date, bookmarks
+#  and resume positions from the job's or the scope's part of the state, and the scope's ids.
+def __plan_account(client, config, catalog, selected_streams, state, estimator):
+    start_date = config.get('start_date')[:10]
+    period_types = config.get('period_types', 'FiscalQuarter')
+    BACKFILL.configure(config)
+    if BACKFILL.active:
+        state = BACKFILL.get_state(state)
+    SCOPE.configure(config)
+    if SCOPE.active:
+        state = SCOPE.get_state(state)
+    SCOPE.resolve(client)
+    wide_names = {stream_name: wide_name for wide_name, stream_name in WIDE_STREAMS.items()}
+
+    plans = []
+    for stream_name, endpoint_config in STREAMS.items():
+        if stream_name not in selected_streams and wide_names.get(stream_name) \
+                not in selected_streams:
+            continue
+        if not BACKFILL.allows(stream_name):
+            continue
+        bookmark = singer_ops.get_bookmark(state, stream_name, start_date)
+        last_date = get_window_start(config, stream_name, bookmark, start_date)
+        req_state = singer_ops.get_request_state(
+            client=client,
+            stream_name=stream_name,
+            start_date=start_date,
+            last_date=last_date,
+            end_date=BACKFILL.get_end_date(),
+            state=state,
+            bookmark_field=next(iter(endpoint_config.get('replication_keys', [])), None),
+            id_fields=endpoint_config.get('key_properties'),
+            period_types=period_types,
+            stream=catalog.get_stream(stream_name),
+            catalog=catalog,
+            config=config,
+            bookmark=bookmark)
+        LOGGER.info('plan: %s from %s', stream_name, last_date)
+
+        if stream_name in ALL_RECORDS_STREAMS:
+            if hybrid.is_hybrid_stream(req_state) and not hybrid.is_full_sweep_due(req_state):
+                plan = StreamPlan(stream_name, 'hybrid_incremental', last_date)
+                __plan_incremental_stream(req_state, plan, estimator)
+            else:
+                # Full table: the record count is only known after the (full) fetch
+                plan = StreamPlan(stream_name, 'full_table', last_date)
+                plan.add_calls(FULL_TABLE_OPERATIONS[stream_name])
+                plan.batches = 1
+        elif stream_name == 'periodic_data_standardized':
+            plan = StreamPlan(stream_name, 'standardized_data', last_date)
+            __plan_standardized_data_stream(req_state, plan, estimator)
+        elif stream_name == 'periodic_data_calculated':
+            plan = StreamPlan(stream_name, 'calculated_data', last_date)
+            __plan_periodic_data_calcs(req_state, plan, estimator)
+        else:
+            plan = StreamPlan(stream_name, 'incremental', last_date)
+            __plan_incremental_stream(req_state, plan, estimator)
+        plan.output_name = config.get('stream_prefix', '') + stream_name
+        plans.append(plan)
+    return plans
+
+
+# Projected calls, batches and duration per selected stream (per output stream, i.e.
+#  <stream_prefix><stream>, of each account in multi-account runs). Only the id listing calls (and
+#  the data item / asset lists for calculated data) are made: no details are fetched, no records
+#  are emitted and the state is not changed.
+def plan_sync(client, config, catalog, state):
+    estimator = CallEstimator(config.get('plan_profile_path') or config.get('run_profile_path'))
+    state = json.loads(json.dumps(state or {}))
+
+    selected_streams = [stream.stream for stream in catalog.get_selected_streams(state)]
+    accounts = get_accounts(config)
+    plans = []
+    if accounts:
+        clients = get_account_clients(client, accounts)
+        configs = dict(accounts)
+        for name in get_account_order(accounts, state):
+            LOGGER.info('plan: Account %s', name)
+            plans.extend(__plan_account(clients[name], configs[name], catalog, selected_streams,
+                                        get_account_state(state, name), estimator))
+    else:
+        plans = __plan_account(client, config, catalog, selected_streams, state, estimator)
+
+    streams = {plan.output_name: plan.to_dict(estimator) for plan in plans}
+    calls = {}
+    for stream_plan in streams.values():
+        for operation, count in stream_plan['calls'].items():
+            calls[operation] = calls.get(operation, 0) + count
+    return {
+        'generated': datetime.utcnow().isoformat() + 'Z',
+        'id_chunk_size': MAX_ID_CHUNK_SIZE,
+        'max_date_window_days': MAX_DATE_WINDOW,
+        'streams': streams,
+        'totals': {
+            'calls': calls,
+            'batches': sum(plan['batches'] for plan in streams.values()),
+            'estimated_seconds': round(sum(
+                plan['estimated_seconds'] for plan in streams.values()), 1)
+        }
+    }
+
+
+def log_plan(plan):
+    for stream_name, stream_plan in plan['streams'].items():
+        LOGGER.info('plan: %s (%s): %s windows, %s batches, calls: %s, ids: %s, ~%ss',
+                    stream_name, stream_plan['mode'], stream_plan['windows'],
+                    stream_plan['batches'], stream_plan['calls'], stream_plan['ids'],
+                    stream_plan['estimated_seconds'])
+    LOGGER.info('plan: total %s batches, calls: %s, ~%ss', plan['totals']['batches'],
+                plan['totals']['calls'], plan['totals']['estimated_seconds'])
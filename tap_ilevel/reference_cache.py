@@ -0,0 +1,45 @@
+import time
+import weakref
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+# Cache of reference data replies (scenarios, data items, funds and assets lists used to plan the
+#  periodic_data_calculated requests and to resolve scopes), by client, operation and arguments.
+#  Disabled unless a TTL is set (reference_cache_ttl_seconds, set by default in daemon mode), so
+#  that a single run always works on fresh lists. Stream data is never cached.
+class ReferenceCache:
+    def __init__(self):
+        self.ttl = None
+        # client: {(operation, arguments): (fetched, reply)}
+        self.entries = weakref.WeakKeyDictionary()
+        self.hits = 0
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    def configure(self, ttl):
+        if ttl != self.ttl:
+            self.entries = weakref.WeakKeyDictionary()
+        self.ttl = ttl
+
+    # Reply of client.service.<operation>(*args), cached for ttl seconds.
+    def call(self, client, operation, *args):
+        if not self.enabled:
+            return getattr(client.service, operation)(*args)
+        key = (operation, repr(args))
+        entries = self.entries.setdefault(client, {})
+        entry = entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry[0] < self.ttl:
+            self.hits = self.hits + 1
+            return entry[1]
+        reply = getattr(client.service, operation)(*args)
+        entries[key] = (now, reply)
+        return reply
+
+
+REFERENCES = ReferenceCache()
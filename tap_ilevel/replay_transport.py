@@ -0,0 +1,197 @@
+import hashlib
+import io
+import json
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+import singer
+from suds.transport import Transport, Reply, TransportError
+from suds.transport.https import HttpAuthenticated
+
+from tap_ilevel import config as tap_config
+
+LOGGER = singer.get_logger()
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+
+# Key for a SOAP request: the operation (from SOAPAction, or the first Body element) and a hash
+#  of the normalized Body. The Header is excluded since the WS-Security nonce and timestamps
+#  change on every request.
+def get_request_key(request):
+    operation = None
+    soap_action = request.headers.get('SOAPAction')
+    if isinstance(soap_action, bytes):
+        soap_action = soap_action.decode('utf-8')
+    if soap_action:
+        operation = soap_action.strip('"').rstrip('/').split('/')[-1]
+
+    body_xml = b''
+    if request.message:
+        try:
+            root = ET.fromstring(request.message)
+            body = root.find('{{{}}}Body'.format(SOAP_ENV_NS))
+            if body is not None:
+                for element in body.iter():
+                    if element.text is not None:
+                        element.text = element.text.strip()
+                    if element.tail is not None:
+                        element.tail = element.tail.strip()
+                if operation is None and len(body):
+                    operation = body[0].tag.split('}')[-1]
+                body_xml = ET.tostring(body)
+        except ET.ParseError:
+            body_xml = request.message
+
+    return operation or 'unknown', hashlib.md5(body_xml).hexdigest()
+
+
+# Wraps a suds transport and records every WSDL fetch (open) and SOAP call (send) of a run into
+#  a zip archive. Each exchange is stored as one JSON entry:
+#    open/<md5(url)>/<seq>.json: {url, body}
+#    send/<operation>/<md5(body)>/<seq>.json: {url, code, headers, body, latency, error}
+class RecordingTransport(Transport):
+    def __init__(self, archive_path, inner=None):
+        Transport.__init__(self)
+        self.inner = inner or HttpAuthenticated()
+        self.archive = zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.sequence = {}
+        self.lock = threading.Lock()
+
+    def __write(self, prefix, entry):
+        with self.lock:
+            seq = self.sequence.get(prefix, 0)
+            self.sequence[prefix] = seq + 1
+            self.archive.writestr('{}/{}.json'.format(prefix, seq), json.dumps(entry))
+
+    def open(self, request):
+        data = self.inner.open(request).read()
+        self.__write('open/{}'.format(hashlib.md5(request.url.encode('utf-8')).hexdigest()),
+                     {'url': request.url, 'body': data.decode('utf-8')})
+        return io.BytesIO(data)
+
+    def send(self, request):
+        operation, body_hash = get_request_key(request)
+        prefix = 'send/{}/{}'.format(operation, body_hash)
+        start = time.perf_counter()
+        try:
+            reply = self.inner.send(request)
+        except TransportError as err:
+            body = err.fp.read() if err.fp is not None else b''
+            self.__write(prefix, {
+                'url': request.url, 'code': err.httpcode, 'headers': {},
+                'body': body.decode('utf-8'), 'latency': time.perf_counter() - start,
+                'error': str(err)})
+            raise TransportError(str(err), err.httpcode, io.BytesIO(body))
+
+        self.__write(prefix, {
+            'url': request.url, 'code': reply.code, 'headers': dict(reply.headers or {}),
+            'body': reply.message.decode('utf-8'), 'latency': time.perf_counter() - start,
+            'error': None})
+        return reply
+
+    def close(self):
+        with self.lock:
+            if self.archive.fp is not None:
+                self.archive.close()
+
+
+# Serves a run recorded by RecordingTransport without any network access. Repeated identical
+#  requests are answered with the recorded replies in order (the last one is reused once they
+#  run out). Requests without an exact match (same operation and Body) get the replies of the
+#  operation in recorded order. With simulate_latency, each reply is delayed by its recorded
+#  latency.
+class ReplayTransport(Transport):
+    def __init__(self, archive_path, simulate_latency=False):
+        Transport.__init__(self)
+        self.simulate_latency = simulate_latency
+        self.entries = {}
+        self.positions = {}
+        self.lock = threading.Lock()
+        # Recorded order per operation, for requests that differ from the recording (e.g. date
+        #  windows computed from the current time)
+        self.operations = {}
+        with zipfile.ZipFile(archive_path) as archive:
+            for name in archive.namelist():
+                prefix, seq = name.rsplit('/', 1)
+                entry = json.loads(archive.read(name))
+                self.entries.setdefault(prefix, []).append((int(seq.split('.')[0]), entry))
+                if prefix.startswith('send/'):
+                    self.operations.setdefault(prefix.split('/')[1], []).append(entry)
+        for prefix in self.entries:
+            self.entries[prefix] = [entry for _, entry in sorted(self.entries[prefix])]
+        LOGGER.info('Replaying %s recorded exchanges from %s',
+                    sum(len(entries) for entries in self.entries.values()), archive_path)
+
+    def __next(self, prefix, entries, description):
+        with self.lock:
+            if not entries:
+                raise TransportError('No recorded reply for {}'.format(description), 404)
+            position = self.positions.get(prefix, 0)
+            self.positions[prefix] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+    def open(self, request):
+        prefix = 'open/{}'.format(hashlib.md5(request.url.encode('utf-8')).hexdigest())
+        entry = self.__next(prefix, self.entries.get(prefix), request.url)
+        return io.BytesIO(entry['body'].encode('utf-8'))
+
+    def send(self, request):
+        operation, body_hash = get_request_key(request)
+        prefix = 'send/{}/{}'.format(operation, body_hash)
+        if prefix in self.entries:
+            entry = self.__next(prefix, self.entries[prefix], operation)
+        else:
+            LOGGER.warning('No exact recorded reply for %s, replaying in recorded order', operation)
+            entry = self.__next(operation, self.operations.get(operation), operation)
+        if self.simulate_latency:
+            time.sleep(entry.get('latency') or 0)
+        body = entry['body'].encode('utf-8')
+        if entry.get('error'):
+            raise TransportError(entry['error'], entry['code'], io.BytesIO(body))
+        return Reply(entry['code'], entry.get('headers') or {}, body)
+
+    def close(self):
+        pass
+
+
+# Handle on a recording or replaying transport for another client: suds links a transport to the
+#  options of a single client, so each client gets its own handle on the shared archive.
+class SharedTransport(Transport):
+    def __init__(self, inner):
+        Transport.__init__(self)
+        self.inner = inner
+
+    def open(self, request):
+        return self.inner.open(request)
+
+    def send(self, request):
+        return self.inner.send(request)
+
+
+# Transport of a client for another client of the run: a SharedTransport for a recording or
+#  replaying transport, None (the suds default) otherwise.
+def share_transport(transport):
+    if isinstance(transport, SharedTransport):
+        return SharedTransport(transport.inner)
+    if isinstance(transport, (RecordingTransport, ReplayTransport)):
+        return SharedTransport(transport)
+    return None
+
+
+# Transport from config, None to use the suds default:
+#   transport_record_path: record all WSDL and SOAP exchanges to this zip archive
+#   transport_replay_path: replay a recorded archive instead of calling iLevel
+#   transport_replay_latency: when replaying, sleep for each recorded latency (default false)
+def get_transport(config):
+    replay_path = config.get('transport_replay_path')
+    if replay_path:
+        return ReplayTransport(
+            replay_path,
+            simulate_latency=tap_config.get_bool(config, 'transport_replay_latency'))
+    record_path = config.get('transport_record_path')
+    if record_path:
+        return RecordingTransport(record_path)
+    return None
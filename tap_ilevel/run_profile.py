@@ -0,0 +1,247 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import singer
+from suds.plugin import MessagePlugin
+
+LOGGER = singer.get_logger()
+
+# Upper bounds (seconds) of the latency histogram buckets, Prometheus style (cumulative, +Inf).
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Phases of a SOAP call, measured from the call wrapper and the ProfilePlugin hooks:
+#   marshal: building the request envelope (incl. SoapFixer) until suds is about to send
+#   http: sending the request and receiving the raw reply
+#   parse: SAX parsing of the reply
+#   unmarshal: converting the parsed reply into suds objects
+SOAP_PHASES = (('marshal', 'start', 'sending'),
+               ('http', 'sending', 'received'),
+               ('parse', 'received', 'parsed'),
+               ('unmarshal', 'parsed', 'unmarshalled'))
+
+
+class PhaseStats:
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        index = 0
+        for bound in HISTOGRAM_BUCKETS:
+            if seconds <= bound:
+                break
+            index = index + 1
+        self.buckets[index] = self.buckets[index] + 1
+
+    def to_dict(self):
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip(list(HISTOGRAM_BUCKETS) + ['+Inf'], self.buckets):
+            cumulative = cumulative + count
+            histogram[str(bound)] = cumulative
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 6),
+            'mean_seconds': round(self.total / self.count, 6) if self.count else None,
+            'min_seconds': self.min,
+            'max_seconds': self.max,
+            'histogram': histogram
+        }
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _PhaseTimer:
+    __slots__ = ('profile', 'phase', 'operation', 'start')
+
+    def __init__(self, profile, phase, operation):
+        self.profile = profile
+        self.phase = phase
+        self.operation = operation
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profile.observe(self.phase, time.perf_counter() - self.start, self.operation)
+        return False
+
+
+# Per run collection of phase timings, keyed by (stream, operation, phase). Collection is off
+#  unless enabled, in which case timer() returns a no-op context manager.
+class RunProfile:
+    def __init__(self):
+        self.enabled = False
+        self.stream_name = None
+        self.stats = {}
+        self.started = None
+        self.call_marks = None
+        self.call_operation = None
+
+    def reset(self, enabled):
+        self.enabled = enabled
+        self.stream_name = None
+        self.stats = {}
+        self.started = datetime.utcnow()
+        self.call_marks = None
+        self.call_operation = None
+
+    def set_stream(self, stream_name):
+        self.stream_name = stream_name
+
+    def observe(self, phase, seconds, operation=None):
+        key = (self.stream_name, operation, phase)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = PhaseStats()
+            self.stats[key] = stats
+        stats.observe(seconds)
+
+    def timer(self, phase, operation=None):
+        if not self.enabled:
+            return NULL_TIMER
+        return _PhaseTimer(self, phase, operation)
+
+    # SOAP call bracketing, used by InstrumentedService and ProfilePlugin.
+    def begin_call(self, operation):
+        self.call_operation = operation
+        self.call_marks = {'start': time.perf_counter()}
+
+    def mark(self, name):
+        if self.call_marks is not None:
+            self.call_marks[name] = time.perf_counter()
+
+    def end_call(self):
+        marks = self.call_marks
+        if marks is None:
+            return
+        marks['end'] = time.perf_counter()
+        for phase, start, end in SOAP_PHASES:
+            if start in marks and end in marks:
+                self.observe(phase, marks[end] - marks[start], self.call_operation)
+        self.observe('call', marks['end'] - marks['start'], self.call_operation)
+        self.call_marks = None
+        self.call_operation = None
+
+    def to_dict(self):
+        phases = []
+        for (stream_name, operation, phase), stats in sorted(
+                self.stats.items(), key=lambda item: tuple(str(part) for part in item[0])):
+            entry = {'stream': stream_name, 'operation': operation, 'phase': phase}
+            entry.update(stats.to_dict())
+            phases.append(entry)
+        return {
+            'started': self.started.isoformat() + 'Z' if self.started else None,
+            'finished': datetime.utcnow().isoformat() + 'Z',
+            'phases': phases
+        }
+
+
+PROFILE = RunProfile()
+
+
+# suds plugin marking the boundaries between the marshal/http/parse/unmarshal phases.
+class ProfilePlugin(MessagePlugin):
+    def sending(self, context):
+        PROFILE.mark('sending')
+
+    def received(self, context):
+        PROFILE.mark('received')
+
+    def parsed(self, context):
+        PROFILE.mark('parsed')
+
+    def unmarshalled(self, context):
+        PROFILE.mark('unmarshalled')
+
+
+# Wraps client.service so that each SOAP operation is bracketed for the ProfilePlugin.
+class InstrumentedService:
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        method = getattr(self.service, name)
+
+        def call(*args, **kwargs):
+            PROFILE.begin_call(name)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                PROFILE.end_call()
+        return call
+
+
+def __write_prometheus(path, profile):
+    lines = []
+    metric = 'tap_ilevel_phase_seconds'
+    lines.append('# HELP {} Time spent per sync phase, stream and SOAP operation.'.format(metric))
+    lines.append('# TYPE {} histogram'.format(metric))
+    for (stream_name, operation, phase), stats in sorted(
+            profile.stats.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        labels = 'stream="{}",operation="{}",phase="{}"'.format(
+            stream_name or '', operation or '', phase)
+        cumulative = 0
+        for bound, count in zip(list(HISTOGRAM_BUCKETS) + ['+Inf'], stats.buckets):
+            cumulative = cumulative + count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, bound, cumulative))
+        lines.append('{}_sum{{{}}} {}'.format(metric, labels, stats.total))
+        lines.append('{}_count{{{}}} {}'.format(metric, labels, stats.count))
+
+    # Textfile collectors pick up files as they appear, so write and rename atomically.
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+# Enable collection from config:
+#   run_profile_path: write a JSON summary of phase timings to this file at the end of the run
+#   run_profile_prometheus_path: also write a Prometheus textfile (node_exporter textfile format)
+def configure_profile(config, client):
+    enabled = bool(config.get('run_profile_path') or config.get('run_profile_prometheus_path'))
+    PROFILE.reset(enabled)
+    instrument_client(client)
+
+
+def instrument_client(client):
+    if PROFILE.enabled and not isinstance(client.service, InstrumentedService):
+        client.service = InstrumentedService(client.service)
+
+
+def write_profile(config):
+    if not PROFILE.enabled:
+        return
+    json_path = config.get('run_profile_path')
+    if json_path:
+        with open(json_path, 'w') as file:
+            json.dump(PROFILE.to_dict(), file, indent=2)
+        LOGGER.info('Run profile written to %s', json_path)
+    prometheus_path = config.get('run_profile_prometheus_path')
+    if prometheus_path:
+        __write_prometheus(prometheus_path, PROFILE)
+        LOGGER.info('Run profile (Prometheus) written to %s', prometheus_path)
@@ -0,0 +1,159 @@
+import fnmatch
+import hashlib
+import json
+
+import singer
+
+from tap_ilevel import config as tap_config
+from tap_ilevel.reference_cache import REFERENCES
+
+LOGGER = singer.get_logger()
+
+# Record fields checked against the scope, per stream: a record is in scope when each group has a
+#  field in a restricted id set (groups whose id sets are all unrestricted are ignored).
+SCOPE_FIELDS = {
+    'assets': [[('id', 'assets')]],
+    'funds': [[('id', 'funds')]],
+    'data_items': [[('id', 'data_items')]],
+    'investments': [[('from_id', 'funds'), ('to_id', 'assets')]],
+    'asset_to_asset_relations': [[('from_id', 'assets'), ('to_id', 'assets')]],
+    'fund_to_asset_relations': [[('from_id', 'funds'), ('to_id', 'assets')]],
+    'fund_to_fund_relations': [[('from_id', 'funds'), ('to_id', 'funds')]],
+    'periodic_data_standardized': [[('entity_id', 'assets'), ('entity_id', 'funds')],
+                                   [('data_item_id', 'data_items')]],
+    'periodic_data_calculated': [[('entity_id', 'assets'), ('entity_id', 'funds')],
+                                 [('data_item_id', 'data_items')]],
+}
+
+# Streams whose GetUpdatedObjects/GetDeletedObjects ids are entity ids (filtered before the
+#  detail fetch)
+ID_SCOPED_STREAMS = {'assets': 'assets', 'funds': 'funds', 'data_items': 'data_items'}
+
+
+# An id (int, or digits) matches that id; anything else is a (case insensitive) wildcard pattern
+#  matched against the id and the names.
+def __matches(spec, obj_id, names):
+    if isinstance(spec, int) or str(spec).strip().isdigit():
+        return int(spec) == obj_id
+    pattern = str(spec).strip().lower()
+    return any(fnmatch.fnmatchcase(str(value).lower(), pattern)
+               for value in [obj_id] + names if value is not None)
+
+
+# Ids of the objects matching any of the specs. Called from Scope methods, so not __ prefixed
+#  (name mangling).
+def match_ids(objects, specs, name_fields=('Name', 'ExcelName')):
+    ids = set()
+    for obj in objects:
+        names = [getattr(obj, field, None) for field in name_fields]
+        if any(__matches(spec, obj.Id, names) for spec in specs):
+            ids.add(obj.Id)
+    return ids
+
+
+# The ids and their descendants through relations of a type (from -> to).
+def with_children(ids, relations, type_id):
+    children = {}
+    for relation in relations:
+        if relation.TypeId == type_id:
+            children.setdefault(relation.FromId, set()).add(relation.ToId)
+    result = set(ids)
+    pending = list(ids)
+    while pending:
+        for child in children.get(pending.pop(), ()):
+            if child not in result:
+                result.add(child)
+                pending.append(child)
+    return result
+
+
+# Optional scope of a run, restricting it to some entities and data items for fast targeted
+#  re-syncs (e.g. a few portfolios), without touching the bookmarks of regular runs:
+#   scope_entities: asset ids or name patterns (e.g. [1234, "Acme*"])
+#   scope_funds: fund ids or name patterns; their sub funds and assets are in scope
+#   scope_data_items: data item ids or name patterns
+#   scope_name: state key of the scope (default: derived from the filters)
+# periodic_data_calculated only requests the assets and data items in scope. Other streams (see
+#  SCOPE_FIELDS) are filtered by record, and by id before the detail fetch where the updated ids
+#  are entity ids. Streams not in SCOPE_FIELDS are not restricted.
+class Scope:
+    def __init__(self):
+        self.name = None
+        self.specs = {}
+        self.ids = {}
+
+    @property
+    def active(self):
+        return bool(self.specs)
+
+    def configure(self, config):
+        self.specs = {}
+        self.ids = {}
+        for key, config_key in (('entities', 'scope_entities'), ('funds', 'scope_funds'),
+                                ('data_items', 'scope_data_items')):
+            specs = config.get(config_key)
+            if isinstance(specs, str) and specs.strip().startswith('['):
+                specs = json.loads(specs)
+            else:
+                specs = tap_config.get_list(config, config_key)
+            if specs:
+                self.specs[key] = specs
+        self.name = config.get('scope_name')
+        if self.active and not self.name:
+            digest = hashlib.md5(json.dumps(self.specs, sort_keys=True).encode('utf-8'))
+            self.name = digest.hexdigest()[:12]
+
+    # Resolve the filters into id sets: assets, funds, data_items (absent: unrestricted).
+    def resolve(self, client):
+        if not self.active:
+            return
+        entity_specs = self.specs.get('entities')
+        fund_specs = self.specs.get('funds')
+        if entity_specs or fund_specs:
+            asset_ids = set()
+            if entity_specs:
+                asset_ids = match_ids(REFERENCES.call(client, 'GetAssets').Asset, entity_specs)
+            if fund_specs:
+                object_types = client.factory.create('ObjectTypes')
+                relations = REFERENCES.call(client, 'GetObjectRelationships').ObjectRelationship
+                fund_ids = with_children(
+                    match_ids(REFERENCES.call(client, 'GetFunds').Fund, fund_specs), relations,
+                    object_types.FundToFund)
+                self.ids['funds'] = fund_ids
+                asset_ids = asset_ids | {
+                    relation.ToId for relation in relations
+                    if relation.TypeId == object_types.FundToAsset and relation.FromId in fund_ids}
+            self.ids['assets'] = asset_ids
+        if self.specs.get('data_items'):
+            criteria = client.factory.create('DataItemsSearchCriteria')
+            criteria.GetGlobalDataItemsOnly = False
+            self.ids['data_items'] = match_ids(
+                REFERENCES.call(client, 'GetDataItems', criteria).DataItemObjectEx,
+                self.specs['data_items'])
+        LOGGER.info('Scope %s: %s', self.name, {key: len(ids) for key, ids in self.ids.items()})
+
+    # Scoped part of the state (bookmarks, currently_syncing, ...), under scopes.<scope_name>.
+    def get_state(self, state):
+        return state.setdefault('scopes', {}).setdefault(self.name, {})
+
+    def allows(self, stream_name, record):
+        for group in SCOPE_FIELDS.get(stream_name, []):
+            restricted = [(field, self.ids[key]) for field, key in group if key in self.ids]
+            if restricted and not any(record.get(field) in ids for field, ids in restricted):
+                return False
+        return True
+
+    def filter_ids(self, stream_name, object_ids):
+        ids = self.ids.get(ID_SCOPED_STREAMS.get(stream_name))
+        if ids is None:
+            return object_ids
+        return [object_id for object_id in object_ids if object_id in ids]
+
+    # Record fields the scope needs (kept by the catalog field projection).
+    def get_fields(self, stream_name):
+        if not self.active:
+            return set()
+        return {field for group in SCOPE_FIELDS.get(stream_name, []) for field, _ in group}
+
+
+SCOPE = Scope()
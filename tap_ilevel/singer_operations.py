@@ -1,8 +1,63 @@
 from datetime import datetime
 import singer
+from singer import utils
+
+from tap_ilevel.pivot import PIVOT
+from tap_ilevel.run_profile import PROFILE
+from tap_ilevel.transform import get_selected_fields
 
 LOGGER = singer.get_logger()
 
+# Optional replacement for SCHEMA/RECORD/STATE output on stdout (e.g. batch_output.BatchWriter,
+#  api.QueueWriter). Writers implement write_schema(stream_name, schema, key_properties),
+#  write_record(stream_name, record, time_extracted), write_state(state), close_stream(stream_name),
+#  flush() and handles(stream_name).
+OUTPUT = {'writer': None, 'spool': None, 'prefix': ''}
+
+# State emitted by write_state when the sync works on a part of it (see scope.Scope.get_state)
+ROOT_STATE = {'state': None}
+
+
+def set_output_writer(writer):
+    OUTPUT['writer'] = writer
+
+
+# Optional spool.Spool receiving each SCHEMA/RECORD/STATE before it is output.
+def set_spool(spool):
+    OUTPUT['spool'] = spool
+
+
+def set_root_state(state):
+    ROOT_STATE['state'] = state
+
+
+# Prefix of the output stream names (SCHEMA/RECORD messages, staged files, spool), e.g. the
+#  account of a multi-account run. Writers only see output names (handles included).
+def set_stream_prefix(prefix):
+    OUTPUT['prefix'] = prefix or ''
+
+
+def get_output_name(stream_name):
+    return OUTPUT['prefix'] + stream_name
+
+
+# Close any open output (staged files) for a stream, emitting any held back state.
+def close_output_stream(stream_name):
+    writer = OUTPUT['writer']
+    if PIVOT.handles(stream_name):
+        write_pivoted_records()
+        wide_name = PIVOT.streams[stream_name].wide_name
+        if writer is not None and writer.handles(get_output_name(wide_name)):
+            writer.close_stream(get_output_name(wide_name))
+    if writer is not None and writer.handles(get_output_name(stream_name)):
+        writer.close_stream(get_output_name(stream_name))
+
+
+def flush_output():
+    writer = OUTPUT['writer']
+    if writer is not None:
+        writer.flush()
+
 
 # pylint: disable=unused-variable
 # pylint: disable=too-many-instance-attributes
@@ -13,25 +68,35 @@ class RequestState:
         stream_name = stream_name = None
         start_date = start_date = None
         last_date = last_date = None
+        records_start = None
+        bookmark = None
         end_date = end_date = None
         state = state = None
         id_fields = None
         period_types = None
         bookmark_field = None
         stream = None
+        fields = None
         catalog = None
+        config = None
+        snapshot = None
 
 
 # Given a series of common parameters, combine them into a data structure to minimize
 #   complexity of passing frequently used data as method parameters.
 def get_request_state(client, stream_name, start_date, last_date, end_date, state, bookmark_field,
-                        id_fields, period_types, stream, catalog):
+                        id_fields, period_types, stream, catalog, config=None, bookmark=None,
+                        records_start=None):
     # pylint: disable=attribute-defined-outside-init
     req_state = RequestState()
     req_state.client = client
     req_state.stream_name = stream_name
     req_state.start_date = start_date
     req_state.last_date = last_date
+    # Earliest bookmark value of the records published (see bookmarks.get_records_start)
+    req_state.records_start = records_start or last_date
+    # High water mark (last_date is the start of the window, i.e. less the lookback)
+    req_state.bookmark = bookmark or last_date
 
     end_date = end_date.strftime("%Y-%m-%d")
     end_date = datetime.strptime(end_date, "%Y-%m-%d")
@@ -42,24 +107,56 @@ def get_request_state(client, stream_name, start_date, last_date, end_date, stat
     req_state.id_fields = id_fields
     req_state.period_types = period_types
     req_state.stream = stream
+    # Selected fields, converted from SOAP replies (None: all)
+    req_state.fields = get_selected_fields(stream) if stream is not None else None
     req_state.catalog = catalog
+    req_state.config = config or {}
+    req_state.snapshot = None
     return req_state
 
 
 # Publish schema to singer.
 def write_schema(catalog, stream_name):
+    if PIVOT.handles(stream_name):
+        wide_stream = catalog.get_stream(PIVOT.streams[stream_name].wide_name)
+        write_schema_message(OUTPUT['prefix'] + wide_stream.tap_stream_id,
+                             wide_stream.schema.to_dict(), wide_stream.key_properties)
+        if not PIVOT.streams[stream_name].emit_rows:
+            return
     stream = catalog.get_stream(stream_name)
-    schema = stream.schema.to_dict()
+    write_schema_message(OUTPUT['prefix'] + stream_name, stream.schema.to_dict(),
+                         stream.key_properties)
+
+
+def write_schema_message(stream_name, schema, key_properties):
+    writer = OUTPUT['writer']
+    if OUTPUT['spool'] is not None:
+        OUTPUT['spool'].write_schema(stream_name, schema, key_properties)
     try:
-        singer.write_schema(stream_name, schema, stream.key_properties)
+        if writer is not None:
+            writer.write_schema(stream_name, schema, key_properties)
+        else:
+            singer.write_schema(stream_name, schema, key_properties)
     except OSError as err:
         LOGGER.info('OS Error writing schema for: %s', stream_name)
         raise err
 
 # Publish individual record.
 def write_record(stream_name, record, time_extracted):
+    if PIVOT.handles(stream_name):
+        PIVOT.add(stream_name, record)
+        if not PIVOT.streams[stream_name].emit_rows:
+            return
+    writer = OUTPUT['writer']
+    output_name = OUTPUT['prefix'] + stream_name
     try:
-        singer.messages.write_record(stream_name, record, time_extracted=time_extracted)
+        with PROFILE.timer('emit'):
+            if OUTPUT['spool'] is not None:
+                OUTPUT['spool'].write_record(output_name, record, time_extracted)
+            if writer is not None and writer.handles(output_name):
+                writer.write_record(output_name, record, time_extracted)
+            else:
+                singer.messages.write_record(output_name, record, time_extracted=time_extracted)
     except OSError as err:
         LOGGER.error('OS Error writing record for: %s', stream_name)
         LOGGER.error('record: %s', record)
@@ -71,6 +168,13 @@ def write_record(stream_name, record, time_extracted):
         raise err
 
 
+# Publish the wide rows pivoted so far (see pivot.Pivot), ahead of the next state.
+def write_pivoted_records():
+    time_extracted = utils.now()
+    for wide_name, record in PIVOT.flush():
+        write_record(wide_name, record, time_extracted)
+
+
 def get_bookmark(state, stream, default):
     if (state is None) or ('bookmarks' not in state):
         return default
@@ -86,7 +190,20 @@ def write_bookmark(state, stream, value):
         state['bookmarks'] = {}
     state['bookmarks'][stream] = value
     LOGGER.info('Write state for stream: %s, value: %s', stream, value)
-    singer.write_state(state)
+    write_state(state)
+
+
+def write_state(state):
+    write_pivoted_records()
+    if ROOT_STATE['state'] is not None:
+        state = ROOT_STATE['state']
+    writer = OUTPUT['writer']
+    if OUTPUT['spool'] is not None:
+        OUTPUT['spool'].write_state(state)
+    if writer is not None:
+        writer.write_state(state)
+    else:
+        singer.write_state(state)
 
 
 # Currently syncing sets the stream currently being delivered in the state.
@@ -100,4 +217,4 @@ def update_currently_syncing(state, stream_name):
         del state['currently_syncing']
     else:
         singer.set_currently_syncing(state, stream_name)
-    singer.write_state(state)
+    write_state(state)
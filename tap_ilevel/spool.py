@@ -0,0 +1,222 @@
+import gzip
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+
+import simplejson
+import singer
+from singer import utils
+
+import tap_ilevel.singer_operations as singer_ops
+from tap_ilevel.batch_output import get_batch_writer
+
+LOGGER = singer.get_logger()
+
+MANIFEST_FILE = 'manifest.jsonl'
+SCHEMAS_FILE = 'schemas.json'
+SPOOL_FILE = 'spool.json'
+SEGMENTS_DIR = 'segments'
+
+
+# Called from Spool methods, so not __ prefixed (name mangling)
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Durable on-disk copy of a run's output (spool_dir), so that records fetched before a target
+#  failure can be re-emitted (--replay-spool) instead of extracted again. Output is cut into
+#  segments at each STATE: the records since the previous state go to a gzip file
+#  segments/<seq>-<stream>.jsonl.gz, which is closed and synced before the state is appended to
+#  manifest.jsonl and emitted. A state in the manifest is therefore only ever emitted after all
+#  the records it covers are on disk.
+#   spool.json: creation time and the input state of the run
+#   schemas.json: latest SCHEMA per stream
+#   manifest.jsonl: {seq, file, stream, records, bookmark, state} per segment
+class Spool:
+    def __init__(self, spool_dir, initial_state):
+        self.spool_dir = spool_dir
+        self.segments_dir = os.path.join(spool_dir, SEGMENTS_DIR)
+        self.seq = 0
+        self.file = None
+        self.raw_file = None
+        self.file_name = None
+        self.stream_name = None
+        self.records = 0
+        self.schemas = {}
+        os.makedirs(self.segments_dir, exist_ok=True)
+        with open(os.path.join(spool_dir, SPOOL_FILE), 'w') as file:
+            json.dump({'created': datetime.utcnow().isoformat() + 'Z',
+                       'initial_state': initial_state}, file)
+        self.manifest = open(os.path.join(spool_dir, MANIFEST_FILE), 'a')
+
+    def write_schema(self, stream_name, schema, key_properties):
+        self.schemas[stream_name] = {'schema': schema, 'key_properties': key_properties}
+        tmp_path = os.path.join(self.spool_dir, SCHEMAS_FILE + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.schemas, file)
+        os.replace(tmp_path, os.path.join(self.spool_dir, SCHEMAS_FILE))
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        if self.file is None:
+            self.seq = self.seq + 1
+            self.stream_name = stream_name
+            self.file_name = '{:06d}-{}.jsonl.gz'.format(self.seq, stream_name)
+            self.raw_file = open(os.path.join(self.segments_dir, self.file_name), 'wb')
+            self.file = io.TextIOWrapper(
+                gzip.GzipFile(fileobj=self.raw_file, mode='wb', compresslevel=6),
+                encoding='utf-8')
+        self.file.write(simplejson.dumps({
+            'stream': stream_name,
+            'record': record,
+            'time_extracted': utils.strftime(time_extracted) if time_extracted else None
+        }, use_decimal=True))
+        self.file.write('\n')
+        self.records = self.records + 1
+
+    def __close_segment(self):
+        if self.file is None:
+            return None
+        # Closing the gzip stream writes its trailer, but leaves raw_file open
+        self.file.close()
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        self.raw_file.close()
+        fsync_dir(self.segments_dir)
+        self.file = None
+        self.raw_file = None
+        return self.file_name
+
+    def write_state(self, state):
+        file_name = self.__close_segment()
+        stream_name = self.stream_name if file_name else None
+        bookmarks = (state or {}).get('bookmarks') or {}
+        entry = {
+            'seq': self.seq,
+            'file': file_name,
+            'stream': stream_name,
+            'records': self.records if file_name else 0,
+            'bookmark': bookmarks.get(stream_name) if stream_name else None,
+            'state': state
+        }
+        self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        self.records = 0
+
+    # Records after the last state are kept as a segment without a state.
+    def close(self):
+        if self.file is not None:
+            self.write_state(None)
+        self.manifest.close()
+
+
+def __read_manifest(spool_dir):
+    entries = []
+    path = os.path.join(spool_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return entries
+    with open(path) as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Partially written last line (interrupted run)
+                break
+    return entries
+
+
+# Index of the first segment not yet confirmed: after the last segment whose state equals the
+#  (target confirmed) input state, or 0 when it matches none.
+def __first_unconfirmed(entries, state):
+    start = 0
+    for index, entry in enumerate(entries):
+        if entry['state'] is not None and entry['state'] == state:
+            start = index + 1
+    return start
+
+
+# Delete the segments of confirmed entries and rewrite the manifest with the remaining ones.
+def __prune(spool_dir, entries, start):
+    for entry in entries[:start]:
+        if entry['file']:
+            path = os.path.join(spool_dir, SEGMENTS_DIR, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+    tmp_path = os.path.join(spool_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as file:
+        for entry in entries[start:]:
+            file.write(json.dumps(entry) + '\n')
+    os.replace(tmp_path, os.path.join(spool_dir, MANIFEST_FILE))
+    if start:
+        LOGGER.info('Spool: Pruned %s confirmed entries', start)
+
+
+# Start a spool for a sync run (None unless spool_dir is set). The previous spool is replaced:
+#  the run extracts again from the input state, so nothing past the confirmed state is lost.
+def get_spool(config, state):
+    spool_dir = config.get('spool_dir')
+    if not spool_dir:
+        return None
+    entries = __read_manifest(spool_dir)
+    start = __first_unconfirmed(entries, state)
+    unconfirmed = sum(entry['records'] for entry in entries[start:])
+    if unconfirmed:
+        LOGGER.warning('Spool: Discarding %s unconfirmed spooled records (not replayed with '
+                       '--replay-spool), they are extracted again', unconfirmed)
+    if os.path.exists(spool_dir):
+        shutil.rmtree(spool_dir)
+    LOGGER.info('Spool: Writing run output to %s', spool_dir)
+    return Spool(spool_dir, state)
+
+
+# --replay-spool: re-emit the records and states spooled after the input state, without any API
+#  calls. Entries up to the input state (confirmed by the target) are pruned; the rest stay in
+#  the spool until a later run confirms them.
+def replay_spool(config, state):
+    spool_dir = config.get('spool_dir')
+    if not spool_dir or not os.path.exists(os.path.join(spool_dir, SPOOL_FILE)):
+        raise Exception('--replay-spool requires spool_dir with a spooled run')
+
+    with open(os.path.join(spool_dir, SPOOL_FILE)) as file:
+        initial_state = json.load(file).get('initial_state')
+    schemas = {}
+    if os.path.exists(os.path.join(spool_dir, SCHEMAS_FILE)):
+        with open(os.path.join(spool_dir, SCHEMAS_FILE)) as file:
+            schemas = json.load(file)
+    entries = __read_manifest(spool_dir)
+    start = __first_unconfirmed(entries, state)
+    if start == 0 and (state or {}) != (initial_state or {}):
+        LOGGER.warning('Spool: Input state matches no spooled state, replaying the whole spool')
+    __prune(spool_dir, entries, start)
+
+    singer_ops.set_output_writer(get_batch_writer(config))
+    emitted_schemas = set()
+    record_count = 0
+    for entry in entries[start:]:
+        if entry['file']:
+            path = os.path.join(spool_dir, SEGMENTS_DIR, entry['file'])
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    message = simplejson.loads(line, use_decimal=True)
+                    stream_name = message['stream']
+                    if stream_name not in emitted_schemas and stream_name in schemas:
+                        singer_ops.write_schema_message(
+                            stream_name, schemas[stream_name]['schema'],
+                            schemas[stream_name]['key_properties'])
+                        emitted_schemas.add(stream_name)
+                    time_extracted = message.get('time_extracted')
+                    singer_ops.write_record(
+                        stream_name, message['record'],
+                        utils.strptime_to_utc(time_extracted) if time_extracted else None)
+                    record_count = record_count + 1
+            singer_ops.close_output_stream(entry['stream'])
+        if entry['state'] is not None:
+            singer_ops.write_state(entry['state'])
+    singer_ops.flush_output()
+    LOGGER.info('Spool: Replayed %s records from %s entries', record_count, len(entries) - start)
@@ -0,0 +1,145 @@
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+import singer
+
+from tap_ilevel import config as tap_config
+
+# resource is not available on all platforms (e.g. Windows); peak RSS is skipped there.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LOGGER = singer.get_logger()
+
+DEFAULT_TOP_N = 25
+TRACEMALLOC_FRAMES = 5
+
+
+# Low overhead alternative to cProfile: a daemon thread samples the stack of the syncing thread
+#  every interval seconds. Samples are written in folded stack format ('a;b;c count'), which
+#  flamegraph.pl / speedscope can read directly.
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id) # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write('{} {}\n'.format(stack, count))
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+# Profiles each stream sync, writing into output_dir:
+#   <stream>.prof: cProfile stats (pstats / snakeviz), or with sample_interval set,
+#   <stream>.folded.txt: sampled stacks (see StackSampler)
+#   <stream>.memory.txt: top_n allocation sites (tracemalloc), traced peak and peak RSS
+class StreamProfiler:
+    def __init__(self, output_dir, top_n=DEFAULT_TOP_N, sample_interval=None, trace_memory=True):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.sample_interval = sample_interval
+        self.trace_memory = trace_memory
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextmanager
+    def profile(self, stream_name):
+        profiler = None
+        sampler = None
+        if self.sample_interval:
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if self.trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+
+            # Snapshot before writing any output, so the profiler's own dump is not reported
+            snapshot = None
+            traced_peak = None
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, traced_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            if profiler is not None:
+                profiler.dump_stats(os.path.join(self.output_dir, '{}.prof'.format(stream_name)))
+            if sampler is not None:
+                sampler.write(os.path.join(self.output_dir, '{}.folded.txt'.format(stream_name)))
+            self.__write_memory_report(stream_name, snapshot, traced_peak)
+
+    def __write_memory_report(self, stream_name, snapshot, traced_peak):
+        peak_rss_mb = get_peak_rss_mb()
+        path = os.path.join(self.output_dir, '{}.memory.txt'.format(stream_name))
+        with open(path, 'w') as file:
+            file.write('stream: {}\n'.format(stream_name))
+            file.write('peak_rss_mb: {}\n'.format(peak_rss_mb))
+            if traced_peak is not None:
+                file.write('traced_peak_mb: {}\n'.format(round(traced_peak / (1024 * 1024), 1)))
+            if snapshot is not None:
+                file.write('\ntop {} allocation sites:\n'.format(self.top_n))
+                for stat in snapshot.statistics('lineno')[:self.top_n]:
+                    file.write('{}\n'.format(stat))
+        LOGGER.info('%s: Profile written to %s (peak RSS: %s MB)',
+                    stream_name, self.output_dir, peak_rss_mb)
+
+
+# Build a StreamProfiler from config (or the equivalent tap-ilevel CLI options), None if off:
+#   profile_dir: output directory; enables profiling
+#   profile_top_n: number of allocation sites to report (default 25)
+#   profile_sample_interval: seconds between stack samples; uses the sampler instead of cProfile
+#   profile_memory: trace allocations with tracemalloc (default true, false with
+#     profile_sample_interval: tracing every allocation would defeat the low overhead sampler)
+def get_stream_profiler(config):
+    output_dir = config.get('profile_dir')
+    if not output_dir:
+        return None
+    sample_interval = tap_config.get_float(config, 'profile_sample_interval')
+    return StreamProfiler(
+        output_dir=output_dir,
+        top_n=tap_config.get_int(config, 'profile_top_n', DEFAULT_TOP_N),
+        sample_interval=sample_interval,
+        trace_memory=tap_config.get_bool(config, 'profile_memory', not sample_interval))
@@ -25,6 +25,12 @@ STREAMS = {
         'replication_keys': ['last_modified_date']
     },
 
+    'currency_rates': {
+        'key_properties': ['currency_from', 'currency_to', 'date'],
+        'replication_method': 'INCREMENTAL',
+        'replication_keys': ['date']
+    },
+
     'data_items': {
         'key_properties': ['id'],
         'replication_method': 'INCREMENTAL',
@@ -1,21 +1,45 @@
 #!/usr/bin/env python3
 
-from datetime import datetime, timedelta
-import json
+from datetime import datetime
 import copy
+import hashlib
+import json
 
 import singer
 from singer import metrics, metadata, Transformer, utils
 
-from tap_ilevel.transform import transform_json, hash_data
+from tap_ilevel.transform import transform_json, PeriodicDataRow
 from tap_ilevel.streams import STREAMS
+from tap_ilevel import config as tap_config
 import tap_ilevel.singer_operations as singer_ops
 import tap_ilevel.ilevel_api as ilevel
-
-from tap_ilevel.constants import ALL_RECORDS_STREAMS, INCREMENTAL_STREAMS, MAX_DATE_WINDOW
+import tap_ilevel.hybrid as hybrid
+from tap_ilevel.hot_logging import HOT_LOGGER, LazyStr, configure_logging
+from tap_ilevel.backfill import BACKFILL
+from tap_ilevel.batch_output import get_batch_writer
+from tap_ilevel.run_profile import PROFILE, configure_profile, instrument_client, \
+    write_profile
+from tap_ilevel.stream_profiler import get_stream_profiler
+from tap_ilevel.bookmarks import parse_bookmark, format_bookmark, max_bookmark, \
+    get_window_start, get_records_start
+from tap_ilevel.conversion_pool import CONVERSION, configure_conversion
+from tap_ilevel.fx import FX, configure_fx
+from tap_ilevel.pivot import PIVOT, PIVOT_FIELDS, WIDE_STREAMS, configure_pivot
+from tap_ilevel.reference_cache import REFERENCES
+from tap_ilevel.scope import SCOPE
+from tap_ilevel.accounts import get_accounts, get_account_clients, get_account_order, \
+    get_account_state, set_currently_syncing_account
+from tap_ilevel.spool import get_spool
+from tap_ilevel.time_budget import BUDGET, configure_time_budget, get_resume, write_resume, \
+    clear_resume
+
+from tap_ilevel.constants import ALL_RECORDS_STREAMS, OTHER_STREAMS, MAX_DATE_WINDOW, \
+    CALC_BATCH_SIZE, DEFAULT_CALC_SCENARIOS, DEFAULT_CALC_CURRENCIES
 
 LOGGER = singer.get_logger()
 
+DELETED_RECORDS_MODES = ('details', 'tombstone')
+
 
 def transform_datetime(this_dttm):
     with Transformer() as transformer:
@@ -31,17 +55,23 @@ def __set_deletion_flag(record, is_soft_deleted=False):
 
 
 # Handle low level operations to publish records.
+#  With transformed, records are already transformed (see conversion_pool.py) and are only
+#  filtered and published.
 def process_records(result_records,
                     req_state,
                     deletion_flag=None,
-                    max_bookmark_value=None):
+                    max_bookmark_value=None,
+                    transformed=False):
 
     if not result_records or result_records is None or result_records == []:
         return max_bookmark_value, 0
 
     stream_name = req_state.stream_name
     bookmark_field = req_state.bookmark_field
-    last_date = req_state.last_date
+    # Keep only records whose bookmark is on or after the start of the window, less the record
+    #  lookback (see bookmarks.get_records_start)
+    records_start_dttm = parse_bookmark(req_state.records_start)
+    max_bookmark_value_dttm = parse_bookmark(max_bookmark_value)
 
     LOGGER.info('%s: Preparing to publish %s records', stream_name, len(result_records))
 
@@ -49,48 +79,54 @@ def process_records(result_records,
     schema = stream.schema.to_dict()
     stream_metadata = metadata.to_map(stream.metadata)
 
-    # Transform records
-    try:
-        transformed_data = transform_json(result_records)
-    except Exception as err:
-        LOGGER.error(err)
-        LOGGER.error('result_records = %s', result_records)
-        raise err
+    # Transform records. Periodic data rows are already snake_case and are only expanded into
+    #  a dict as each record is published.
+    if transformed:
+        transformed_data = result_records
+    elif isinstance(result_records[0], PeriodicDataRow):
+        transformed_data = (row.to_dict() for row in result_records)
+    else:
+        try:
+            with PROFILE.timer('transform_json'):
+                transformed_data = transform_json(result_records)
+        except Exception as err:
+            LOGGER.error(err)
+            LOGGER.error('result_records = %s', result_records)
+            raise err
 
     with metrics.record_counter(req_state.stream_name) as counter:
         for record in transformed_data:
-            # Add deletion flag to record
-            __set_deletion_flag(record, deletion_flag)
-
-            # Singer.io validate/transform vs. JSON schema
-            with Transformer() as transformer:
-                try:
-                    transformed_record = transformer.transform(
-                        record,
-                        schema,
-                        stream_metadata)
-                except Exception as err:
-                    LOGGER.error(err)
-                    LOGGER.error('Error record: %s', record)
-                    raise err
+            if SCOPE.active and not SCOPE.allows(stream_name, record):
+                continue
+            if transformed:
+                transformed_record = record
+            else:
+                # Add deletion flag to record
+                __set_deletion_flag(record, deletion_flag)
+
+                # Singer.io validate/transform vs. JSON schema
+                with PROFILE.timer('transformer'), Transformer() as transformer:
+                    try:
+                        transformed_record = transformer.transform(
+                            record,
+                            schema,
+                            stream_metadata)
+                    except Exception as err:
+                        LOGGER.error(err)
+                        LOGGER.error('Error record: %s', record)
+                        raise err
+
+            # Keep the local rate table (fx_currencies) up to date
+            if stream_name == 'currency_rates' and FX.enabled:
+                FX.add(transformed_record)
 
             # Reset max_bookmark_value to new value if higher
-            if bookmark_field and (bookmark_field in transformed_record):
-                bookmark_dt = transformed_record[bookmark_field][:10]
-
-                bookmark_dttm = datetime.strptime(bookmark_dt, "%Y-%m-%d")
-                if max_bookmark_value:
-                    max_bookmark_value_dttm = datetime.strptime(max_bookmark_value, "%Y-%m-%d")
-                    if bookmark_dttm > max_bookmark_value_dttm:
-                        max_bookmark_value = bookmark_dt
-                else:
-                    max_bookmark_value = bookmark_dt
-
-                # Lookback window, always process last 14 days
-                last_dttm = datetime.strptime(last_date, "%Y-%m-%d") - timedelta(days=14)
-
-                # Keep only records whose bookmark is on after the last_date
-                if bookmark_dttm >= last_dttm:
+            if bookmark_field and transformed_record.get(bookmark_field):
+                bookmark_dttm = parse_bookmark(transformed_record[bookmark_field])
+                if max_bookmark_value_dttm is None or bookmark_dttm > max_bookmark_value_dttm:
+                    max_bookmark_value_dttm = bookmark_dttm
+
+                if bookmark_dttm >= records_start_dttm:
                     singer_ops.write_record(
                         req_state.stream_name, transformed_record, utils.now())
                     counter.increment()
@@ -99,17 +135,33 @@ def process_records(result_records,
                     req_state.stream_name, transformed_record, utils.now())
                 counter.increment()
 
+        if max_bookmark_value_dttm is not None:
+            max_bookmark_value = format_bookmark(max_bookmark_value_dttm)
         LOGGER.info('%s: Published %s records, max_bookmark_value: %s', stream_name, counter.value, max_bookmark_value)
         return max_bookmark_value, counter.value
 
 
 def __process_all_records_data_stream(req_state):
-    max_bookmark_value = req_state.last_date
+    is_full_sweep = hybrid.is_hybrid_stream(req_state)
+    if is_full_sweep:
+        # Hybrid full sweep: publish every record (no lookback filter) to reconcile
+        LOGGER.info('%s: Running full sweep', req_state.stream_name)
+        req_state.last_date = req_state.start_date
+        req_state.records_start = req_state.start_date
+
+    max_bookmark_value = req_state.bookmark
 
     record_count = 0
-    records = ilevel.get_all_objects(req_state.stream_name, req_state.client)
+    records = ilevel.get_all_objects(req_state.stream_name, req_state.client,
+                                     fields=req_state.fields)
+
+    if is_full_sweep:
+        hybrid.save_snapshot(req_state.config, req_state.stream_name,
+                             {record.get('Id'): record for record in records})
 
     if len(records) == 0:
+        if is_full_sweep:
+            hybrid.write_full_sweep(req_state)
         return 0
 
     # Process records
@@ -127,26 +179,50 @@ def __process_all_records_data_stream(req_state):
     if req_state.bookmark_field and process_record_count > 0:
         singer_ops.write_bookmark(req_state.state, req_state.stream_name, max_bookmark_value)
 
+    # Incremental runs resume from the date of the sweep
+    if is_full_sweep:
+        singer_ops.write_bookmark(req_state.state, req_state.stream_name,
+                                  format_bookmark(req_state.end_date))
+        hybrid.write_full_sweep(req_state)
+
     return record_count
 
 
-def __process_updated_object_stream_id_set(object_ids, req_state, max_bookmark_value):
+# Hybrid mode for ALL_RECORDS_STREAMS between full sweeps: process updated/deleted ids by date
+#  window, backfilling missing fields from the snapshot of the last sweep.
+def __process_hybrid_incremental_stream(req_state):
+    LOGGER.info('%s: Running hybrid incremental (last full sweep: %s)', req_state.stream_name,
+                hybrid.get_last_full_sweep(req_state.state, req_state.stream_name))
+    req_state.snapshot = hybrid.load_snapshot(req_state.config, req_state.stream_name)
+    record_count = __process_incremental_stream(req_state)
+    hybrid.save_snapshot(req_state.config, req_state.stream_name, req_state.snapshot)
+    return record_count
+
+
+def __process_updated_object_stream_id_set(object_ids, req_state, max_bookmark_value,
+                                           window_end=None):
     update_count = 0
+    if SCOPE.active:
+        object_ids = SCOPE.filter_ids(req_state.stream_name, object_ids)
 
     if object_ids is None or object_ids == []:
         return max_bookmark_value, update_count
 
-    if req_state.stream_name in INCREMENTAL_STREAMS:
-        records = ilevel.get_object_details_by_ids(
-            object_ids, req_state.stream_name, req_state.client)
-
-    else: # Investment Transactions
+    if req_state.stream_name in OTHER_STREAMS: # Investment Transactions
         records = ilevel.get_investment_transaction_details_by_ids(
-            object_ids, req_state.client)
+            object_ids, req_state.client, fields=req_state.fields)
+
+    else:
+        records = ilevel.get_object_details_by_ids(
+            object_ids, req_state.stream_name, req_state.client, fields=req_state.fields)
 
     if len(records) == 0:
         return max_bookmark_value, update_count
 
+    if req_state.snapshot is not None:
+        records = hybrid.backfill_records(records, req_state.snapshot, req_state.bookmark_field,
+                                          window_end)
+
     # Process records
     max_bookmark_value, process_record_count = process_records(
         result_records=records,
@@ -159,19 +235,66 @@ def __process_updated_object_stream_id_set(object_ids, req_state, max_bookmark_v
     return max_bookmark_value, update_count
 
 
-def __process_deleted_object_stream_id_set(object_ids, req_state, max_bookmark_value):
+# Check deleted_records_mode before any stream starts. Tombstones are built from the
+#  GetDeletedObjects ids, which only fill a single key property: streams with a composite key
+#  (currency_rates) still fetch the details of their deleted objects.
+def check_deleted_records_mode(config, stream_names):
+    mode = config.get('deleted_records_mode', 'details')
+    if mode not in DELETED_RECORDS_MODES:
+        raise ValueError('deleted_records_mode must be one of {}, got: {}'.format(
+            ', '.join(DELETED_RECORDS_MODES), mode))
+    if mode == 'tombstone':
+        for stream_name in stream_names:
+            if len(STREAMS.get(stream_name, {}).get('key_properties', [])) > 1:
+                LOGGER.warning('%s: Composite key, deleted records are fetched by id '
+                               '(no tombstones)', stream_name)
+
+
+def uses_tombstones(req_state):
+    return req_state.config.get('deleted_records_mode', 'details') == 'tombstone' \
+        and len(req_state.id_fields) == 1
+
+
+# Minimal records for deleted objects, built straight from the GetDeletedObjects ids: the key
+#  property, the deletion flag (set in process_records) and the window end as bookmark value.
+def __get_tombstone_records(object_ids, req_state, window_end):
+    if len(req_state.id_fields) != 1:
+        raise Exception('{}: Tombstones require a single key property, got: {}'.format(
+            req_state.stream_name, req_state.id_fields))
+    key_field = req_state.id_fields[0]
+    deleted_dttm = window_end.strftime('%Y-%m-%dT%H:%M:%SZ')
+    records = []
+    for object_id in object_ids:
+        record = {key_field: object_id}
+        if req_state.bookmark_field:
+            record[req_state.bookmark_field] = deleted_dttm
+        records.append(record)
+    return records
+
+
+def __process_deleted_object_stream_id_set(object_ids, req_state, max_bookmark_value,
+                                           window_end=None):
     update_count = 0
+    if SCOPE.active:
+        object_ids = SCOPE.filter_ids(req_state.stream_name, object_ids)
 
     if object_ids is None or object_ids == []:
         return max_bookmark_value, update_count
 
-    if req_state.stream_name in INCREMENTAL_STREAMS:
-        records = ilevel.get_object_details_by_ids(
-            object_ids, req_state.stream_name, req_state.client)
+    # deleted_records_mode = tombstone: skip the detail fetch for deleted ids entirely
+    if uses_tombstones(req_state):
+        records = __get_tombstone_records(object_ids, req_state, window_end)
 
-    else:
+    elif req_state.stream_name in OTHER_STREAMS:
         records = ilevel.get_investment_transaction_details_by_ids(
-            object_ids, req_state.client)
+            object_ids, req_state.client, fields=req_state.fields)
+
+    else:
+        records = ilevel.get_object_details_by_ids(
+            object_ids, req_state.stream_name, req_state.client, fields=req_state.fields)
+        if req_state.snapshot is not None:
+            records = hybrid.backfill_records(records, req_state.snapshot,
+                                              req_state.bookmark_field, window_end)
 
     if len(records) == 0:
         return max_bookmark_value, update_count
@@ -192,8 +315,8 @@ def __process_deleted_object_stream_id_set(object_ids, req_state, max_bookmark_v
 def __process_incremental_stream(req_state):
     record_count = 0
     date_chunks = ilevel.get_date_chunks(req_state.last_date, req_state.end_date, MAX_DATE_WINDOW)
-    max_bookmark_value_upd = req_state.last_date
-    max_bookmark_value_del = req_state.last_date
+    max_bookmark_value_upd = req_state.bookmark
+    max_bookmark_value_del = req_state.bookmark
 
     cur_start_date = None
     cur_end_date = None
@@ -207,6 +330,11 @@ def __process_incremental_stream(req_state):
             cur_end_date = date_chunks[1]
             cur_date_range_index = 2
         else:
+            # Safe point: all ids up to the end of the previous window have been processed
+            if BUDGET.stop_at_safe_point(req_state.stream_name):
+                singer_ops.write_bookmark(req_state.state, req_state.stream_name,
+                                          max_bookmark(req_state.bookmark, cur_end_date))
+                break
             cur_start_date = cur_end_date
             cur_end_date = date_chunks[cur_date_range_index]
             cur_date_range_index = cur_date_range_index + 1
@@ -232,7 +360,8 @@ def __process_incremental_stream(req_state):
                     __process_updated_object_stream_id_set(
                         object_ids=list(id_set),
                         req_state=req_state,
-                        max_bookmark_value=max_bookmark_value_upd)
+                        max_bookmark_value=max_bookmark_value_upd,
+                        window_end=cur_end_date)
 
                 record_count = record_count + updated_record_count
                 if updated_record_count > 0:
@@ -253,7 +382,8 @@ def __process_incremental_stream(req_state):
                     __process_deleted_object_stream_id_set(
                         object_ids=list(id_set),
                         req_state=req_state,
-                        max_bookmark_value=max_bookmark_value_del)
+                        max_bookmark_value=max_bookmark_value_del,
+                        window_end=cur_end_date)
 
                 record_count = record_count + deleted_record_count
                 if deleted_record_count > 0:
@@ -261,12 +391,16 @@ def __process_incremental_stream(req_state):
 
                 cur_id_set_index = cur_id_set_index + 1
 
-        # Get max_bookmark_value from update (_1) and delete (_2)
-        max_bookmark_value = max(req_state.start_date, req_state.last_date, \
-            max_bookmark_value_upd, max_bookmark_value_del)
-        max_bookmark_value_dttm = datetime.strptime(max_bookmark_value, "%Y-%m-%d")
-        if max_bookmark_value_dttm > cur_end_date:
-            max_bookmark_value = cur_end_date.strftime("%Y-%m-%d")
+        # Get max_bookmark_value from update (_1) and delete (_2), capped at the window end but
+        #  never before the previous high water mark (lookback windows end before it)
+        max_bookmark_value = max_bookmark(max_bookmark_value_upd, max_bookmark_value_del)
+        if parse_bookmark(max_bookmark_value) > cur_end_date:
+            max_bookmark_value = max_bookmark(req_state.bookmark, cur_end_date)
+
+        # Hybrid streams: the id calls cover the whole window, so the window end is the bookmark
+        if req_state.snapshot is not None:
+            max_bookmark_value = max_bookmark(req_state.bookmark, cur_end_date)
+            update_bookmark = True
 
         # Data not sorted
         # Update the state with the max_bookmark_value for the stream after ALL records
@@ -282,6 +416,11 @@ def __process_incremental_stream(req_state):
 def process_iget_batch_for_standardized_id_set(std_id_set, req_state, max_bookmark_value=None):
     update_count = 0
 
+    if CONVERSION.enabled:
+        reply = ilevel.perform_igetbatch_operation_for_standardized_id_set(
+            std_id_set, req_state, raw_reply=True)
+        return __process_converted_reply(reply, req_state, max_bookmark_value)
+
     #Retrieve additional details for id criteria.
     std_data_results = ilevel.perform_igetbatch_operation_for_standardized_id_set(
         std_id_set, req_state)
@@ -298,6 +437,20 @@ def process_iget_batch_for_standardized_id_set(std_id_set, req_state, max_bookma
     return max_bookmark_value, update_count
 
 
+# Publish an iGetBatch reply through the conversion pool: records arrive transformed, in order.
+def __process_converted_reply(reply, req_state, max_bookmark_value, first_entity_only=False):
+    update_count = 0
+    for records in CONVERSION.convert(req_state, reply, first_entity_only):
+        max_bookmark_value, process_record_count = process_records(
+            result_records=records,
+            req_state=req_state,
+            deletion_flag=False,
+            max_bookmark_value=max_bookmark_value,
+            transformed=True)
+        update_count = update_count + process_record_count
+    return max_bookmark_value, update_count
+
+
 # Retrieve periodic data. API docs under 'Migrating iLEVEL Data Changes (Deltas) to a Data
 # Warehouse' (pp 67). Whereas other streams attempt to reflect updates to entities (Assets,
 # Funds, InvestmentTransactions) operations for certain attributes will not be reflected in the
@@ -305,25 +458,38 @@ def process_iget_batch_for_standardized_id_set(std_id_set, req_state, max_bookma
 # timeframe. Additionally, this call will reflect the state of an attribute at a given point in
 # time (period).
 def __process_standardized_data_stream(req_state):
-    max_bookmark_value = req_state.last_date
+    max_bookmark_value = req_state.bookmark
     update_count = 0
 
     #Split date windows: API call restricts date windows based on 30 day periods.
     date_chunks = ilevel.get_date_chunks(req_state.last_date, req_state.end_date, MAX_DATE_WINDOW)
 
+    # Resume inside the window interrupted by the time budget: same window, skipping the batches
+    #  already published (unless the window's ids have changed since)
+    resume = get_resume(req_state.state, req_state.stream_name)
+    if resume:
+        date_chunks = [parse_bookmark(resume['window_start'])] + ilevel.get_date_chunks(
+            resume['window_end'], req_state.end_date, MAX_DATE_WINDOW)
+
     cur_start_date = None
     cur_end_date = None
     cur_date_criteria_length = len(date_chunks)
     cur_date_range_index = 0
     LOGGER.info('Preparing to process %s date chunks', len(date_chunks))
     date_chunk_index = 0
-    while cur_date_range_index < cur_date_criteria_length:
+    stopped = False
+    while cur_date_range_index < cur_date_criteria_length and not stopped:
 
         if cur_start_date is None:
             cur_start_date = date_chunks[0]
             cur_end_date = date_chunks[1]
             cur_date_range_index = 2
         else:
+            # Safe point: the previous window is complete
+            if BUDGET.stop_at_safe_point(req_state.stream_name):
+                singer_ops.write_bookmark(req_state.state, req_state.stream_name,
+                                          max_bookmark(req_state.bookmark, cur_end_date))
+                break
             cur_start_date = cur_end_date
             cur_end_date = date_chunks[cur_date_range_index]
             cur_date_range_index = cur_date_range_index + 1
@@ -334,6 +500,20 @@ def __process_standardized_data_stream(req_state):
         #Get updated records based on date range
         updated_object_id_sets = ilevel.get_standardized_data_id_chunks(
             cur_start_date, cur_end_date, req_state.client)
+
+        id_count = sum(len(id_set) for id_set in updated_object_id_sets)
+        skip_batches = 0
+        if resume:
+            if resume.get('ids') == id_count:
+                skip_batches = resume.get('batches', 0)
+                LOGGER.info('periodic_data_standardized, %s - %s, Resuming after batch #%s',
+                            cur_start_date, cur_end_date, skip_batches)
+            else:
+                LOGGER.info('periodic_data_standardized, %s - %s, Ids changed since the '
+                            'interrupted run, restarting window', cur_start_date, cur_end_date)
+            clear_resume(req_state.state, req_state.stream_name)
+            resume = None
+
         if len(updated_object_id_sets) == 0:
             continue
 
@@ -343,23 +523,36 @@ def __process_standardized_data_stream(req_state):
         #Translate standardized ids to objects
         batch = 1
         for id_set in updated_object_id_sets:
+            if batch <= skip_batches:
+                batch = batch + 1
+                continue
+
+            # Safe point between batches: resume inside this window next run (the bookmark is
+            #  left at the last complete window)
+            if batch > skip_batches + 1 and BUDGET.stop_at_safe_point(req_state.stream_name):
+                write_resume(req_state.state, req_state.stream_name,
+                             window_start=format_bookmark(cur_start_date),
+                             window_end=format_bookmark(cur_end_date),
+                             batches=batch - 1, ids=id_count)
+                stopped = True
+                break
+
             processed_record_count = 0
             temp_max_bookmark_value, processed_record_count = process_iget_batch_for_standardized_id_set(
                 id_set, req_state)
-            temp_max_bookmark_value_dttm = datetime.strptime(temp_max_bookmark_value, "%Y-%m-%d")
-            max_bookmark_value_dttm = datetime.strptime(max_bookmark_value, "%Y-%m-%d")
-            if temp_max_bookmark_value_dttm > max_bookmark_value_dttm:
-                max_bookmark_value = temp_max_bookmark_value
+            max_bookmark_value = max_bookmark(max_bookmark_value, temp_max_bookmark_value)
 
             LOGGER.info('periodic_data_standardized, %s - %s, Batch #%s, Requests: %s, Results: %s',
                         cur_start_date, cur_end_date, batch, len(id_set), processed_record_count)
             update_count = update_count + processed_record_count
             batch = batch + 1
 
+        if stopped:
+            break
+
         # Some reported_date_value (bookmark) are in the future?
-        max_bookmark_value_dttm = datetime.strptime(max_bookmark_value, "%Y-%m-%d")
-        if max_bookmark_value_dttm > cur_end_date:
-            max_bookmark_value = cur_end_date.strftime("%Y-%m-%d")
+        if parse_bookmark(max_bookmark_value) > cur_end_date:
+            max_bookmark_value = max_bookmark(req_state.bookmark, cur_end_date)
 
         date_chunk_index = date_chunk_index + 1
 
@@ -371,12 +564,25 @@ def __process_standardized_data_stream(req_state):
     return update_count
 
 
-def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_code='USD'): # pylint: disable=too-many-statements
+# Fingerprint of the calculated data requests: their window (the period offsets run from each
+#  entity's start to end_date), period types, data items, entities and variants.
+def get_calc_plan_key(req_state, period_types, calc_data_items, entity_objs, variants):
+    plan = [req_state.last_date, format_bookmark(req_state.end_date), period_types,
+            [item.Id for item in calc_data_items],
+            [(entity.Id, str(entity.InitialPeriod)) for entity in entity_objs],
+            variants]
+    return hashlib.sha1(json.dumps(plan, default=str).encode('utf-8')).hexdigest()
+
+
+# Calculated data for each configured scenario and currency (calc_scenarios, calc_currencies): the
+#  data items, assets and periods are planned once, and the requests of all the scenario/currency
+#  variants are packed into the same iGetBatch calls.
+def __process_periodic_data_calcs(req_state): # pylint: disable=too-many-statements
     entity_types = ['assets'] # Currently: assets only (not funds)
     period_types = req_state.period_types.strip().replace(' ', '').split(',')
-    batch_size = 10000
+    batch_size = CALC_BATCH_SIZE
     end_dttm = req_state.end_date
-    max_bookmark_value = req_state.last_date
+    max_bookmark_value = req_state.bookmark
 
     # Init params_list and results
     i_get_params_list = req_state.client.factory.create('ArrayOfBaseRequestParameters')
@@ -388,10 +594,18 @@ def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_co
     # Base objects
     data_value_types = req_state.client.factory.create('DataValueTypes')
 
-    # scenario_id for scenario_name
-    scenarios = req_state.client.service.GetScenarios()
-    scenario = [i for i in scenarios.NamedEntity if i.Name == scenario_name][0]
-    scenario_id = scenario.Id
+    # scenario_id for each scenario name, in variants of (scenario_id, currency_code)
+    scenarios = REFERENCES.call(req_state.client, 'GetScenarios')
+    scenario_ids = {i.Name: i.Id for i in scenarios.NamedEntity}
+    variants = []
+    for scenario_name in tap_config.get_list(req_state.config, 'calc_scenarios',
+                                             DEFAULT_CALC_SCENARIOS):
+        if scenario_name not in scenario_ids:
+            raise Exception('calc_scenarios: Unknown scenario {}'.format(scenario_name))
+        for currency_code in tap_config.get_list(req_state.config, 'calc_currencies',
+                                                 DEFAULT_CALC_CURRENCIES):
+            variants.append((scenario_ids[scenario_name], currency_code))
+    variants_len = len(variants)
 
     # current_date
     date_types = req_state.client.factory.create('DateTypes')
@@ -405,30 +619,48 @@ def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_co
     # Get all calc data items
     data_item_search_criteria = req_state.client.factory.create('DataItemsSearchCriteria')
     data_item_search_criteria.GetGlobalDataItemsOnly = True # Global Data Items ONLY
-    data_items = req_state.client.service.GetDataItems(data_item_search_criteria)
-    calc_data_items = [i for i in data_items.DataItemObjectEx if i.FormulaTypeIDsString] # TESTING (add): and 'Gross Margin' in i.Name
+    data_items = REFERENCES.call(req_state.client, 'GetDataItems', data_item_search_criteria)
+    calc_data_items = [i for i in data_items.DataItemObjectEx if i.FormulaTypeIDsString]
+    # Only the data items in scope (scope_data_items)
+    if 'data_items' in SCOPE.ids:
+        calc_data_items = [i for i in calc_data_items if i.Id in SCOPE.ids['data_items']]
     calc_data_items_len = len(calc_data_items)
 
+    # Resume after the batches published by a run interrupted by the time budget: the requests
+    #  are rebuilt in the same order, so batches line up while the plan (see get_calc_plan_key)
+    #  is the same
+    resume = get_resume(req_state.state, req_state.stream_name)
+    skip_batches = 0
+
     # entity_type loop
     for entity_type in entity_types: # funds, assets pylint: disable=too-many-nested-blocks
-        LOGGER.info('entity_type = %s', entity_type) # COMMENT OUT
+        HOT_LOGGER.debug('periodic_data_calculated.entity_type', entity_type=entity_type)
         # entity_ids for funds_or_assets
         if entity_type == 'funds':
-            entities = req_state.client.service.GetFunds()
+            entities = REFERENCES.call(req_state.client, 'GetFunds')
             entity_objs = entities.Fund
-            # entity_objs = [i for i in entity_objs if 'IV, L.P.' in i.ExcelName] # COMMENT OUT
         else: # assets
-            entities = req_state.client.service.GetAssets()
+            entities = REFERENCES.call(req_state.client, 'GetAssets')
             entity_objs = entities.Asset
-            # entity_objs = [i for i in entity_objs if 'Guild Education' in i.Name] # TESTING: COMMENT OUT
+        # Only the entities in scope (scope_entities, scope_funds)
+        if entity_type in SCOPE.ids:
+            entity_objs = [i for i in entity_objs if i.Id in SCOPE.ids[entity_type]]
         entity_objs_len = len(entity_objs)
+        plan_key = get_calc_plan_key(req_state, period_types, calc_data_items, entity_objs,
+                                     variants)
+        if resume and resume.get('plan') == plan_key:
+            skip_batches = resume.get('batches', 0)
+            LOGGER.info('periodic_data_calculated, Resuming after batch #%s', skip_batches)
+        elif resume:
+            LOGGER.info('periodic_data_calculated, Requests changed since the interrupted run, '
+                        'starting over')
 
         # calc_data_items loop
         cdi = 1
         for data_item in calc_data_items:
             data_item_id = data_item.Id
             data_item_name = data_item.Name
-            LOGGER.info('data_item_name = %s (%s)', data_item_name, data_item_id) # COMMENT OUT
+            HOT_LOGGER.debug('periodic_data_calculated.data_item', name=data_item_name, id=data_item_id)
 
             # data_value_type for data_item
             data_value_type_id = data_item.DataValueType
@@ -439,15 +671,14 @@ def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_co
             for entity in entity_objs:
                 entity_dict = ilevel.sobject_to_dict(entity)
                 entity_id = entity_dict.get('Id')
-                # LOGGER.info('entity = {} ({})'.format(entity_name, entity_id)) # COMMENT OUT
                 entity_initial_dttm = datetime.strptime(entity_dict.get('InitialPeriod')[:10], '%Y-%m-%d')
-                start_dttm = datetime.strptime(req_state.last_date, '%Y-%m-%d')
+                start_dttm = parse_bookmark(req_state.last_date)
                 max_dttm = [start_dttm, entity_initial_dttm]
                 # Choose the earliest date for which there is data for an entity
                 start_dttm = max(i for i in max_dttm if i is not None)
 
-                # LOGGER.info('periodic_data_calculated: {}, {}: {} ({})'.format(
-                #     data_item_name, entity_type, entity_name, entity_id)) # COMMENT OUT
+                HOT_LOGGER.debug('periodic_data_calculated.entity', entity_type=entity_type,
+                                 entity_id=entity_id, data_item_id=data_item_id)
                 entity_path = ilevel.create_entity_path(req_state, [entity_id])
 
                 # period_type loop
@@ -458,152 +689,91 @@ def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_co
                     # offset_period loop (0, -1, -2, ...) look-back
                     pd = 0
                     while pd <=  period_diff + 1:
-                        # LOGGER.info('{}: periodic_data_calculated: {}, Period Type: {}, Offset: {}'.format(
-                        #    req_id, data_item_name, period_type, -pd)) # COMMENT OUT
                         offset_period = copy.copy(period)
                         offset_period.IsOffset = True
                         offset_period.Quantity = int(-1 * pd)
 
-                        i_get_params = req_state.client.factory.create('AssetAndFundGetRequestParameters')
-                        i_get_params.RequestIdentifier = req_id
-                        i_get_params.DataValueType = data_value_type
-                        i_get_params.EntitiesPath = entity_path
-                        i_get_params.DataItemId = data_item_id
-                        i_get_params.ScenarioId = scenario_id
-                        i_get_params.Period = period
-                        i_get_params.Offset = offset_period
-                        i_get_params.EndOfPeriod = latest_date
-                        i_get_params.ReportedDate = current_date
-                        i_get_params.CurrencyCode = currency_code
-
-                        i_get_params_list.BaseRequestParameters.append(i_get_params)
-                        # LOGGER.info('i_get_params = {}'.format(i_get_params)) # COMMENT OUT
-
-                        # run iGetBatch
-                        end_of_batches = False
-                        if (pd == (period_diff + 1) and period_type == last_period_type \
-                            and ent == entity_objs_len and cdi == calc_data_items_len and entity_type == 'assets'):
-                            end_of_batches = True
-                            LOGGER.info('xxx END OF BATCHES xxx')
-                        if (req_id % batch_size == 0) or end_of_batches:
-                            LOGGER.info('xxx BATCH: %s xxx', batch)
-                            i_get_count = len(i_get_params_list)
-                            i_get_request = req_state.client.factory.create('DataServiceRequest')
-                            i_get_request.IncludeStandardizedDataInfo = True
-                            i_get_request.IncludeExcelFormula = True
-                            i_get_request.ParametersList = i_get_params_list
-                            # LOGGER.info('i_get_request = {}'.format(i_get_request)) # COMMENT OUT
-
-                            # pylint: disable=unused-variable
-                            metrics_string = ('periodic_data_calculated, iGetBatch #{}: {} requests'.format(
-                                batch, i_get_count))
-                            with metrics.http_request_timer(metrics_string) as timer:
-                                data_values = req_state.client.service.iGetBatch(i_get_request)
-
-                            LOGGER.info('data_values = {}'.format(data_values)) # COMMENT OUT
-
-                            if isinstance(data_values, str):
-                                continue
-
-                            try:
-                                periodic_data_records = data_values.DataValue
-                            except Exception as err:
-                                LOGGER.error('%s', err)
-                                LOGGER.error('data_values dict = %s', ilevel.sobject_to_dict(data_values))
-                                raise err
-
-                            for periodic_data_record in periodic_data_records:
-                                if "Error" in periodic_data_record:
-                                    continue
-
-                                if "NoDataAvailable" in periodic_data_record:
-                                    continue
-
-                                periodic_data_record_dict = ilevel.sobject_to_dict(periodic_data_record)
-                                LOGGER.info('period_data_record_dict = {}'.format(periodic_data_record_dict)) # COMMENT OUT
-
-                                transformed_record = transform_json(periodic_data_record_dict)
-                                LOGGER.info('transformed_record = {}'.format(transformed_record)) # COMMENT OUT
-
-                                if 'value' in transformed_record:
-                                    value = transformed_record.get('value')
-                                    value_string = str(value)
-                                    if type(value) in (int, float):
-                                        value_numeric = float(value)
-                                    else:
-                                        value_numeric = None
-                                    if value == 'No Data Available':
-                                        LOGGER.info('No Data Available, skipping record')
+                        # scenario/currency loop
+                        for var, (scenario_id, currency_code) in enumerate(variants, 1):
+                            i_get_params = req_state.client.factory.create('AssetAndFundGetRequestParameters')
+                            i_get_params.RequestIdentifier = req_id
+                            i_get_params.DataValueType = data_value_type
+                            i_get_params.EntitiesPath = entity_path
+                            i_get_params.DataItemId = data_item_id
+                            i_get_params.ScenarioId = scenario_id
+                            i_get_params.Period = period
+                            i_get_params.Offset = offset_period
+                            i_get_params.EndOfPeriod = latest_date
+                            i_get_params.ReportedDate = current_date
+                            i_get_params.CurrencyCode = currency_code
+
+                            i_get_params_list.BaseRequestParameters.append(i_get_params)
+                            HOT_LOGGER.sample('periodic_data_calculated.i_get_params', i_get_params)
+
+                            # run iGetBatch
+                            end_of_batches = False
+                            if (pd == (period_diff + 1) and period_type == last_period_type \
+                                and ent == entity_objs_len and cdi == calc_data_items_len and entity_type == 'assets' \
+                                and var == variants_len):
+                                end_of_batches = True
+                                HOT_LOGGER.debug('periodic_data_calculated.end_of_batches', batch=batch)
+                            if ((req_id % batch_size == 0) or end_of_batches) and batch <= skip_batches:
+                                # Published by the interrupted run
+                                i_get_params_list = req_state.client.factory.create('ArrayOfBaseRequestParameters')
+                                batch = batch + 1
+                            elif (req_id % batch_size == 0) or end_of_batches:
+                                HOT_LOGGER.info('periodic_data_calculated.batch', batch=batch)
+                                i_get_count = len(i_get_params_list)
+                                i_get_request = ilevel.create_igetbatch_request(
+                                    req_state, i_get_params_list)
+
+                                # pylint: disable=unused-variable
+                                metrics_string = ('periodic_data_calculated, iGetBatch #{}: {} requests'.format(
+                                    batch, i_get_count))
+                                if CONVERSION.enabled:
+                                    with metrics.http_request_timer(metrics_string) as timer:
+                                        reply = ilevel.get_igetbatch_reply_xml(req_state.client, i_get_request)
+                                    max_bookmark_value, process_record_count = __process_converted_reply(
+                                        reply, req_state, max_bookmark_value, first_entity_only=True)
+                                else:
+                                    with metrics.http_request_timer(metrics_string) as timer:
+                                        data_values = req_state.client.service.iGetBatch(i_get_request)
+
+                                    HOT_LOGGER.debug('periodic_data_calculated.igetbatch_reply', batch=batch,
+                                                     reply=LazyStr(ilevel.sobject_to_dict, data_values))
+
+                                    if isinstance(data_values, str):
                                         continue
-                                    sd_parameters = transformed_record.get('sd_parameters', {})
-                                    excel_formula = transformed_record.get('excel_formula')
-                                    currency_code = sd_parameters.get('currency_code')
-                                    data_item_id = sd_parameters.get('data_item_id')
-                                    data_value_type = sd_parameters.get('data_value_type')
-                                    detail_id = sd_parameters.get('detail_id')
-                                    entity_id = next(iter(sd_parameters.get('entities_path', {}).get('path', {}).get('int', [])), None)
-                                    scenario_id = sd_parameters.get('scenario_id')
-                                    period_type = sd_parameters.get('period', {}).get('type')
-                                    end_of_period_value = sd_parameters.get('end_of_period', {}).get('value')
-                                    reported_date_value = sd_parameters.get('reported_date', {}).get('value')
-                                    exchange_rate_type = sd_parameters.get('exchange_rate', {}).get('type')
-                                    request_id = sd_parameters.get('request_identifier')
-                                    standardized_data_id = sd_parameters.get('standardized_data_id')
-
-                                    dimensions = {
-                                        'data_item_id': data_item_id,
-                                        'entity_id': entity_id,
-                                        'scenario_id': scenario_id,
-                                        'period_type': period_type,
-                                        'end_of_period_value': end_of_period_value,
-                                        'currency_code': currency_code,
-                                        'exchange_rate_type': exchange_rate_type,
-                                        'data_value_type': data_value_type
-                                    }
-                                    hash_key = str(hash_data(json.dumps(dimensions, sort_keys=True)))
-
-
-                                    # Primary key dimensions, create md5 hash key
-                                    new_record = {
-                                        'hash_key': hash_key,
-                                        'excel_formula': excel_formula,
-                                        'currency_code': currency_code,
-                                        'data_item_id': data_item_id,
-                                        'data_value_type': data_value_type,
-                                        'detail_id': detail_id,
-                                        'entity_id': entity_id,
-                                        'scenario_id': scenario_id,
-                                        'period_type': period_type,
-                                        'end_of_period_value': end_of_period_value,
-                                        'reported_date_value': reported_date_value,
-                                        'exchange_rate_type': exchange_rate_type,
-                                        'request_id': request_id,
-                                        'standardized_data_id': standardized_data_id,
-                                        'value': value,
-                                        'value_string': value_string,
-                                        'value_numeric': value_numeric
-                                    }
-
-                                    results.append(new_record)
-                                # end for rec in period_data_records
-
-                            # Process batch records
-                            max_bookmark_value, process_record_count = process_records(
-                                result_records=results,
-                                req_state=req_state,
-                                deletion_flag=False,
-                                max_bookmark_value=max_bookmark_value)
-
-                            update_count = update_count + process_record_count
-
-                            # Init new params_list and results
-                            i_get_params_list = req_state.client.factory.create('ArrayOfBaseRequestParameters')
-                            results = []
-
-                            batch = batch + 1
-                            # end iGetBatch
-
-                        req_id = req_id + 1
+
+                                    results.extend(ilevel.get_data_value_rows(
+                                        data_values, 'periodic_data_calculated', first_entity_only=True,
+                                        fx=FX if FX.enabled else None))
+
+                                    # Process batch records
+                                    max_bookmark_value, process_record_count = process_records(
+                                        result_records=results,
+                                        req_state=req_state,
+                                        deletion_flag=False,
+                                        max_bookmark_value=max_bookmark_value)
+
+                                update_count = update_count + process_record_count
+
+                                # Init new params_list and results
+                                i_get_params_list = req_state.client.factory.create('ArrayOfBaseRequestParameters')
+                                results = []
+
+                                # Safe point: the batch is published
+                                if not end_of_batches and BUDGET.stop_at_safe_point(req_state.stream_name):
+                                    write_resume(req_state.state, req_state.stream_name,
+                                                 plan=plan_key, batches=batch)
+                                    return update_count
+
+                                batch = batch + 1
+                                # end iGetBatch
+
+                            req_id = req_id + 1
+                            # end scenario/currency loop
+
                         pd = pd + 1
                         # end offset_period loop
 
@@ -617,11 +787,10 @@ def __process_periodic_data_calcs(req_state, scenario_name='Actual', currency_co
 
         # end entity_type loop
 
-    # Update the state with the max_bookmark_value for the stream after ALL records
-    # Always process past year of calculated data (Subtract 365 days from max_bookmark_value)
-    max_bookmark_dttm = datetime.strptime(max_bookmark_value[:10], "%Y-%m-%d") - timedelta(days=365)
-    max_bookmark_value = max_bookmark_dttm.strftime("%Y-%m-%d")
+    # Update the state with the max_bookmark_value for the stream after ALL records (the past year
+    #  of calculated data is reprocessed through the stream's lookback, see bookmarks.py)
     singer_ops.write_bookmark(req_state.state, req_state.stream_name, max_bookmark_value)
+    clear_resume(req_state.state, req_state.stream_name)
 
     return update_count
 
@@ -634,6 +803,7 @@ def __sync_endpoint(req_state):
     with metrics.job_timer('endpoint_duration'):
 
         LOGGER.info('%s: STARTED Syncing stream', req_state.stream_name)
+        PROFILE.set_stream(req_state.stream_name)
         singer_ops.update_currently_syncing(req_state.state, req_state.stream_name)
 
         # Publish schema to singer
@@ -642,7 +812,10 @@ def __sync_endpoint(req_state):
                     req_state.stream_name, req_state.last_date, req_state.end_date)
 
         if req_state.stream_name in ALL_RECORDS_STREAMS:
-            endpoint_total = __process_all_records_data_stream(req_state)
+            if hybrid.is_hybrid_stream(req_state) and not hybrid.is_full_sweep_due(req_state):
+                endpoint_total = __process_hybrid_incremental_stream(req_state)
+            else:
+                endpoint_total = __process_all_records_data_stream(req_state)
 
         elif req_state.stream_name == 'periodic_data_standardized':
             endpoint_total = __process_standardized_data_stream(req_state)
@@ -651,10 +824,14 @@ def __sync_endpoint(req_state):
             endpoint_total = __process_periodic_data_calcs(req_state)
 
         else:
-            # data_items, investment_transactions
+            # currency_rates, investment_transactions
             endpoint_total = __process_incremental_stream(req_state)
 
-        singer_ops.update_currently_syncing(req_state.state, None)
+        # Close staged batch files (if any) so the stream's records precede its final state
+        singer_ops.close_output_stream(req_state.stream_name)
+        # A stream stopped by the time budget stays currently_syncing, so the next run starts with it
+        if BUDGET.stopped_stream != req_state.stream_name:
+            singer_ops.update_currently_syncing(req_state.state, None)
         LOGGER.info('%s: FINISHED Syncing Stream, total_records: %s',
                     req_state.stream_name, endpoint_total)
 
@@ -663,38 +840,130 @@ def __sync_endpoint(req_state):
     return endpoint_total
 
 
-# Main routine: orchestrates pulling data for selected streams.
-def sync(client, config, catalog, state):
-    start_date = config.get('start_date')[:10]
-    period_types = config.get('period_types', 'FiscalQuarter')
+# Main routine: orchestrates pulling data for selected streams, of each account in multi-account
+#  runs (see accounts.get_accounts).
+#   output_writer: replaces the stdout/batch output (see singer_operations.OUTPUT), e.g. for
+#     api.iter_sync
+def sync(client, config, catalog, state, output_writer=None):
+    configure_logging(config)
+    configure_profile(config, client)
+    profiler = get_stream_profiler(config)
+    singer_ops.set_output_writer(output_writer or get_batch_writer(config))
+    configure_time_budget(config)
+    configure_fx(config)
+    configure_pivot(config)
 
-    # Get selected_streams from catalog, based on state last_stream
-    #   last_stream = Previous currently synced stream, if the load was interrupted
-    last_stream = singer.get_currently_syncing(state)
-    LOGGER.info('last/currently syncing stream: %s', last_stream)
-    selected_streams = []
     selected_streams_by_name = {}
     for stream in catalog.get_selected_streams(state):
-        selected_streams.append(stream.stream)
         selected_streams_by_name[stream.stream] = stream
 
-    LOGGER.info('selected_streams: %s', selected_streams)
+    LOGGER.info('selected_streams: %s', list(selected_streams_by_name))
 
-    if not selected_streams or selected_streams == []:
+    if not selected_streams_by_name:
         return
+    check_deleted_records_mode(config, selected_streams_by_name)
+
+    configure_conversion(config, client)
+    spool = get_spool(config, state)
+    singer_ops.set_spool(spool)
+
+    accounts = get_accounts(config)
+    if accounts:
+        clients = get_account_clients(client, accounts)
+        configs = dict(accounts)
+        for name in get_account_order(accounts, state):
+            if BUDGET.expired():
+                LOGGER.info('Time budget spent (%.0fs elapsed), not starting account: %s',
+                            BUDGET.elapsed(), name)
+                break
+            LOGGER.info('START Syncing account: %s', name)
+            set_currently_syncing_account(state, name)
+            instrument_client(clients[name])
+            singer_ops.set_stream_prefix(configs[name]['stream_prefix'])
+            __sync_account(clients[name], configs[name], catalog, selected_streams_by_name,
+                           get_account_state(state, name), state, profiler)
+            singer_ops.set_stream_prefix(None)
+            if BUDGET.stopped_stream:
+                break
+        else:
+            set_currently_syncing_account(state, None)
+            singer_ops.write_state(state)
+    else:
+        __sync_account(client, config, catalog, selected_streams_by_name, state, state, profiler)
+
+    singer_ops.flush_output()
+    if FX.enabled:
+        FX.save()
+    if spool is not None:
+        spool.close()
+        singer_ops.set_spool(None)
+    CONVERSION.release()
+    PIVOT.close()
+    write_profile(config)
+    LOGGER.info('sync.py: sync complete')
+
+
+# Sync the selected streams of one account (the whole run, unless multi-account).
+#   state: the account's part of root_state (the state emitted)
+def __sync_account(client, config, catalog, selected_streams_by_name, state, root_state,
+                   profiler):
+    start_date = config.get('start_date')[:10]
+    period_types = config.get('period_types', 'FiscalQuarter')
+
+    # Backfill jobs (backfill_job config) keep their state under backfills.<name>, scoped runs
+    #  (scope_* config) their bookmarks under scopes.<scope_name>
+    BACKFILL.configure(config)
+    if BACKFILL.active:
+        state = BACKFILL.get_state(state)
+    job_state = state
+    SCOPE.configure(config)
+    if SCOPE.active:
+        state = SCOPE.get_state(state)
+    singer_ops.set_root_state(root_state if state is not root_state else None)
+    SCOPE.resolve(client)
+
+    # Start with the interrupted stream (if any), then continue in order
+    #   last_stream = Previous currently synced stream, if the load was interrupted
+    last_stream = singer.get_currently_syncing(state)
+    LOGGER.info('last/currently syncing stream: %s', last_stream)
+    stream_names = list(STREAMS)
+    if last_stream in stream_names:
+        index = stream_names.index(last_stream)
+        stream_names = stream_names[index:] + stream_names[:index]
+
+    # Wide (pivoted) stream of each periodic data stream
+    wide_names = {stream_name: wide_name for wide_name, stream_name in WIDE_STREAMS.items()}
 
     # Loop through endpoints in selected_streams
-    for stream_name, endpoint_config in STREAMS.items():
-        if stream_name in selected_streams:
+    for stream_name in stream_names:
+        endpoint_config = STREAMS[stream_name]
+        wide_name = wide_names.get(stream_name)
+        if not BACKFILL.allows(stream_name):
+            continue
+        if stream_name in selected_streams_by_name or wide_name in selected_streams_by_name:
+            if BUDGET.expired():
+                LOGGER.info('Time budget spent (%.0fs elapsed), not starting: %s',
+                            BUDGET.elapsed(), stream_name)
+                break
             LOGGER.info('START Syncing: %s', stream_name)
-            stream = selected_streams_by_name[stream_name]
+            stream = selected_streams_by_name.get(stream_name)
+            if wide_name in selected_streams_by_name:
+                # The wide stream is pivoted from the records of the stream (selected or not)
+                if stream is None:
+                    stream = catalog.get_stream(stream_name)
+                if stream is None:
+                    raise Exception('{} requires {} in the catalog'.format(wide_name, stream_name))
+                PIVOT.start(stream_name, selected_streams_by_name[wide_name],
+                            singer_ops.get_output_name(wide_name),
+                            emit_rows=stream_name in selected_streams_by_name)
 
             bookmark_field = next(iter(endpoint_config.get('replication_keys', [])), None)
             id_fields = endpoint_config.get('key_properties')
             singer_ops.write_schema(catalog, stream_name)
             total_records = 0
 
-            last_date = singer_ops.get_bookmark(state, stream_name, start_date)
+            bookmark = singer_ops.get_bookmark(state, stream_name, start_date)
+            last_date = get_window_start(config, stream_name, bookmark, start_date)
 
             #Request is made using currrent ddate + 1 as the end period.
             req_state = singer_ops.get_request_state(
@@ -702,19 +971,37 @@ def sync(client, config, catalog, state):
                 stream_name=stream_name,
                 start_date=start_date,
                 last_date=last_date,
-                end_date=datetime.now(),
+                end_date=BACKFILL.get_end_date(),
                 state=state,
                 bookmark_field=bookmark_field,
                 id_fields=id_fields,
                 period_types=period_types,
                 stream=stream,
-                catalog=catalog)
+                catalog=catalog,
+                config=config,
+                bookmark=bookmark,
+                records_start=get_records_start(config, stream_name, last_date, start_date))
+            # Keep the fields the scope filters on, and those pivoted
+            if req_state.fields is not None:
+                req_state.fields = req_state.fields | SCOPE.get_fields(stream_name)
+                if PIVOT.handles(stream_name):
+                    req_state.fields = req_state.fields | PIVOT_FIELDS
 
             # Main sync routine
-            total_records = __sync_endpoint(req_state)
+            if profiler is not None:
+                with profiler.profile(config.get('stream_prefix', '') + stream_name):
+                    total_records = __sync_endpoint(req_state)
+            else:
+                total_records = __sync_endpoint(req_state)
+            PIVOT.finish(stream_name)
+            if BACKFILL.active and BUDGET.stopped_stream != stream_name:
+                BACKFILL.complete(job_state)
+                singer_ops.write_state(job_state)
 
             LOGGER.info('FINISHED Syncing: %s, total_records: %s',
                         stream_name,
                         total_records)
+            if BUDGET.stopped_stream:
+                break
 
-    LOGGER.info('sync.py: sync complete')
+    singer_ops.set_root_state(None)
@@ -0,0 +1,74 @@
+import time
+
+import singer
+
+from tap_ilevel import config as tap_config
+import tap_ilevel.singer_operations as singer_ops
+
+LOGGER = singer.get_logger()
+
+
+# Run time budget (max_runtime_seconds). The sync loops check expired() at their safe points
+#  (between date windows and batches); once it has expired the current stream stops there,
+#  records where to resume (see write_resume) and no further streams are started. The next run
+#  starts with the interrupted stream (currently_syncing). cancel() ends the budget early (e.g.
+#  daemon shutdown).
+class TimeBudget:
+    def __init__(self):
+        self.max_seconds = None
+        self.started = None
+        self.stopped_stream = None
+        self.cancelled = False
+
+    def reset(self, max_seconds):
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.stopped_stream = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started is not None else 0
+
+    def expired(self):
+        return self.cancelled or (bool(self.max_seconds) and self.elapsed() >= self.max_seconds)
+
+    # Check at a safe point: True (and the stream is marked as stopped) when the budget is spent.
+    def stop_at_safe_point(self, stream_name):
+        if not self.expired():
+            return False
+        if self.stopped_stream is None:
+            LOGGER.info('%s: Time budget of %ss spent (%.0fs elapsed), stopping at safe point',
+                        stream_name, self.max_seconds, self.elapsed())
+        self.stopped_stream = stream_name
+        return True
+
+
+BUDGET = TimeBudget()
+
+
+def configure_time_budget(config):
+    BUDGET.reset(tap_config.get_float(config, 'max_runtime_seconds'))
+
+
+# Resume positions inside a stream, kept in state under 'resume' (e.g. the date window and number
+#  of completed batches). Bookmarks alone resume at date window granularity.
+def get_resume(state, stream_name):
+    return (state or {}).get('resume', {}).get(stream_name)
+
+
+def write_resume(state, stream_name, **position):
+    state.setdefault('resume', {})[stream_name] = position
+    LOGGER.info('%s: Resume position: %s', stream_name, position)
+    singer_ops.write_state(state)
+
+
+def clear_resume(state, stream_name):
+    resume = (state or {}).get('resume', {})
+    if stream_name in resume:
+        del resume[stream_name]
+        if not resume:
+            del state['resume']
+        singer_ops.write_state(state)
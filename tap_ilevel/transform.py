@@ -1,5 +1,8 @@
+import functools
 import hashlib
+import json
 import humps
+from singer import metadata
 
 
 #  camelCase to snake_case for fieldname keys
@@ -8,9 +11,88 @@ def transform_json(records):
     return transformed_json
 
 
+# Snake_case name of a SOAP field (e.g. LastModifiedDate -> last_modified_date), as
+#  transform_json would name it.
+@functools.lru_cache(maxsize=None)
+def decamelize_key(field):
+    return humps.decamelize(field)
+
+
+# Top level fields of a stream that singer's Transformer would keep: in the schema, and selected
+#  (or automatic) and supported in the catalog metadata. None when all schema fields are kept.
+#  Used to skip converting deselected fields (see ilevel_api.sobject_to_dict).
+def get_selected_fields(stream):
+    properties = stream.schema.to_dict().get('properties') or {}
+    stream_metadata = metadata.to_map(stream.metadata)
+    fields = set()
+    for field in properties:
+        breadcrumb = ('properties', field)
+        inclusion = metadata.get(stream_metadata, breadcrumb, 'inclusion')
+        if inclusion == 'automatic' or (
+                inclusion != 'unsupported' and
+                metadata.get(stream_metadata, breadcrumb, 'selected') is not False):
+            fields.add(field)
+    if len(fields) == len(properties):
+        return None
+    return frozenset(fields)
+
+
 # Create MD5 hash key for data element
 def hash_data(data):
     # Prepare the project id hash
     hash_id = hashlib.md5()
     hash_id.update(repr(data).encode('utf-8'))
     return hash_id.hexdigest()
+
+
+# Key (hash_key) of a periodic data row: md5 of its primary key dimensions.
+def periodic_hash_key(data_item_id, entity_id, scenario_id, period_type, end_of_period_value,
+                      currency_code, exchange_rate_type, data_value_type):
+    dimensions = {
+        'data_item_id': data_item_id,
+        'entity_id': entity_id,
+        'scenario_id': scenario_id,
+        'period_type': period_type,
+        'end_of_period_value': end_of_period_value,
+        'currency_code': currency_code,
+        'exchange_rate_type': exchange_rate_type,
+        'data_value_type': data_value_type
+    }
+    return str(hash_data(json.dumps(dimensions, sort_keys=True)))
+
+
+# Field order of a periodic data row (periodic_data_standardized, periodic_data_calculated).
+PERIODIC_DATA_FIELDS = (
+    'hash_key',
+    'excel_formula',
+    'currency_code',
+    'data_item_id',
+    'data_value_type',
+    'detail_id',
+    'entity_id',
+    'scenario_id',
+    'period_type',
+    'end_of_period_value',
+    'reported_date_value',
+    'exchange_rate_type',
+    'request_id',
+    'standardized_data_id',
+    'value',
+    'value_string',
+    'value_numeric'
+)
+
+
+# Compact representation of a single periodic data value. Rows are held in batches of 10,000+
+#  between the iGetBatch reply and publishing, so they use __slots__ instead of a per-row dict;
+#  field names are already snake_case and are only expanded into a dict by to_dict() when the
+#  record is published.
+class PeriodicDataRow:
+    __slots__ = PERIODIC_DATA_FIELDS
+
+    def __init__(self, **values):
+        for field in PERIODIC_DATA_FIELDS:
+            setattr(self, field, values.get(field))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in PERIODIC_DATA_FIELDS}
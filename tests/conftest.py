@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks import mock_server
+
+
+# Local mock iLevel DataService (see benchmarks.mock_server) with a small synthetic tenant, for
+#  tests syncing through the SOAP client.
+@pytest.fixture(name='ilevel_server', scope='session')
+def fixture_ilevel_server():
+    tenant = mock_server.SyntheticTenant(assets=4, funds=2, securities=2, investments=2,
+                                         data_items=6, calc_data_items=3, transactions=20,
+                                         data_points=200, history_days=30)
+    server = mock_server.MockILevelServer(tenant).start()
+    yield server
+    server.stop()
+
+
+# Tap config for the mock server, syncing its history.
+@pytest.fixture(name='ilevel_config')
+def fixture_ilevel_config(ilevel_server):
+    return {
+        'username': 'test',
+        'password': 'test',
+        'start_date': (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d'),
+        'period_types': 'FiscalQuarter',
+        'service_url': ilevel_server.url
+    }
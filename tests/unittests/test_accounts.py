@@ -0,0 +1,21 @@
+from tap_ilevel import get_client, get_security
+from tap_ilevel.accounts import clone_client
+
+
+def test_clone_client(ilevel_config):
+    client = get_client(ilevel_config)
+    clone = clone_client(client)
+    # The parsed WSDL and the plugins are shared, the options and transport are not
+    assert clone.wsdl is client.wsdl and clone.factory is client.factory
+    assert clone.options.plugins == client.options.plugins
+    assert clone.options.location == client.options.location
+    assert clone.options.transport is not client.options.transport
+
+    security = get_security(dict(ilevel_config, username='other'))
+    clone.set_options(wsse=security, nosend=True)
+    assert client.options.wsse is not security
+    assert not client.options.nosend
+
+    # Both still call the service
+    assert clone.service.GetFunds().envelope
+    assert len(client.service.GetFunds().Fund) == 2
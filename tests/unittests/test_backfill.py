@@ -0,0 +1,81 @@
+import json
+
+from tap_ilevel.backfill import split_backfill, write_backfill_jobs, merge_backfill_states
+
+CONFIG = {'start_date': '2021-01-01T00:00:00Z'}
+
+
+def job_state(job, completed=True):
+    return {'backfills': {job['name']: {'job': job, 'completed': completed}}}
+
+
+def test_split_covers_the_range_without_gaps():
+    jobs = split_backfill(CONFIG, ['investment_transactions'], 3, '2021-03-01')
+    assert [job['name'] for job in jobs] == ['investment_transactions-001',
+                                             'investment_transactions-002',
+                                             'investment_transactions-003']
+    assert jobs[0]['start_date'] == '2021-01-01T00:00:00.000000Z'
+    assert jobs[-1]['end_date'] == '2021-03-01T00:00:00.000000Z'
+    for previous, job in zip(jobs, jobs[1:]):
+        assert job['start_date'] == previous['end_date']
+    # Jobs are whole date windows (14 days), except for the last one
+    assert jobs[0]['end_date'] == '2021-01-15T00:00:00.000000Z'
+
+
+def test_split_job_count_bounded_by_windows():
+    # 20 days: two date windows
+    jobs = split_backfill(CONFIG, ['currency_rates'], 10, '2021-01-21')
+    assert len(jobs) == 2
+    assert split_backfill(CONFIG, ['currency_rates'], 0, '2021-01-21')[0]['end_date'] == \
+        '2021-01-21T00:00:00.000000Z'
+
+
+def test_split_skips_streams_not_extracted_by_window():
+    jobs = split_backfill(CONFIG, ['assets', 'currency_rates'], 2, '2021-03-01')
+    assert {job['stream'] for job in jobs} == {'currency_rates'}
+
+
+def test_write_backfill_jobs(tmp_path):
+    config = dict(CONFIG, backfill_dir=str(tmp_path), backfill_end_date='2021-03-01')
+    jobs = write_backfill_jobs(config, ['currency_rates'], 2)
+    assert len(jobs) == 2
+    with open(jobs[1]['config']) as file:
+        job_config = json.load(file)
+    assert job_config['backfill_job']['name'] == 'currency_rates-002'
+    assert job_config['start_date'] == jobs[1]['start_date']
+
+
+def test_merge_contiguous_completed_jobs():
+    jobs = split_backfill(CONFIG, ['investment_transactions'], 3, '2021-03-01')
+    merged = merge_backfill_states([job_state(job) for job in reversed(jobs)])
+    assert merged == {'bookmarks': {'investment_transactions': '2021-03-01T00:00:00.000000Z'}}
+
+
+def test_merge_stops_at_incomplete_job():
+    jobs = split_backfill(CONFIG, ['investment_transactions'], 3, '2021-03-01')
+    states = [job_state(jobs[0]), job_state(jobs[1], completed=False), job_state(jobs[2])]
+    merged = merge_backfill_states(states)
+    assert merged['bookmarks']['investment_transactions'] == jobs[0]['end_date']
+
+
+def test_merge_stops_at_gap():
+    jobs = split_backfill(CONFIG, ['investment_transactions'], 3, '2021-03-01')
+    merged = merge_backfill_states([job_state(jobs[0]), job_state(jobs[2])])
+    assert merged['bookmarks']['investment_transactions'] == jobs[0]['end_date']
+    # Nothing merged when the first job is missing
+    assert merge_backfill_states([job_state(jobs[1])]) == {}
+
+
+def test_merge_keeps_later_base_bookmarks():
+    jobs = split_backfill(CONFIG, ['currency_rates'], 1, '2021-03-01')
+    base = {'bookmarks': {'currency_rates': '2021-06-01T00:00:00.000000Z', 'assets': '2021-01-01'},
+            'currently_syncing': None}
+    merged = merge_backfill_states([job_state(job) for job in jobs], base)
+    assert merged['bookmarks'] == base['bookmarks']
+    assert merged is not base
+
+
+def test_merge_per_account():
+    job = split_backfill(CONFIG, ['currency_rates'], 1, '2021-03-01')[0]
+    merged = merge_backfill_states([{'accounts': {'eu': job_state(job)}}])
+    assert merged['accounts']['eu']['bookmarks'] == {'currency_rates': job['end_date']}
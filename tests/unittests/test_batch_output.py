@@ -0,0 +1,57 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import tap_ilevel.singer_operations as singer_ops
+from tap_ilevel.batch_output import get_batch_writer, EXTRACTED_AT_FIELD
+
+
+def test_batch_streams_of_each_account(tmp_path, capsys):
+    writer = get_batch_writer({
+        'output_mode': 'batch', 'batch_staging_dir': str(tmp_path), 'batch_streams': 'funds',
+        'accounts': [{'name': 'east'}, {'name': 'west', 'stream_prefix': 'w_'}]})
+    assert writer.handles('east_funds') and writer.handles('w_funds')
+    assert not writer.handles('funds') and not writer.handles('east_assets')
+
+    singer_ops.set_output_writer(writer)
+    singer_ops.set_stream_prefix('east_')
+    try:
+        singer_ops.write_record('funds', {'id': 1}, None)
+        singer_ops.write_record('assets', {'id': 2}, None)
+        singer_ops.close_output_stream('funds')
+        singer_ops.close_output_stream('assets')
+    finally:
+        singer_ops.set_stream_prefix(None)
+        singer_ops.set_output_writer(None)
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(message['type'], message['stream']) for message in messages] == \
+        [('RECORD', 'east_assets'), ('BATCH', 'east_funds')]
+    assert messages[1]['manifest'][0].startswith('file://{}/east_funds-'.format(tmp_path))
+
+
+@pytest.mark.parametrize('batch_format', ['jsonl', 'parquet'])
+def test_batch_records_keep_time_extracted(tmp_path, capsys, batch_format):
+    if batch_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    writer = get_batch_writer({'output_mode': 'batch', 'batch_staging_dir': str(tmp_path),
+                               'batch_format': batch_format})
+    schema = {'type': 'object', 'properties': {'id': {'type': 'integer'}}}
+    writer.write_schema('funds', schema, ['id'])
+    writer.write_record('funds', {'id': 1}, datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc))
+    writer.write_record('funds', {'id': 2}, None)
+    writer.flush()
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert messages[0]['schema']['properties'][EXTRACTED_AT_FIELD]['format'] == 'date-time'
+    path = messages[1]['manifest'][0][len('file://'):]
+    if batch_format == 'jsonl':
+        with gzip.open(path, 'rt') as file:
+            records = [json.loads(line) for line in file]
+    else:
+        import pyarrow.parquet # pylint: disable=import-outside-toplevel
+        records = pyarrow.parquet.read_table(path).to_pylist()
+    assert records == [{'id': 1, EXTRACTED_AT_FIELD: '2021-03-04T05:06:07.000000Z'},
+                       {'id': 2, EXTRACTED_AT_FIELD: None}]
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from tap_ilevel.bookmarks import parse_bookmark, format_bookmark, max_bookmark, get_lookback, \
+    get_window_start, get_records_start
+
+
+def test_parse_bookmark_formats():
+    expected = datetime(2021, 3, 4, 5, 6, 7, 890000)
+    assert parse_bookmark('2021-03-04T05:06:07.890000Z') == expected
+    assert parse_bookmark('2021-03-04T05:06:07.89Z') == expected
+    assert parse_bookmark('2021-03-04T07:06:07.890000+02:00') == expected
+    # Date only bookmarks (earlier states, start_date) are read as midnight
+    assert parse_bookmark('2021-03-04') == datetime(2021, 3, 4)
+    assert parse_bookmark(expected) is expected
+    assert parse_bookmark(None) is None
+
+
+def test_format_bookmark_round_trip():
+    assert format_bookmark('2021-03-04') == '2021-03-04T00:00:00.000000Z'
+    assert format_bookmark(datetime(2021, 3, 4, 5, 6, 7, 1)) == '2021-03-04T05:06:07.000001Z'
+    value = '2021-03-04T05:06:07.000001Z'
+    assert format_bookmark(parse_bookmark(value)) == value
+
+
+def test_max_bookmark():
+    assert max_bookmark(None, None) is None
+    assert max_bookmark('2021-03-04', None) == '2021-03-04T00:00:00.000000Z'
+    assert max_bookmark(None, datetime(2021, 3, 4)) == '2021-03-04T00:00:00.000000Z'
+    assert max_bookmark('2021-03-04T00:00:00.000001Z', '2021-03-04') == \
+        '2021-03-04T00:00:00.000001Z'
+
+
+def test_get_lookback_defaults():
+    assert get_lookback({}, 'assets') == timedelta(0)
+    # Standardized data is extracted from its bookmark (see test_get_records_start)
+    assert get_lookback({}, 'periodic_data_standardized') == timedelta(0)
+    assert get_lookback({}, 'periodic_data_calculated') == timedelta(days=365)
+
+
+def test_get_lookback_config():
+    assert get_lookback({'lookback_days': 2}, 'assets') == timedelta(days=2)
+    assert get_lookback({'lookback_days': '0.5'}, 'periodic_data_calculated') == \
+        timedelta(hours=12)
+    by_stream = {'lookback_days': {'assets': 3}}
+    assert get_lookback(by_stream, 'assets') == timedelta(days=3)
+    # Streams not listed keep their default
+    assert get_lookback(by_stream, 'periodic_data_calculated') == timedelta(days=365)
+    assert get_lookback({'lookback_days': '{"funds": 1}'}, 'funds') == timedelta(days=1)
+
+
+def test_get_window_start():
+    config = {'lookback_days': {'assets': 1.5}}
+    assert get_window_start(config, 'assets', '2021-03-04T12:00:00.000000Z', '2020-01-01') == \
+        '2021-03-03T00:00:00.000000Z'
+    assert get_window_start({}, 'funds', '2021-03-04T12:00:00.000000Z', '2020-01-01') == \
+        '2021-03-04T12:00:00.000000Z'
+
+
+def test_get_window_start_not_before_start_date():
+    assert get_window_start({}, 'periodic_data_calculated', '2021-03-04', '2021-01-01') == \
+        '2021-01-01T00:00:00.000000Z'
+
+
+def test_get_records_start():
+    window_start = '2021-03-04T12:00:00.000000Z'
+    assert get_records_start({}, 'periodic_data_standardized', window_start, '2020-01-01') == \
+        '2021-02-18T12:00:00.000000Z'
+    assert get_records_start({}, 'assets', window_start, '2020-01-01') == window_start
+    config = {'record_lookback_days': {'periodic_data_standardized': 0, 'funds': 1}}
+    assert get_records_start(config, 'periodic_data_standardized', window_start,
+                             '2020-01-01') == window_start
+    assert get_records_start(config, 'funds', window_start, '2020-01-01') == \
+        '2021-03-03T12:00:00.000000Z'
+    # Not before start_date
+    assert get_records_start({}, 'periodic_data_standardized', window_start, '2021-03-01') == \
+        '2021-03-01T00:00:00.000000Z'
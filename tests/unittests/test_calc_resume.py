@@ -0,0 +1,70 @@
+import copy
+import importlib
+from datetime import datetime, timedelta
+
+import pytest
+from singer.messages import RecordMessage
+
+from tap_ilevel import get_client
+from tap_ilevel.api import iter_sync, select_streams
+from tap_ilevel.backfill import BACKFILL
+from tap_ilevel.discover import discover
+from tap_ilevel.time_budget import BUDGET
+
+# The module (the package exports its sync function under the same name)
+SYNC_MODULE = importlib.import_module('tap_ilevel.sync')
+STREAM = 'periodic_data_calculated'
+
+
+@pytest.fixture(name='calc_sync')
+def fixture_calc_sync(ilevel_config, monkeypatch):
+    # Several iGetBatch batches for the small mock tenant
+    monkeypatch.setattr(SYNC_MODULE, 'CALC_BATCH_SIZE', 20)
+    client = get_client(ilevel_config)
+    catalog = select_streams(discover(), [STREAM])
+
+    # Sync the stream from state, returning the hash_key of each record published
+    def run(state):
+        return [message.record['hash_key']
+                for message in iter_sync(ilevel_config, catalog, state=state, client=client)
+                if isinstance(message, RecordMessage) and message.stream == STREAM]
+    return run
+
+
+# Run interrupted by the time budget at its first safe point, i.e. after the first batch.
+def interrupted_run(calc_sync, monkeypatch, state):
+    calls = []
+
+    def expired():
+        calls.append(1)
+        # The first check is before the stream starts
+        return len(calls) > 1
+    with monkeypatch.context() as patch:
+        patch.setattr(BUDGET, 'expired', expired)
+        return calc_sync(state)
+
+
+def test_resume_skips_published_batches(calc_sync, monkeypatch):
+    full_run = calc_sync({})
+
+    state = {}
+    first_run = interrupted_run(calc_sync, monkeypatch, state)
+    assert first_run == full_run[:len(first_run)]
+    assert state['resume'][STREAM]['batches'] == 1
+    assert state['currently_syncing'] == STREAM
+
+    resumed_run = calc_sync(state)
+    assert first_run + resumed_run == full_run
+    assert 'resume' not in state
+
+
+def test_resume_starts_over_when_requests_change(calc_sync, monkeypatch):
+    state = {}
+    assert interrupted_run(calc_sync, monkeypatch, state)
+
+    # Resumed on a later day: the period offsets (from end_date) and so the batches differ
+    later = datetime.utcnow() + timedelta(days=200)
+    monkeypatch.setattr(BACKFILL, 'get_end_date', lambda: later)
+    full_run = calc_sync({})
+    resumed_run = calc_sync(copy.deepcopy(state))
+    assert resumed_run == full_run
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from singer import metadata, Transformer
+
+from benchmarks import synthetic
+from tap_ilevel import get_client
+from tap_ilevel import ilevel_api as ilevel
+from tap_ilevel.api import select_streams
+from tap_ilevel.conversion_pool import ConversionPool, DATA_VALUE_START_RE, split_reply
+from tap_ilevel.discover import discover
+
+STREAM = 'periodic_data_standardized'
+
+
+# iGetBatch reply of 10 values (two skipped: an Error and a NoDataAvailable), with every other
+#  top level DataValue and the result element namespace prefixed, as other serializers write them.
+def get_reply():
+    items = synthetic.make_data_values(8, entities_per_value=2)
+    items.insert(3, synthetic.new_object('DataValue', Error='Unknown StandardizedDataId'))
+    items.insert(6, synthetic.new_object('DataValue', NoDataAvailable=True))
+    body = synthetic.envelope('iGetBatchResponse', 'iGetBatchResult', items, 'DataValue')
+    head, *values = body.split('<DataValue>')
+    reply = head
+    for index, value in enumerate(values):
+        if index % 2:
+            reply += '<d:DataValue>' + value.replace('</DataValue>', '</d:DataValue>')
+        else:
+            reply += '<DataValue>' + value
+    reply = reply.replace('<iGetBatchResponse xmlns="{0}">'.format(synthetic.DATA_SERVICE_NS),
+                          '<iGetBatchResponse xmlns="{0}" xmlns:d="{0}">'.format(
+                              synthetic.DATA_SERVICE_NS)) \
+        .replace('<iGetBatchResult ', '<d:iGetBatchResult ') \
+        .replace('</iGetBatchResult>', '</d:iGetBatchResult>')
+    return reply.encode('utf-8')
+
+
+def test_split_reply_chunks_prefixed_values():
+    reply = get_reply()
+    chunks = split_reply(reply, 3)
+    assert [len(DATA_VALUE_START_RE.findall(chunk)) for chunk in chunks] == [3, 3, 3, 1]
+    assert b'<DataValue>' in chunks[0] and b'<d:DataValue>' in chunks[0]
+    assert all(chunk.endswith(b'</d:iGetBatchResult></iGetBatchResponse></s:Body></s:Envelope>')
+               for chunk in chunks)
+    assert split_reply(reply, 10) == [reply]
+
+
+# Records of the conversion workers, over several chunks, match the in process conversion (as
+#  process_records does it) of the whole reply.
+def test_convert_matches_in_process(ilevel_config):
+    client = get_client(ilevel_config)
+    catalog = select_streams(discover(), [STREAM])
+    stream = catalog.get_stream(STREAM)
+    reply = get_reply()
+
+    expected = []
+    data_values = client.service.iGetBatch(__inject={'reply': reply})
+    with Transformer() as transformer:
+        for row in ilevel.get_data_value_rows(data_values, STREAM):
+            record = row.to_dict()
+            record['is_soft_deleted'] = False
+            expected.append(transformer.transform(record, stream.schema.to_dict(),
+                                                  metadata.to_map(stream.metadata)))
+    # A row per entity of the 8 values
+    assert len(expected) == 16
+
+    pool = ConversionPool()
+    pool.start(client, 2, chunk_size=3)
+    try:
+        req_state = SimpleNamespace(catalog=catalog, stream_name=STREAM)
+        chunks = list(pool.convert(req_state, reply))
+    finally:
+        pool.close()
+    assert [len(records) for records in chunks] == [6, 4, 4, 2]
+    assert [record for records in chunks for record in records] == expected
@@ -0,0 +1,63 @@
+import copy
+import importlib
+
+from singer import RecordMessage
+
+from tap_ilevel import daemon
+from tap_ilevel import get_client
+from tap_ilevel.api import QueueWriter, select_streams
+from tap_ilevel.daemon import run_daemon
+from tap_ilevel.discover import discover
+from tap_ilevel.reference_cache import REFERENCES
+
+# The module (the package exports its sync function under the same name)
+SYNC_MODULE = importlib.import_module('tap_ilevel.sync')
+
+TRANSACTIONS = 'investment_transactions'
+CALCULATED = 'periodic_data_calculated'
+
+
+# Two cycles with a warm client: the second starts from the bookmarks the first ended with, and
+#  plans the calculated data from the reference replies of the first.
+def test_daemon_cycles_carry_state_and_references(ilevel_config, monkeypatch):
+    config = dict(ilevel_config, daemon_max_cycles=2, daemon_interval_seconds=0)
+    writer = QueueWriter(queue_size=0)
+    cycles = []
+
+    def sync(**kwargs):
+        cycle = {'state': copy.deepcopy(kwargs['state']), 'window_starts': {}}
+        cycles.append(cycle)
+        SYNC_MODULE.sync(**kwargs)
+        cycle['end_state'] = copy.deepcopy(kwargs['state'])
+        cycle['reference_hits'] = REFERENCES.hits
+        cycle['records'] = {}
+        while not writer.queue.empty():
+            message = writer.queue.get()
+            if isinstance(message, RecordMessage):
+                cycle['records'][message.stream] = cycle['records'].get(message.stream, 0) + 1
+
+    window_start = SYNC_MODULE.get_window_start
+
+    def get_window_start(config, stream_name, bookmark, start_date):
+        cycles[-1]['window_starts'][stream_name] = bookmark
+        return window_start(config, stream_name, bookmark, start_date)
+    monkeypatch.setattr(daemon, 'sync', sync)
+    monkeypatch.setattr(SYNC_MODULE, 'get_window_start', get_window_start)
+
+    hits = REFERENCES.hits
+    run_daemon(get_client(config), config, select_streams(discover(), [TRANSACTIONS, CALCULATED]),
+               {}, output_writer=writer)
+
+    first, second = cycles
+    assert first['window_starts'][TRANSACTIONS] == config['start_date']
+    bookmark = first['end_state']['bookmarks'][TRANSACTIONS]
+    assert second['state']['bookmarks'][TRANSACTIONS] == bookmark
+    assert second['window_starts'][TRANSACTIONS] == bookmark
+    assert first['records'][TRANSACTIONS] > second['records'].get(TRANSACTIONS, 0)
+
+    # Scenarios, data items and entities are fetched once
+    assert first['reference_hits'] == hits
+    assert second['reference_hits'] - hits >= 3
+    assert first['records'][CALCULATED] == second['records'][CALCULATED]
+    # The cache is disabled again once the daemon stops
+    assert not REFERENCES.enabled
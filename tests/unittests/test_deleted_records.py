@@ -0,0 +1,37 @@
+import importlib
+from datetime import datetime
+
+import pytest
+
+import tap_ilevel.singer_operations as singer_ops
+from tap_ilevel.streams import STREAMS
+
+# The module (the package exports its sync function under the same name)
+SYNC_MODULE = importlib.import_module('tap_ilevel.sync')
+TOMBSTONE_CONFIG = {'deleted_records_mode': 'tombstone'}
+
+
+def get_req_state(stream_name, config):
+    return singer_ops.get_request_state(
+        client=None, stream_name=stream_name, start_date='2021-01-01',
+        last_date='2021-01-01T00:00:00.000000Z', end_date=datetime(2021, 3, 4), state={},
+        bookmark_field=next(iter(STREAMS[stream_name].get('replication_keys', [])), None),
+        id_fields=STREAMS[stream_name]['key_properties'], period_types='FiscalQuarter',
+        stream=None, catalog=None, config=config)
+
+
+def test_uses_tombstones():
+    assert SYNC_MODULE.uses_tombstones(get_req_state('investment_transactions', TOMBSTONE_CONFIG))
+    assert not SYNC_MODULE.uses_tombstones(get_req_state('investment_transactions', {}))
+    # The GetDeletedObjects ids do not fill a composite key
+    assert not SYNC_MODULE.uses_tombstones(get_req_state('currency_rates', TOMBSTONE_CONFIG))
+
+
+def test_check_deleted_records_mode(caplog):
+    SYNC_MODULE.check_deleted_records_mode({}, ['currency_rates'])
+    SYNC_MODULE.check_deleted_records_mode(TOMBSTONE_CONFIG, ['investment_transactions'])
+    assert 'Composite key' not in caplog.text
+    SYNC_MODULE.check_deleted_records_mode(TOMBSTONE_CONFIG, ['currency_rates'])
+    assert 'currency_rates: Composite key' in caplog.text
+    with pytest.raises(ValueError):
+        SYNC_MODULE.check_deleted_records_mode({'deleted_records_mode': 'tombstones'}, [])
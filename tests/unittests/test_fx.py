@@ -0,0 +1,37 @@
+from tap_ilevel.fx import FX, configure_fx
+from tap_ilevel.transform import periodic_hash_key, PeriodicDataRow
+
+
+def get_row(currency_code, value):
+    dimensions = dict(data_item_id=1, entity_id=2, scenario_id=3, period_type='FiscalQuarter',
+                      end_of_period_value='2021-03-31T00:00:00Z', exchange_rate_type='Average',
+                      data_value_type='Currency')
+    return PeriodicDataRow(
+        hash_key=periodic_hash_key(currency_code=currency_code, **dimensions),
+        currency_code=currency_code, value=value, value_string=str(value), value_numeric=value,
+        **dimensions)
+
+
+def test_derive_rows_once_per_currency(tmp_path):
+    configure_fx({'fx_currencies': 'EUR, GBP, EUR, USD', 'calc_currencies': 'USD, EUR',
+                  'fx_table_path': str(tmp_path / 'fx_rates.json.gz')})
+    for currency, mid in (('EUR', 0.5), ('GBP', 0.25)):
+        FX.add({'currency_from': 'USD', 'currency_to': currency, 'date': '2021-03-01',
+                'mid': mid})
+
+    rows = [get_row('USD', 100.0)]
+    derived = FX.derive_rows(rows, 'periodic_data_standardized')
+    assert [(row.currency_code, row.value_numeric) for row in derived] == \
+        [('EUR', 50.0), ('GBP', 25.0)]
+
+    # EUR is requested from iGetBatch (calc_currencies), so its rows are already in the reply
+    rows.append(get_row('EUR', 40.0))
+    derived = FX.derive_rows(rows, 'periodic_data_calculated')
+    assert [row.currency_code for row in derived] == ['GBP']
+    hash_keys = [row.hash_key for row in rows + derived]
+    assert len(set(hash_keys)) == len(hash_keys)
+
+    # The table handed to conversion workers derives the same currencies
+    assert [row.currency_code for row in FX.subset().derive_rows(rows, 'periodic_data_calculated')] \
+        == ['GBP']
+    configure_fx({})
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+from singer.messages import RecordMessage
+
+from benchmarks import mock_server
+from tap_ilevel import get_client
+from tap_ilevel.api import iter_sync, select_streams
+from tap_ilevel.backfill import BACKFILL
+from tap_ilevel.bookmarks import format_bookmark
+from tap_ilevel.discover import discover
+from tap_ilevel.hybrid import load_snapshot
+
+STREAM = 'assets'
+
+
+# Own tenant: the tests update and delete its objects.
+@pytest.fixture(name='hybrid_sync')
+def fixture_hybrid_sync(ilevel_config, tmp_path):
+    tenant = mock_server.SyntheticTenant(assets=4, funds=2, securities=2, investments=2,
+                                         data_items=6, transactions=2, data_points=10,
+                                         history_days=30, deleted_ratio=0)
+    server = mock_server.MockILevelServer(tenant).start()
+    config = dict(ilevel_config, service_url=server.url, hybrid_incremental_streams=[STREAM],
+                  snapshot_dir=str(tmp_path))
+    catalog = select_streams(discover(), [STREAM])
+
+    # Sync the stream from state, returning its records by id
+    def run(state):
+        return {message.record['id']: message.record
+                for message in iter_sync(config, catalog, state=state, client=get_client(config))
+                if isinstance(message, RecordMessage)}
+    run.tenant = tenant
+    run.config = config
+    yield run
+    server.stop()
+
+
+def get_today():
+    return datetime.strptime(datetime.utcnow().strftime('%Y-%m-%d'), '%Y-%m-%d')
+
+
+# Changes an asset an hour into today, after the full sweep's window.
+def update_asset(tenant, asset_id, deleted=False, **values):
+    obj, _, _ = tenant.objects['Asset'][asset_id]
+    modified = get_today() + timedelta(hours=1)
+    for key, value in values.items():
+        setattr(obj, key, value)
+    if 'LastModifiedDate' not in values:
+        obj.LastModifiedDate = modified
+    tenant.objects['Asset'][asset_id] = (obj, modified, modified if deleted else None)
+
+
+def test_sweep_then_incremental(hybrid_sync, monkeypatch):
+    state = {}
+    swept = hybrid_sync(state)
+    assert len(swept) == 4
+    assert state['full_sweeps'][STREAM] == get_today().strftime('%Y-%m-%d')
+    # Incremental runs start from the sweep
+    assert state['bookmarks'][STREAM] == format_bookmark(get_today())
+    assert len(load_snapshot(hybrid_sync.config, STREAM)) == 4
+
+    updated_id, deleted_id = sorted(swept)[:2]
+    update_asset(hybrid_sync.tenant, updated_id, Name='Renamed')
+    update_asset(hybrid_sync.tenant, deleted_id, deleted=True)
+
+    # Two days later: within full_sweep_interval_days, so incremental
+    monkeypatch.setattr(BACKFILL, 'get_end_date', lambda: datetime.utcnow() + timedelta(days=2))
+    records = hybrid_sync(state)
+    assert sorted(records) == [updated_id, deleted_id]
+    assert records[updated_id]['name'] == 'Renamed'
+    assert not records[updated_id]['is_soft_deleted']
+    assert records[deleted_id]['is_soft_deleted']
+    # Fields are kept from the snapshot, and the snapshot is updated
+    assert {key: value for key, value in records[updated_id].items()
+            if key not in ('name', 'last_modified_date')} == \
+        {key: value for key, value in swept[updated_id].items()
+         if key not in ('name', 'last_modified_date')}
+    assert load_snapshot(hybrid_sync.config, STREAM)[updated_id]['Name'] == 'Renamed'
+    assert state['full_sweeps'][STREAM] == get_today().strftime('%Y-%m-%d')
+
+    # A week after the sweep: full sweep again
+    monkeypatch.setattr(BACKFILL, 'get_end_date', lambda: datetime.utcnow() + timedelta(days=7))
+    assert len(hybrid_sync(state)) == 3
+    assert state['full_sweeps'][STREAM] == \
+        (get_today() + timedelta(days=7)).strftime('%Y-%m-%d')
+
+
+def test_detail_without_replication_key(hybrid_sync, monkeypatch):
+    state = {}
+    swept = hybrid_sync(state)
+    asset_id = sorted(swept)[0]
+    update_asset(hybrid_sync.tenant, asset_id, Name='Renamed', LastModifiedDate=None)
+
+    end_date = datetime.utcnow() + timedelta(days=2)
+    monkeypatch.setattr(BACKFILL, 'get_end_date', lambda: end_date)
+    records = hybrid_sync(state)
+    # Not published with the snapshot's (swept) date, which is before the window
+    assert list(records) == [asset_id]
+    assert records[asset_id]['name'] == 'Renamed'
+    assert records[asset_id]['last_modified_date'] == \
+        end_date.strftime('%Y-%m-%dT00:00:00.000000Z')
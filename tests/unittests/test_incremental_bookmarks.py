@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from singer.messages import StateMessage
+
+from tap_ilevel import get_client
+from tap_ilevel.api import iter_sync, select_streams
+from tap_ilevel.bookmarks import format_bookmark, parse_bookmark
+from tap_ilevel.discover import discover
+
+STREAM = 'investment_transactions'
+
+
+# Host clock a day ahead of UTC (as Asia/Tokyo is after 15:00 UTC), whatever the time of day.
+@pytest.fixture(name='clock_ahead_of_utc')
+def fixture_clock_ahead_of_utc(monkeypatch):
+    monkeypatch.setenv('TZ', 'TST-24')
+    time.tzset()
+    assert datetime.now().date() > datetime.utcnow().date()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_lookback_window_does_not_regress_bookmark(ilevel_config):
+    # The lookback windows end before the bookmark
+    config = dict(ilevel_config, lookback_days={STREAM: 20})
+    bookmark = format_bookmark(datetime.utcnow() - timedelta(days=1))
+    state = {'bookmarks': {STREAM: bookmark}}
+    catalog = select_streams(discover(), [STREAM])
+
+    bookmarks = [message.value['bookmarks'][STREAM]
+                 for message in iter_sync(config, catalog, state=state,
+                                          client=get_client(config))
+                 if isinstance(message, StateMessage)]
+    assert bookmarks
+    assert all(parse_bookmark(value) >= parse_bookmark(bookmark) for value in bookmarks)
+
+
+# Window ends are saved as bookmarks by the hybrid full sweep and incremental runs (and at time
+#  budget safe points): they must not be ahead of the UTC timestamps of the records.
+def test_window_end_not_ahead_of_utc(ilevel_config, clock_ahead_of_utc, tmp_path): # pylint: disable=unused-argument
+    config = dict(ilevel_config, hybrid_incremental_streams=['assets'], snapshot_dir=str(tmp_path))
+    stream_names = [STREAM, 'periodic_data_standardized', 'assets']
+    catalog = select_streams(discover(), stream_names)
+    state = {}
+    # A full sweep of assets, then a hybrid incremental run
+    for _ in range(2):
+        for _ in iter_sync(config, catalog, state=state, client=get_client(config)):
+            pass
+        assert sorted(state['bookmarks']) == sorted(stream_names)
+        for bookmark in state['bookmarks'].values():
+            assert parse_bookmark(bookmark) <= datetime.utcnow()
+    assert state['full_sweeps']['assets'] == datetime.utcnow().strftime('%Y-%m-%d')
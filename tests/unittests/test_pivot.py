@@ -0,0 +1,41 @@
+from singer.catalog import CatalogEntry, Schema
+
+from benchmarks import synthetic
+from tap_ilevel.pivot import Pivot, get_wide_schema
+
+STREAM = 'periodic_data_standardized'
+WIDE_STREAM = 'periodic_data_standardized_wide'
+KEY = {'entity_id': 10, 'scenario_id': 1, 'period_type': 'FiscalQuarter',
+       'end_of_period_value': '2021-03-31T00:00:00Z', 'currency_code': 'USD'}
+
+
+def get_wide_stream():
+    data_items = [synthetic.new_object('DataItemObjectEx', Id=1, Name='Revenue', DataValueType=5),
+                  synthetic.new_object('DataItemObjectEx', Id=2, Name='Sector', DataValueType=1)]
+    return CatalogEntry(stream=WIDE_STREAM, tap_stream_id=WIDE_STREAM,
+                        schema=Schema.from_dict(get_wide_schema(data_items)))
+
+
+def get_record(data_item_id, value):
+    return dict(KEY, data_item_id=data_item_id, value=value, value_string=str(value),
+                value_numeric=value if isinstance(value, float) else None)
+
+
+# A wide row updated for one value at a time (as by incremental windows) keeps the columns of
+#  the earlier flushes, also in a later run.
+def test_wide_row_merged_with_stored_columns(tmp_path):
+    pivot = Pivot()
+    pivot.configure(str(tmp_path / 'pivot_store.sqlite'))
+    pivot.start(STREAM, get_wide_stream(), WIDE_STREAM, emit_rows=False)
+    pivot.add(STREAM, get_record(1, 100.0))
+    assert pivot.flush() == [(WIDE_STREAM, dict(KEY, data_item_1=100.0))]
+    assert pivot.flush() == []
+
+    pivot.add(STREAM, get_record(2, 'Software'))
+    assert pivot.flush() == [(WIDE_STREAM, dict(KEY, data_item_1=100.0, data_item_2='Software'))]
+    pivot.close()
+
+    pivot.start(STREAM, get_wide_stream(), WIDE_STREAM, emit_rows=False)
+    pivot.add(STREAM, get_record(1, 120.0))
+    assert pivot.flush() == [(WIDE_STREAM, dict(KEY, data_item_1=120.0, data_item_2='Software'))]
+    pivot.close()
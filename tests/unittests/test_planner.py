@@ -0,0 +1,113 @@
+import copy
+import importlib
+from datetime import datetime, timedelta
+
+from tap_ilevel import get_client
+from tap_ilevel import ilevel_api as ilevel
+from tap_ilevel import planner
+from tap_ilevel.api import iter_sync, select_streams
+from tap_ilevel.backfill import split_backfill
+from tap_ilevel.bookmarks import format_bookmark, parse_bookmark
+from tap_ilevel.constants import MAX_DATE_WINDOW
+from tap_ilevel.discover import discover
+from tap_ilevel.planner import plan_sync
+from tap_ilevel.time_budget import BUDGET
+
+# The module (the package exports its sync function under the same name)
+SYNC_MODULE = importlib.import_module('tap_ilevel.sync')
+
+STANDARDIZED = 'periodic_data_standardized'
+CALCULATED = 'periodic_data_calculated'
+TRANSACTIONS = 'investment_transactions'
+
+
+def get_plan(config, stream_names, state=None):
+    catalog = select_streams(discover(), stream_names)
+    return plan_sync(get_client(config), config, catalog, state or {})['streams']
+
+
+def test_plan_backfill_job(ilevel_config):
+    assert get_plan(ilevel_config, ['assets', STANDARDIZED])[STANDARDIZED]['windows'] == 3
+    # The first of two jobs: the first of the three windows, and only the job's stream
+    job = split_backfill(ilevel_config, [STANDARDIZED], 2)[0]
+    config = dict(ilevel_config, start_date=job['start_date'], backfill_job=job)
+    plan = get_plan(config, ['assets', STANDARDIZED])
+    assert list(plan) == [STANDARDIZED]
+    assert plan[STANDARDIZED]['windows'] == 1
+
+
+def test_plan_standardized_resume(ilevel_config):
+    full_plan = get_plan(ilevel_config, [STANDARDIZED])[STANDARDIZED]
+    # Interrupted after the first batch of the first window
+    today = datetime.strptime(datetime.utcnow().strftime('%Y-%m-%d'), '%Y-%m-%d')
+    window_start, window_end = ilevel.get_date_chunks(
+        ilevel_config['start_date'], today, MAX_DATE_WINDOW)[:2]
+    id_sets = ilevel.get_standardized_data_id_chunks(window_start, window_end,
+                                                     get_client(ilevel_config))
+    resume = {'window_start': format_bookmark(window_start),
+              'window_end': format_bookmark(window_end),
+              'batches': 1, 'ids': sum(len(id_set) for id_set in id_sets)}
+    plan = get_plan(ilevel_config, [STANDARDIZED], {'resume': {STANDARDIZED: resume}})[STANDARDIZED]
+    assert plan['skipped_batches'] == 1
+    assert plan['batches'] == full_plan['batches'] - 1
+    assert plan['records_estimate'] == full_plan['records_estimate'] - len(id_sets[0])
+
+    # The window's ids have changed: nothing is skipped
+    resume['ids'] = resume['ids'] + 1
+    plan = get_plan(ilevel_config, [STANDARDIZED], {'resume': {STANDARDIZED: resume}})[STANDARDIZED]
+    assert plan['skipped_batches'] == 0
+    assert plan['batches'] == full_plan['batches']
+
+
+def test_plan_calculated_resume(ilevel_config, monkeypatch):
+    # Several iGetBatch batches for the small mock tenant
+    monkeypatch.setattr(SYNC_MODULE, 'CALC_BATCH_SIZE', 20)
+    monkeypatch.setattr(planner, 'CALC_BATCH_SIZE', 20)
+    full_plan = get_plan(ilevel_config, [CALCULATED])[CALCULATED]
+    assert full_plan['batches'] > 1
+
+    # Interrupted by the time budget after the first batch
+    calls = []
+
+    def expired():
+        calls.append(1)
+        return len(calls) > 1
+    state = {}
+    with monkeypatch.context() as patch:
+        patch.setattr(BUDGET, 'expired', expired)
+        for _ in iter_sync(ilevel_config, select_streams(discover(), [CALCULATED]), state=state,
+                           client=get_client(ilevel_config)):
+            pass
+    assert state['resume'][CALCULATED]['batches'] == 1
+
+    plan = get_plan(ilevel_config, [CALCULATED], state)[CALCULATED]
+    assert plan['skipped_batches'] == 1
+    assert plan['batches'] == full_plan['batches'] - 1
+
+
+def test_plan_scope(ilevel_config):
+    full_plan = get_plan(ilevel_config, [CALCULATED, TRANSACTIONS])
+    asset_ids = sorted(asset.Id for asset in get_client(ilevel_config).service.GetAssets().Asset)
+    # Regular runs' bookmarks are not the scope's
+    state = {'bookmarks': {TRANSACTIONS: format_bookmark(datetime.utcnow())}}
+    plan = get_plan(dict(ilevel_config, scope_entities=[asset_ids[0]]),
+                    [CALCULATED, TRANSACTIONS], state)
+    assert plan[CALCULATED]['ids']['assets'] == 1
+    assert plan[CALCULATED]['ids']['requests'] * len(asset_ids) == \
+        full_plan[CALCULATED]['ids']['requests']
+    assert plan[TRANSACTIONS]['windows'] == full_plan[TRANSACTIONS]['windows'] == 3
+    assert get_plan(ilevel_config, [TRANSACTIONS], state)[TRANSACTIONS]['windows'] == 1
+
+
+def test_plan_accounts(ilevel_config):
+    config = dict(ilevel_config, accounts=[
+        {'name': 'east', 'username': 'test', 'password': 'test'},
+        {'name': 'west', 'username': 'test', 'password': 'test', 'stream_prefix': 'w_'}])
+    bookmark = format_bookmark(datetime.utcnow() - timedelta(days=1))
+    state = {'accounts': {'east': {'bookmarks': {TRANSACTIONS: bookmark}}}}
+    plan = get_plan(config, [TRANSACTIONS], copy.deepcopy(state))
+    assert sorted(plan) == ['east_investment_transactions', 'w_investment_transactions']
+    assert parse_bookmark(plan['east_investment_transactions']['last_date']) == \
+        parse_bookmark(bookmark)
+    assert plan['east_investment_transactions']['windows'] == 1
+    assert plan['w_investment_transactions']['windows'] == 3
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+from singer import RecordMessage
+
+from benchmarks import mock_server
+from tap_ilevel import get_client
+from tap_ilevel.api import iter_sync, select_streams
+from tap_ilevel.bookmarks import format_bookmark
+from tap_ilevel.discover import discover
+
+STREAMS = ['assets', 'funds', 'fund_to_asset_relations']
+
+
+# Mock server of a tenant with a fund tree: fund 0 holds sub fund 1, each fund holds the asset
+#  of the same index (fund 2 and assets 2, 3 are out of fund 0's tree).
+@pytest.fixture(name='fund_tree_server', scope='module')
+def fixture_fund_tree_server():
+    tenant = mock_server.SyntheticTenant(assets=4, funds=3, securities=1, investments=1,
+                                         data_items=2, calc_data_items=1, transactions=1,
+                                         data_points=10, history_days=30, deleted_ratio=0)
+    asset_ids = tenant.live_ids('Asset')
+    fund_ids = tenant.live_ids('Fund')
+    for type_id, pairs in (('FundToFund', [(fund_ids[0], fund_ids[1])]),
+                           ('FundToAsset', list(zip(fund_ids, asset_ids)))):
+        relations = tenant.objects[type_id]
+        for relation_id in list(relations)[len(pairs):]:
+            del relations[relation_id]
+        for (relation, _, _), (from_id, to_id) in zip(relations.values(), pairs):
+            relation.FromId = from_id
+            relation.ToId = to_id
+    server = mock_server.MockILevelServer(tenant).start()
+    yield server, fund_ids, asset_ids
+    server.stop()
+
+
+def get_records(config, state):
+    records = {}
+    for message in iter_sync(config, select_streams(discover(), STREAMS), state=state,
+                             client=get_client(config)):
+        if isinstance(message, RecordMessage):
+            records.setdefault(message.stream, []).append(message.record)
+    return records
+
+
+def test_scope_funds_expand_to_sub_funds_and_assets(fund_tree_server):
+    server, fund_ids, asset_ids = fund_tree_server
+    config = {
+        'username': 'test',
+        'password': 'test',
+        'start_date': (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d'),
+        'service_url': server.url,
+        'scope_funds': [fund_ids[0]],
+        'scope_name': 'fund_0'
+    }
+    # A regular run's bookmarks, after every change (relations are FULL_TABLE)
+    bookmarks = {stream: format_bookmark(datetime.utcnow()) for stream in ('assets', 'funds')}
+    state = {'bookmarks': dict(bookmarks)}
+
+    records = get_records(config, state)
+    assert sorted(record['id'] for record in records['funds']) == fund_ids[:2]
+    assert sorted(record['id'] for record in records['assets']) == asset_ids[:2]
+    assert sorted((record['from_id'], record['to_id'])
+                  for record in records['fund_to_asset_relations']) == \
+        list(zip(fund_ids[:2], asset_ids[:2]))
+
+    # The scope's state is its own: the regular bookmarks are neither used nor moved
+    assert state['bookmarks'] == bookmarks
+    assert sorted(state['scopes']['fund_0']['bookmarks']) == ['assets', 'funds']
+    assert list(state['scopes']) == ['fund_0']
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+import tap_ilevel.singer_operations as singer_ops
+from tap_ilevel.spool import get_spool, replay_spool, MANIFEST_FILE, SEGMENTS_DIR
+
+SCHEMA = {'type': 'object', 'properties': {'id': {'type': ['null', 'integer']}}}
+
+
+@pytest.fixture(name='spool_config')
+def fixture_spool_config(tmp_path):
+    yield {'spool_dir': str(tmp_path / 'spool')}
+    singer_ops.set_output_writer(None)
+    singer_ops.set_spool(None)
+
+
+def state_after(count):
+    return {'bookmarks': {'assets': count}}
+
+
+# A spooled run: two records per state, three states, then two records without a state.
+def spool_run(config, initial_state=None):
+    spool = get_spool(config, initial_state or {})
+    spool.write_schema('assets', SCHEMA, ['id'])
+    for record_id in range(1, 9):
+        spool.write_record('assets', {'id': record_id})
+        if record_id % 2 == 0 and record_id <= 6:
+            spool.write_state(state_after(record_id))
+    spool.close()
+
+
+def read_messages(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def segment_files(config):
+    return sorted(os.listdir(os.path.join(config['spool_dir'], SEGMENTS_DIR)))
+
+
+def test_spool_segments_and_manifest(spool_config):
+    spool_run(spool_config)
+    assert len(segment_files(spool_config)) == 4
+    with open(os.path.join(spool_config['spool_dir'], MANIFEST_FILE)) as file:
+        entries = [json.loads(line) for line in file]
+    assert [entry['records'] for entry in entries] == [2, 2, 2, 2]
+    assert [entry['bookmark'] for entry in entries] == [2, 4, 6, None]
+    assert entries[-1]['state'] is None
+
+
+def test_replay_after_confirmed_state(spool_config, capsys):
+    spool_run(spool_config)
+    capsys.readouterr()
+    replay_spool(spool_config, state_after(2))
+    messages = read_messages(capsys)
+    assert messages[0]['type'] == 'SCHEMA'
+    records = [message['record']['id'] for message in messages if message['type'] == 'RECORD']
+    assert records == [3, 4, 5, 6, 7, 8]
+    states = [message['value'] for message in messages if message['type'] == 'STATE']
+    assert states == [state_after(4), state_after(6)]
+    # The confirmed segment is pruned
+    assert len(segment_files(spool_config)) == 3
+
+
+def test_replay_prunes_up_to_latest_confirmed_state(spool_config, capsys):
+    spool_run(spool_config)
+    replay_spool(spool_config, state_after(2))
+    replay_spool(spool_config, state_after(6))
+    capsys.readouterr()
+    replay_spool(spool_config, state_after(6))
+    records = [message['record']['id'] for message in read_messages(capsys)
+               if message['type'] == 'RECORD']
+    assert records == [7, 8]
+    assert len(segment_files(spool_config)) == 1
+
+
+def test_replay_unknown_state_replays_everything(spool_config, capsys):
+    spool_run(spool_config)
+    capsys.readouterr()
+    replay_spool(spool_config, {'bookmarks': {'assets': 'unknown'}})
+    records = [message for message in read_messages(capsys) if message['type'] == 'RECORD']
+    assert len(records) == 8
+
+
+def test_new_run_replaces_spool(spool_config):
+    spool_run(spool_config)
+    spool = get_spool(spool_config, state_after(6))
+    spool.close()
+    assert segment_files(spool_config) == []
+
+
+def test_replay_requires_spool(tmp_path):
+    with pytest.raises(Exception, match='--replay-spool'):
+        replay_spool({'spool_dir': str(tmp_path / 'missing')}, {})